@@ -0,0 +1,69 @@
+"""
+Partition the messages table by month and archive old months.
+
+    partition          rebuild messages as a monthly-partitioned table (Postgres, once)
+    ensure-partitions  create the coming months' partitions (the server also does this at startup)
+    archive            move months older than --keep-months into ARCHIVE_DIR files
+
+Usage:
+    python archive_messages.py partition
+    python archive_messages.py ensure-partitions [--months-ahead 3]
+    python archive_messages.py archive [--keep-months 6] [--dry-run] [--archive-dir ./archive]
+"""
+
+import argparse
+
+import message_archive
+import message_partitions
+from database import engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition and archive chat messages")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("partition", help="Convert messages to a monthly-partitioned table (Postgres)")
+    ensure = commands.add_parser("ensure-partitions", help="Create partitions for the coming months")
+    ensure.add_argument("--months-ahead", type=int, default=message_partitions.PARTITION_MONTHS_AHEAD)
+    archive = commands.add_parser("archive", help="Move old months into archive files")
+    archive.add_argument("--keep-months", type=int, default=message_archive.ARCHIVE_AFTER_MONTHS,
+                         help="Months kept in the messages table, not counting the current one")
+    archive.add_argument("--dry-run", action="store_true", help="Report what would be archived without moving it")
+    archive.add_argument("--archive-dir", default=message_archive.ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    if args.command == "partition":
+        print("📅 Partitioning the messages table by month")
+        print("=" * 60)
+        report = message_partitions.convert_to_partitioned(engine)
+        if report["converted"]:
+            print(f"✅ Copied {report['rows']} messages into {report['partitions']} monthly partitions")
+        else:
+            print(f"✅ Already partitioned ({report['partitions']} partitions)")
+
+    elif args.command == "ensure-partitions":
+        print(f"📅 Creating partitions {args.months_ahead} months ahead")
+        print("=" * 60)
+        created = message_partitions.ensure_partitions(engine, args.months_ahead)
+        print(f"✅ Created {len(created)} partitions{': ' + ', '.join(created) if created else ''}")
+
+    else:
+        print(f"🗄️  Archiving messages older than {args.keep_months} months{' (dry run)' if args.dry_run else ''}")
+        print("=" * 60)
+        report = message_archive.archive_old_messages(
+            engine, message_archive.MessageArchive(args.archive_dir), args.keep_months, dry_run=args.dry_run
+        )
+        print(f"📋 Cutoff: {report['cutoff']}")
+        for entry in report["months"]:
+            line = f"   {entry['month']}  {entry['rows']:>10} messages"
+            if entry.get("file"):
+                line += f"  → {entry['file']}"
+            if entry.get("dropped_partition"):
+                line += f"  (dropped {entry['dropped_partition']})"
+            print(line)
+        print(f"✅ {'Would archive' if args.dry_run else 'Archived'} {report['archived_rows']} messages "
+              f"from {len(report['months'])} months in {report['duration_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Garbage collector for orphaned chat attachments.
+
+Files whose messages were deleted for everyone, or whose upload never made
+it into a message, are referenced by nothing and would otherwise stay on
+disk forever. A GC pass:
+
+1. streams every file_url out of the message store (messages.json is read
+   incrementally, the messages table with yield_per) into a compact set of
+   64-bit digests of the live files - a collision can only keep a file
+   alive, never delete a referenced one
+2. walks the blob store and the legacy chat_files layout and deletes files
+   that are not live and older than the grace period, together with their
+   derived previews. The live set is a snapshot, so each blob is checked
+   again right before it goes: a reference added since (blob index refs) or
+   a dedupe hit by an upload (which refreshes the blob's mtime) keeps it
+
+Deletion happens in bounded batches with a pause in between, so a pass never
+holds the disk or the threadpool for long. With dry_run=True nothing is
+deleted and the report lists what would go.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import sharding
+from blob_store import BlobStore, BLOB_NAME_RE
+from json_stream import iter_json_array
+from thumbnails import previews_dir
+
+ATTACHMENT_GC_GRACE_SECONDS = int(os.getenv("ATTACHMENT_GC_GRACE_SECONDS", str(7 * 24 * 60 * 60)))
+# Seconds between background passes; 0 disables the background job
+ATTACHMENT_GC_INTERVAL = int(os.getenv("ATTACHMENT_GC_INTERVAL", str(6 * 60 * 60)))
+ATTACHMENT_GC_BATCH_SIZE = int(os.getenv("ATTACHMENT_GC_BATCH_SIZE", "200"))
+ATTACHMENT_GC_BATCH_PAUSE = float(os.getenv("ATTACHMENT_GC_BATCH_PAUSE", "0.5"))
+REPORT_SAMPLE_SIZE = 50
+
+
+def json_file_urls(messages_file: str) -> Iterator[str]:
+    """file_url of every live message in a messages.json file"""
+    for msg in iter_json_array(messages_file):
+        if msg.get("file_url") and not msg.get("deleted_for_everyone", False):
+            yield msg["file_url"]
+
+
+def db_file_urls(session_factory) -> Iterator[str]:
+    """file_url of every live message in the messages and group_messages tables"""
+    from database import Message, GroupMessage
+
+    db = session_factory()
+    try:
+        for model in (Message, GroupMessage):
+            rows = db.query(model.file_url).filter(
+                model.file_url.isnot(None),
+                model.deleted_for_everyone == False
+            ).yield_per(5000)
+            for file_url, in rows:
+                yield file_url
+    finally:
+        db.close()
+
+
+def _digest(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class AttachmentGC:
+    def __init__(self, blob_store: BlobStore, file_urls: Callable[[], Iterable[str]],
+                 grace_seconds: int = ATTACHMENT_GC_GRACE_SECONDS,
+                 batch_size: int = ATTACHMENT_GC_BATCH_SIZE,
+                 batch_pause: float = ATTACHMENT_GC_BATCH_PAUSE):
+        self.blob_store = blob_store
+        self.file_urls = file_urls
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.last_report: Optional[dict] = None
+
+    def _key_for_name(self, filename: str) -> str:
+        sha256 = self.blob_store.sha_for_name(filename)
+        return f"blob:{sha256}" if sha256 else f"name:{filename}"
+
+    def build_live_set(self) -> set:
+        live = set()
+        for file_url in self.file_urls():
+            filename = self.blob_store.filename_from_url(file_url)
+            if filename:
+                live.add(_digest(self._key_for_name(filename)))
+        return live
+
+    def iter_stored_files(self) -> Iterator[Tuple[str, str, os.DirEntry]]:
+        """(live-set key, kind, DirEntry) for every stored attachment"""
+        blobs_dir = self.blob_store.blobs_dir
+        for _, entry in sharding.iter_files(blobs_dir):
+            # Blobs live at .blobs/<ab>/<cd>/<sha256>; the index files are skipped as flat files
+            if BLOB_NAME_RE.match(entry.name) and os.path.dirname(entry.path) != blobs_dir:
+                yield f"blob:{entry.name}", "blob", entry
+        for _, entry in sharding.iter_files(self.blob_store.tmp_dir):
+            # Uploads abandoned half-way; never referenced by a message
+            yield "", "tmp", entry
+        for _, entry in sharding.iter_files(self.blob_store.chat_files_dir):
+            yield self._key_for_name(entry.name), "legacy", entry
+
+    def passes(self, dry_run: bool = False) -> Iterator[dict]:
+        """
+        Run a GC pass one batch per step: every next() handles at most
+        batch_size orphans and yields the report so far. The final report
+        is also kept in last_report.
+        """
+        started = time.time()
+        report = {
+            "dry_run": dry_run,
+            "grace_seconds": self.grace_seconds,
+            "live_references": 0,
+            "scanned": 0,
+            "orphaned": 0,
+            "deleted": 0,
+            "orphaned_bytes": 0,
+            "skipped_recent": 0,
+            "kept_on_recheck": 0,
+            "batches": 0,
+            "sample": [],
+        }
+        live = self.build_live_set()
+        report["live_references"] = len(live)
+        cutoff = started - self.grace_seconds
+
+        in_batch = 0
+        for key, kind, entry in self.iter_stored_files():
+            report["scanned"] += 1
+            if key and _digest(key) in live:
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_mtime > cutoff:
+                report["skipped_recent"] += 1
+                continue
+            if not dry_run and not self._delete(entry.path, kind, key, cutoff):
+                # Referenced or reused since the live set was built
+                report["kept_on_recheck"] += 1
+                continue
+            report["orphaned"] += 1
+            report["orphaned_bytes"] += st.st_size
+            if len(report["sample"]) < REPORT_SAMPLE_SIZE:
+                report["sample"].append({"path": entry.path, "kind": kind, "size": st.st_size})
+            if not dry_run:
+                report["deleted"] += 1
+            in_batch += 1
+            if in_batch >= self.batch_size:
+                report["batches"] += 1
+                in_batch = 0
+                yield report
+
+        report["batches"] += 1
+        report["duration_seconds"] = round(time.time() - started, 3)
+        self.last_report = report
+        yield report
+
+    def _delete(self, path: str, kind: str, key: str, cutoff: float) -> bool:
+        """
+        Delete an orphan unless it changed since the live set was built: a
+        blob re-referenced by a message or refreshed by a dedupe hit, or a
+        file touched since it was scanned. Returns whether it was deleted.
+        """
+        if kind == "blob":
+            if not self.blob_store.delete_unreferenced(key.split(":", 1)[1], cutoff):
+                return False
+        else:
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        shutil.rmtree(previews_dir(path), ignore_errors=True)
+        return True
+
+    def run(self, dry_run: bool = False) -> dict:
+        """Blocking pass for scripts, pausing between batches"""
+        report = None
+        for report in self.passes(dry_run):
+            time.sleep(self.batch_pause)
+        return report
+
+    async def run_async(self, dry_run: bool = False) -> dict:
+        """Pass for the running server: each batch runs in the threadpool"""
+        steps = self.passes(dry_run)
+        report = None
+        while True:
+            step = await run_in_threadpool(next, steps, None)
+            if step is None:
+                return report
+            report = step
+            await asyncio.sleep(self.batch_pause)
+
+    async def loop(self, interval: int = ATTACHMENT_GC_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                report = await self.run_async()
+                if report["deleted"]:
+                    print(f"🧹 Removed {report['deleted']} orphaned attachments "
+                          f"({report['orphaned_bytes'] / 1024 / 1024:.1f} MB)")
+            except Exception as e:
+                print(f"❌ Attachment GC failed: {e}")
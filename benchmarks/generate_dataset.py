@@ -0,0 +1,347 @@
+"""
+Synthetic dataset generator for scaling tests.
+
+Builds a deterministic (--seed) dataset shaped like real chat history and
+writes it in main.py's JSON format, in the database.py schema, or both:
+
+- usernames user0000000..; every user shares one precomputed scrypt hash of
+  "password123" so generation stays fast and logins still work
+- conversations between pairs of users, with a few popular users taking
+  part in many of them, and Zipf-distributed sizes (--skew): a handful of
+  very long chats and a long tail of short ones
+- messages in timestamp order over --days, with attachments, edits,
+  deletions for one side and deletions for everyone at the given ratios
+- a fraction of users online and a fraction banned
+
+messages.json is written as a stream, so tens of millions of messages never
+sit in memory. A manifest (dataset.json) records the sizes plus sample
+users, conversations and message ids that storage_bench.py uses as inputs.
+
+Usage:
+    python benchmarks/generate_dataset.py --users 100000 --messages 1000000 --out data/100k [--format json|db|both]
+                                          [--database-url sqlite:///data/100k/chatapp.db]
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+PASSWORD = "password123"
+BATCH_SIZE = 10000
+SAMPLE_SIZE = 200
+WORDS = ("hey", "hi", "ok", "sure", "thanks", "lol", "see", "you", "tomorrow", "what", "about",
+         "the", "meeting", "call", "me", "later", "sounds", "good", "where", "are", "now", "?", "!")
+ATTACHMENT_TYPES = (("image", ".jpg"), ("image", ".png"), ("video", ".mp4"), ("file", ".pdf"))
+
+
+def username(i: int) -> str:
+    return f"user{i:07d}"
+
+
+class DatasetSpec:
+    def __init__(self, users: int, messages: int, seed: int = 42, skew: float = 1.1, contacts: float = 5,
+                 days: int = 365, attachment_ratio: float = 0.05, edit_ratio: float = 0.02,
+                 delete_ratio: float = 0.03, delete_everyone_ratio: float = 0.01,
+                 online_ratio: float = 0.05, banned_ratio: float = 0.001):
+        self.users = users
+        self.messages = messages
+        self.seed = seed
+        self.skew = skew
+        self.contacts = contacts
+        self.days = days
+        self.attachment_ratio = attachment_ratio
+        self.edit_ratio = edit_ratio
+        self.delete_ratio = delete_ratio
+        self.delete_everyone_ratio = delete_everyone_ratio
+        self.online_ratio = online_ratio
+        self.banned_ratio = banned_ratio
+        self.end = datetime(2026, 1, 1)
+        self.start = self.end - timedelta(days=days)
+        self._conversations = None
+
+    # ----- users -----
+
+    def banned(self) -> list:
+        rng = random.Random(self.seed + 1)
+        count = int(self.users * self.banned_ratio)
+        return sorted(username(i) for i in rng.sample(range(self.users), count))
+
+    def online(self) -> list:
+        rng = random.Random(self.seed + 2)
+        count = int(self.users * self.online_ratio)
+        return sorted(username(i) for i in rng.sample(range(self.users), count))
+
+    def iter_users(self):
+        """(username, created_at) in signup order"""
+        span = (self.end - self.start).total_seconds()
+        for i in range(self.users):
+            yield username(i), self.start + timedelta(seconds=span * i / max(1, self.users) * 0.5)
+
+    # ----- conversations -----
+
+    def conversations(self) -> list:
+        """Conversation pairs, largest first"""
+        if self._conversations is None:
+            rng = random.Random(self.seed + 3)
+            wanted = max(1, min(int(self.users * self.contacts / 2), self.users * (self.users - 1) // 2))
+            # Popular users: the first side of a pair is itself Zipf-distributed
+            user_weights = list(itertools.accumulate(1 / (i + 1) ** 0.8 for i in range(self.users)))
+            pairs = set()
+            attempts = 0
+            while len(pairs) < wanted and attempts < wanted * 10:
+                attempts += 1
+                a = bisect.bisect_left(user_weights, rng.random() * user_weights[-1])
+                b = rng.randrange(self.users)
+                if a != b:
+                    pairs.add((min(a, b), max(a, b)))
+            pairs = sorted(pairs)
+            rng.shuffle(pairs)
+            self._conversations = pairs
+        return self._conversations
+
+    def iter_messages(self):
+        """Message dicts in main.py's format, in timestamp order"""
+        rng = random.Random(self.seed + 4)
+        conversations = self.conversations()
+        weights = list(itertools.accumulate(1 / (k + 1) ** self.skew for k in range(len(conversations))))
+        total_weight = weights[-1]
+        span = (self.end - self.start).total_seconds()
+        step = span / max(1, self.messages)
+
+        for i in range(self.messages):
+            k = bisect.bisect_left(weights, rng.random() * total_weight)
+            a, b = conversations[min(k, len(conversations) - 1)]
+            sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+            timestamp = self.start + timedelta(seconds=i * step + rng.random() * step)
+            message = {
+                "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "from": username(sender),
+                "to": username(receiver),
+                "message": " ".join(rng.choice(WORDS) for _ in range(1 + int(rng.expovariate(1 / 8)))),
+                "timestamp": timestamp.isoformat(),
+                "edited": False,
+                "deleted_for": [],
+            }
+            if rng.random() < self.attachment_ratio:
+                file_type, extension = rng.choice(ATTACHMENT_TYPES)
+                message["file_url"] = f"{rng.getrandbits(256):064x}{extension}"
+                message["file_name"] = f"attachment{i}{extension}"
+                message["file_type"] = file_type
+            if rng.random() < self.edit_ratio:
+                message["edited"] = True
+                message["edited_at"] = (timestamp + timedelta(minutes=1)).isoformat()
+            roll = rng.random()
+            if roll < self.delete_everyone_ratio:
+                message["deleted_for_everyone"] = True
+            elif roll < self.delete_everyone_ratio + self.delete_ratio:
+                message["deleted_for"] = [message["from"] if rng.random() < 0.5 else message["to"]]
+            yield message
+
+    # ----- manifest -----
+
+    def manifest(self, sample_message_ids: list) -> dict:
+        conversations = self.conversations()
+        return {
+            "users": self.users,
+            "messages": self.messages,
+            "conversations": len(conversations),
+            "seed": self.seed,
+            "skew": self.skew,
+            "hot_conversation": [username(u) for u in conversations[0]],
+            "typical_conversation": [username(u) for u in conversations[len(conversations) // 2]],
+            "sample_users": [username(u) for u in random.Random(self.seed + 5).sample(range(self.users), min(self.users, SAMPLE_SIZE))],
+            "sample_message_ids": sample_message_ids,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+
+class Sampler:
+    """Reservoir sample of message ids that were not deleted for everyone"""
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.seen = 0
+        self.ids = []
+
+    def add(self, message: dict):
+        if message.get("deleted_for_everyone"):
+            return
+        self.seen += 1
+        if len(self.ids) < self.size:
+            self.ids.append(message["id"])
+        else:
+            j = self.rng.randrange(self.seen)
+            if j < self.size:
+                self.ids[j] = message["id"]
+
+
+def report(label: str, done: int, total: int, start: float):
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0
+    print(f"   ... {label}: {done}/{total} ({rate:,.0f} rows/s)")
+
+
+# ===== JSON (main.py) =====
+
+def write_json(spec: DatasetSpec, out_dir: str, password_hash: str, sampler: Sampler):
+    print(f"📝 Writing JSON files to {out_dir}...")
+    with open(os.path.join(out_dir, "users.json"), "w") as f:
+        json.dump({
+            name: {"password": password_hash, "plain_password": PASSWORD,
+                   "created_at": created_at.isoformat(), "is_admin": False}
+            for name, created_at in spec.iter_users()
+        }, f)
+    with open(os.path.join(out_dir, "banned_users.json"), "w") as f:
+        json.dump(spec.banned(), f)
+    now = datetime.now().isoformat()
+    with open(os.path.join(out_dir, "online_users.json"), "w") as f:
+        json.dump({name: {"status": "online", "last_seen": now} for name in spec.online()}, f)
+
+    start = time.perf_counter()
+    with open(os.path.join(out_dir, "messages.json"), "w") as f:
+        f.write("[")
+        for i, message in enumerate(spec.iter_messages()):
+            if i:
+                f.write(",\n")
+            # main.py stores attachments by their download URL
+            if "file_url" in message:
+                message["file_url"] = f"/download_chat_file/{message['file_url']}"
+            f.write(json.dumps(message))
+            sampler.add(message)
+            if (i + 1) % (BATCH_SIZE * 100) == 0:
+                report("messages", i + 1, spec.messages, start)
+        f.write("]\n")
+    print(f"✅ JSON: {spec.users} users, {spec.messages} messages in {time.perf_counter() - start:.1f}s")
+
+
+# ===== SQL (database.py) =====
+
+def write_database(spec: DatasetSpec, database_url: str, password_hash: str, sampler: Sampler = None):
+    from sqlalchemy import create_engine, func, insert, select
+
+    from database import Base, Message, OnlineUser, User
+
+    print(f"📝 Writing database {database_url}...")
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(User)).scalar():
+            raise SystemExit("❌ Target database already has users; generate into an empty database")
+
+    banned = set(spec.banned())
+    with engine.begin() as conn:
+        batch = []
+        for name, created_at in spec.iter_users():
+            batch.append({"username": name, "password": password_hash, "plain_password": PASSWORD,
+                          "is_admin": False, "is_banned": name in banned, "created_at": created_at})
+            if len(batch) >= BATCH_SIZE:
+                conn.execute(insert(User), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(User), batch)
+    with engine.connect() as conn:
+        user_ids = dict(conn.execute(select(User.username, User.id)).all())
+    with engine.begin() as conn:
+        now = datetime.utcnow()
+        rows = [{"user_id": user_ids[name], "last_heartbeat": now} for name in spec.online()]
+        if rows:
+            conn.execute(insert(OnlineUser), rows)
+
+    start = time.perf_counter()
+    batch = []
+    done = 0
+    for message in spec.iter_messages():
+        deleted_for = message["deleted_for"]
+        batch.append({
+            "id": message["id"],
+            "from_user_id": user_ids[message["from"]],
+            "to_user_id": user_ids[message["to"]],
+            "message": message["message"],
+            "file_url": f"/chat_files/{message['file_url']}" if "file_url" in message else None,
+            "file_name": message.get("file_name"),
+            "file_type": message.get("file_type"),
+            "timestamp": datetime.fromisoformat(message["timestamp"]),
+            "edited": message["edited"],
+            "deleted_for_sender": message["from"] in deleted_for,
+            "deleted_for_receiver": message["to"] in deleted_for,
+            "deleted_for_everyone": message.get("deleted_for_everyone", False),
+        })
+        if sampler is not None:
+            sampler.add(message)
+        if len(batch) >= BATCH_SIZE:
+            with engine.begin() as conn:
+                conn.execute(insert(Message), batch)
+            done += len(batch)
+            batch = []
+            if done % (BATCH_SIZE * 10) == 0:
+                report("messages", done, spec.messages, start)
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(insert(Message), batch)
+    engine.dispose()
+    print(f"✅ Database: {spec.users} users, {spec.messages} messages in {time.perf_counter() - start:.1f}s")
+
+
+def generate(spec: DatasetSpec, out_dir: str, fmt: str = "both", database_url: str = None) -> dict:
+    from passwords import hash_password_sync
+
+    os.makedirs(out_dir, exist_ok=True)
+    password_hash = hash_password_sync(PASSWORD)
+    # Both formats draw from the same stream, so one sample fits either
+    sampler = Sampler(SAMPLE_SIZE, spec.seed + 6)
+    if fmt in ("json", "both"):
+        write_json(spec, out_dir, password_hash, sampler)
+    if fmt in ("db", "both"):
+        write_database(spec, database_url or f"sqlite:///{os.path.join(out_dir, 'chatapp.db')}",
+                       password_hash, sampler if fmt == "db" else None)
+    manifest = spec.manifest(sampler.ids)
+    manifest["format"] = fmt
+    with open(os.path.join(out_dir, "dataset.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Generate a synthetic chat dataset")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--out", required=True, help="Directory for the JSON files and manifest")
+    parser.add_argument("--format", choices=["json", "db", "both"], default="both")
+    parser.add_argument("--database-url", help="Target database (default: sqlite in --out)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of conversation sizes")
+    parser.add_argument("--contacts", type=float, default=5, help="Average conversations per user")
+    parser.add_argument("--days", type=int, default=365, help="Days of history")
+    parser.add_argument("--attachment-ratio", type=float, default=0.05)
+    parser.add_argument("--edit-ratio", type=float, default=0.02)
+    parser.add_argument("--delete-ratio", type=float, default=0.03, help="Deleted for one side")
+    parser.add_argument("--delete-everyone-ratio", type=float, default=0.01)
+    parser.add_argument("--online-ratio", type=float, default=0.05)
+    parser.add_argument("--banned-ratio", type=float, default=0.001)
+    args = parser.parse_args()
+
+    spec = DatasetSpec(
+        args.users, args.messages, seed=args.seed, skew=args.skew, contacts=args.contacts, days=args.days,
+        attachment_ratio=args.attachment_ratio, edit_ratio=args.edit_ratio, delete_ratio=args.delete_ratio,
+        delete_everyone_ratio=args.delete_everyone_ratio, online_ratio=args.online_ratio,
+        banned_ratio=args.banned_ratio,
+    )
+    print(f"🚀 Generating {args.users} users, {args.messages} messages (seed {args.seed})")
+    manifest = generate(spec, args.out, args.format, args.database_url)
+    print(f"📊 {manifest['conversations']} conversations; hot: {manifest['hot_conversation']}, "
+          f"typical: {manifest['typical_conversation']}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,191 @@
+"""
+Group messaging: fan-out on write versus fan-out on read.
+
+For groups of 10, 100 and 1,000 members (--sizes), per storage engine:
+
+- fan-out on write is the workaround groups replace: the sender sends one
+  one-to-one copy to every other member, and each member polls their
+  conversation with the sender
+- fan-out on read stores each group message once; each member polls
+  get_groups (unread counts from their read cursor) and the newest page of
+  the group's messages
+
+Both send --messages messages, then every member polls once. Reports the
+time per group message sent, per member poll and for all members polling
+once, plus rows stored per group message. Each engine runs in its own
+process in a scratch directory, calling the storage engine directly.
+
+Usage:
+    python benchmarks/group_bench.py [--sizes 10,100,1000] [--engines sql,memory] [--messages 10]
+                                     [--page 50] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from load_test import git_commit
+from storage_bench import RESULTS_DIR, RESULT_MARKER
+
+STRATEGIES = ("fan-out on write", "fan-out on read")
+
+
+# ===== WORKER (one engine, in a child process) =====
+
+def timed(operation) -> float:
+    start = time.perf_counter()
+    operation()
+    return time.perf_counter() - start
+
+
+def run_size(storage, size: int, messages: int, page: int) -> dict:
+    # Fresh users per size, so earlier sizes' messages don't slow this one down
+    members = [f"g{size}_{i}" for i in range(size)]
+    for username in members:
+        storage.create_user(username, "x", "x")
+    sender, recipients = members[0], members[1:]
+    results = {}
+
+    # Fan-out on write: one copy per recipient
+    send_times = [timed(lambda: [storage.add_message(sender, member, "hello group") for member in recipients])
+                  for _ in range(messages)]
+    poll_times = [timed(lambda: storage.conversation(member, sender, viewer=member, limit=page)) for member in recipients]
+    results["fan-out on write"] = {
+        "send_ms": round(statistics.mean(send_times) * 1000, 3),
+        "poll_ms": round(statistics.median(poll_times) * 1000, 3),
+        "poll_all_ms": round(sum(poll_times) * 1000, 1),
+        "rows_per_message": len(recipients),
+    }
+
+    # Fan-out on read: stored once, read cursors per member
+    group = storage.create_group(f"bench {size}", sender, recipients)
+    send_times = [timed(lambda: storage.add_group_message(group["id"], sender, "hello group")) for _ in range(messages)]
+
+    def poll(member):
+        storage.user_groups(member)
+        storage.group_messages(group["id"], limit=page)
+
+    poll_times = [timed(lambda: poll(member)) for member in recipients]
+    results["fan-out on read"] = {
+        "send_ms": round(statistics.mean(send_times) * 1000, 3),
+        "poll_ms": round(statistics.median(poll_times) * 1000, 3),
+        "poll_all_ms": round(sum(poll_times) * 1000, 1),
+        "rows_per_message": 1,
+    }
+    return results
+
+
+def run_worker(sizes: list, messages: int, page: int) -> dict:
+    from storage_engine import create_storage
+
+    storage = create_storage()
+    storage.init()
+    results = {}
+    for size in sizes:
+        results[str(size)] = run_size(storage, size, messages, page)
+        for strategy, stats in results[str(size)].items():
+            print(f"   {size:>5} members  {strategy:18} send {stats['send_ms']:10.2f} ms  "
+                  f"poll {stats['poll_ms']:8.2f} ms  all {stats['poll_all_ms']:10.1f} ms", file=sys.stderr)
+    return results
+
+
+def worker_main(args):
+    # The engines print to stdout; keep it for the result line only
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    result = run_worker([int(size) for size in args.sizes.split(",")], args.messages, args.page)
+    stdout.write(RESULT_MARKER + json.dumps(result) + "\n")
+    stdout.flush()
+
+
+# ===== ORCHESTRATOR =====
+
+def run_engine(engine: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        env = dict(os.environ, STORAGE_ENGINE=engine, DATABASE_URL=f"sqlite:///{os.path.join(scratch_dir, 'chatapp.db')}",
+                   MESSAGE_SHARD_DIR=os.path.join(scratch_dir, "message_shards"))
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--sizes", args.sizes,
+                   "--messages", str(args.messages), "--page", str(args.page)]
+        try:
+            proc = subprocess.run(command, cwd=scratch_dir, env=env, stdout=subprocess.PIPE, text=True,
+                                  timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            print(f"   ⏱️  {engine} did not finish within {args.timeout}s")
+            return {"error": f"timeout after {args.timeout}s"}
+
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    print(f"   ❌ {engine} failed (exit code {proc.returncode})")
+    return {"error": f"exit code {proc.returncode}"}
+
+
+def print_table(results: dict):
+    print("=" * 96)
+    print(f"{'engine':8} {'members':>8} {'strategy':18} {'send ms':>10} {'poll ms':>10} {'all poll ms':>12} {'rows/msg':>9}")
+    print("-" * 96)
+    for engine, by_size in results.items():
+        if "error" in by_size:
+            print(f"{engine:8} {by_size['error']}")
+            continue
+        for size, by_strategy in by_size.items():
+            for strategy in STRATEGIES:
+                stats = by_strategy[strategy]
+                print(f"{engine:8} {size:>8} {strategy:18} {stats['send_ms']:10.2f} {stats['poll_ms']:10.2f} "
+                      f"{stats['poll_all_ms']:12.1f} {stats['rows_per_message']:9d}")
+    print("-" * 96)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare fan-out on write and fan-out on read for group messages")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated group sizes")
+    parser.add_argument("--engines", default="sql,memory",
+                        help="Storage engines to run (json and sharded work too, but json rewrites "
+                             "messages.json once per copy: slow at 1,000 members)")
+    parser.add_argument("--messages", type=int, default=10, help="Group messages sent per strategy")
+    parser.add_argument("--page", type=int, default=50, help="Messages per poll")
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up on an engine after this many seconds")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/groups_<commit>_<time>.json)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    commit = git_commit()
+    print(f"🚀 Group fan-out (commit {commit}): sizes {args.sizes}, engines {', '.join(engines)}, "
+          f"{args.messages} messages per strategy")
+    results = {}
+    for engine in engines:
+        print(f"\n⏱️  {engine}")
+        results[engine] = run_engine(engine, args)
+    print()
+    print_table(results)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"groups_{commit}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "settings": {"sizes": args.sizes, "messages": args.messages, "page": args.page},
+            "results": results,
+        }, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,323 @@
+"""
+Load test that replays the chat.html traffic pattern.
+
+Each simulated client signs up (or logs in), opens a chat with another
+client and then behaves like an idle-but-open browser tab:
+
+- POST /heartbeat/{user} every --heartbeat-interval seconds (chat.html: 10)
+- GET /all_online_status every --status-interval seconds (chat.html: 5)
+- GET /get_messages/{user}/{peer} every --poll-interval seconds (chat.html: 2)
+- POST /send_message at --send-rate messages per client per minute
+  (Poisson arrivals), followed by the get_messages and get_conversations
+  refresh chat.html does after a send
+
+Runs main.py or main_with_db.py in-process (httpx ASGITransport, in a
+scratch directory, startup/shutdown hooks included) or against a running
+server with --url. --engine swaps the storage engine under either app
+(json, sql, memory or sharded; see storage_engine.py), and for the sql engine
+--database-url picks the database (default: a fresh SQLite file in the
+scratch directory; a local Postgres works too). In-process runs share one event loop between clients and app,
+so absolute numbers are a lower bound on what a real deployment serves.
+
+Reports throughput, errors and p50/p95/p99 per endpoint (route template),
+and writes them to --output as JSON together with the git commit, so runs
+can be compared across commits with --compare.
+
+Usage:
+    python benchmarks/load_test.py [--app main_with_db] [--engine memory] [--clients 100] [--duration 60]
+                                   [--send-rate 3] [--url http://localhost:8000]
+                                   [--database-url postgresql://...] [--output FILE] [--compare OLD.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Recorder:
+    """Latencies and status codes per endpoint, only inside the measured window"""
+
+    def __init__(self):
+        self.measuring = False
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def add(self, endpoint: str, seconds: float, status):
+        if not self.measuring:
+            return
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        codes = self.statuses.setdefault(endpoint, {})
+        codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def summary(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, times in sorted(self.latencies.items()):
+            codes = self.statuses[endpoint]
+            failed = sum(n for code, n in codes.items() if not code.startswith("2"))
+            endpoints[endpoint] = {
+                "requests": len(times),
+                "rps": round(len(times) / duration, 2),
+                "errors": failed,
+                "statuses": codes,
+                "p50_ms": round(percentile(times, 50) * 1000, 2),
+                "p95_ms": round(percentile(times, 95) * 1000, 2),
+                "p99_ms": round(percentile(times, 99) * 1000, 2),
+                "max_ms": round(max(times) * 1000, 2),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_rps": round(total / duration, 2),
+            "total_errors": sum(e["errors"] for e in endpoints.values()),
+            "endpoints": endpoints,
+        }
+
+
+class Client:
+    def __init__(self, http, recorder: Recorder, username: str, peer: str, args):
+        self.http = http
+        self.recorder = recorder
+        self.username = username
+        self.peer = peer
+        self.args = args
+        self.headers = {}
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=self.headers, **kwargs)
+            status = response.status_code
+        except Exception as e:
+            response, status = None, type(e).__name__
+        self.recorder.add(endpoint, time.perf_counter() - start, status)
+        return response
+
+    async def sign_in(self):
+        credentials = {"username": self.username, "password": "password123"}
+        for endpoint in ("/signup", "/login") * 10:
+            response = await self.call(endpoint, "POST", endpoint, json=credentials)
+            if response is None:
+                continue
+            if response.status_code == 200:
+                token = response.json().get("token")
+                if token:
+                    self.headers = {"Authorization": f"Bearer {token}"}
+                return
+            if response.status_code in (429, 503):
+                # Password hashing is admission-controlled; back off like a user retrying
+                await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        raise RuntimeError(f"Could not sign in {self.username}")
+
+    async def every(self, interval: float, action, deadline: float):
+        # Browsers start their timers at different moments
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.perf_counter() < deadline:
+            await action()
+            await asyncio.sleep(interval)
+
+    async def heartbeat(self):
+        await self.call("/heartbeat/{username}", "POST", f"/heartbeat/{self.username}")
+
+    async def status(self):
+        await self.call("/all_online_status", "GET", "/all_online_status")
+
+    async def poll(self):
+        await self.call("/get_messages/{from_user}/{to_user}", "GET",
+                        f"/get_messages/{self.username}/{self.peer}")
+
+    async def send_loop(self, deadline: float):
+        if self.args.send_rate <= 0:
+            return
+        mean_gap = 60.0 / self.args.send_rate
+        while True:
+            await asyncio.sleep(random.expovariate(1 / mean_gap))
+            if time.perf_counter() >= deadline:
+                return
+            text = f"load test message {random.randint(0, 10 ** 9)} " + "x" * random.randint(0, 200)
+            await self.call("/send_message", "POST", "/send_message",
+                            json={"from_user": self.username, "to_user": self.peer, "message": text})
+            # chat.html refreshes the open chat and the conversation list after sending
+            await self.poll()
+            await self.call("/get_conversations/{username}", "GET", f"/get_conversations/{self.username}")
+
+    async def run(self, deadline: float):
+        args = self.args
+        await asyncio.gather(
+            self.every(args.heartbeat_interval, self.heartbeat, deadline),
+            self.every(args.status_interval, self.status, deadline),
+            self.every(args.poll_interval, self.poll, deadline),
+            self.send_loop(deadline),
+        )
+
+
+@contextlib.asynccontextmanager
+async def in_process_client(app_name: str):
+    import importlib
+
+    import httpx
+
+    app = importlib.import_module(app_name).app
+    # Run the app's startup/shutdown hooks like uvicorn would
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as http:
+            yield http
+
+
+@contextlib.asynccontextmanager
+async def http_client(url: str, clients: int):
+    import httpx
+
+    limits = httpx.Limits(max_connections=clients * 2, max_keepalive_connections=clients * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as http:
+        yield http
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    client_context = http_client(args.url, args.clients) if args.url else in_process_client(args.app)
+    async with client_context as http:
+        prefix = args.user_prefix or f"lt{random.randint(0, 99999)}u"
+        names = [f"{prefix}{i}" for i in range(args.clients)]
+        # Pair clients up so every open chat has traffic in both directions
+        clients = [Client(http, recorder, name, names[i ^ 1] if (i ^ 1) < len(names) else names[0], args)
+                   for i, name in enumerate(names)]
+
+        print(f"👥 Signing in {len(clients)} clients...")
+        for i in range(0, len(clients), 20):
+            await asyncio.gather(*[c.sign_in() for c in clients[i:i + 20]])
+
+        print(f"🔥 Warming up for {args.warmup:g}s, then measuring for {args.duration:g}s...")
+        start = time.perf_counter()
+        deadline = start + args.warmup + args.duration
+
+        async def start_measuring():
+            await asyncio.sleep(args.warmup)
+            recorder.measuring = True
+
+        await asyncio.gather(start_measuring(), *[c.run(deadline) for c in clients])
+        recorder.measuring = False
+
+    return recorder.summary(args.duration)
+
+
+def print_summary(summary: dict, previous: dict = None):
+    print("=" * 96)
+    print(f"{'endpoint':40} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    print("-" * 96)
+    for endpoint, stats in summary["endpoints"].items():
+        print(f"{endpoint:40} {stats['rps']:8.1f} {stats['errors']:7d} {stats['p50_ms']:8.1f} "
+              f"{stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f} {stats['max_ms']:8.1f}")
+        old = (previous or {}).get("endpoints", {}).get(endpoint)
+        if old:
+            print(f"{'   vs ' + previous.get('_label', 'previous'):40} {stats['rps'] - old['rps']:+8.1f} "
+                  f"{stats['errors'] - old['errors']:+7d} {stats['p50_ms'] - old['p50_ms']:+8.1f} "
+                  f"{stats['p95_ms'] - old['p95_ms']:+8.1f} {stats['p99_ms'] - old['p99_ms']:+8.1f} "
+                  f"{stats['max_ms'] - old['max_ms']:+8.1f}")
+    print("-" * 96)
+    print(f"📊 {summary['total_requests']} requests, {summary['total_rps']:.1f} req/s, "
+          f"{summary['total_errors']} errors")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Simulate chat.html clients and measure per-endpoint latency")
+    parser.add_argument("--app", choices=["main", "main_with_db"], default="main_with_db",
+                        help="App to run in-process (ignored with --url)")
+    parser.add_argument("--url", help="Test a running server instead, e.g. http://localhost:8000")
+    parser.add_argument("--engine", choices=["json", "sql", "memory", "sharded"],
+                        help="STORAGE_ENGINE for the in-process app (default: json for main, sql for main_with_db)")
+    parser.add_argument("--database-url", help="DATABASE_URL for the in-process sql engine (default: scratch SQLite)")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of traffic before measuring")
+    parser.add_argument("--send-rate", type=float, default=2, help="Messages per client per minute")
+    parser.add_argument("--heartbeat-interval", type=float, default=10)
+    parser.add_argument("--status-interval", type=float, default=5)
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--user-prefix", help="Username prefix (default: random, so runs don't collide)")
+    parser.add_argument("--label", help="Name stored with the results (default: git commit)")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/load_<app>_<commit>_<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to print differences against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    engine = None if args.url else args.engine or ("json" if args.app == "main" else "sql")
+    target = args.url or f"{args.app} ({engine} storage)"
+    print(f"🚀 Load test: {args.clients} clients against {target} (commit {commit})")
+
+    if args.url:
+        summary = asyncio.run(run(args))
+    else:
+        # Both apps keep their data files (and the default SQLite file) in the working directory
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            os.environ["STORAGE_ENGINE"] = engine
+            os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+            summary = asyncio.run(run(args))
+            os.chdir(REPO_DIR)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)["results"]
+        previous["_label"] = os.path.basename(args.compare)
+    print_summary(summary, previous)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = f"{args.app}-{engine}" if not args.url else "http"
+        output = os.path.join(RESULTS_DIR, f"load_{name}_{commit}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "label": args.label or commit,
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "target": target,
+            "engine": engine,
+            "database": (args.database_url or "sqlite") if engine == "sql" else None,
+            "settings": {
+                "clients": args.clients,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "send_rate": args.send_rate,
+                "heartbeat_interval": args.heartbeat_interval,
+                "status_interval": args.status_interval,
+                "poll_interval": args.poll_interval,
+            },
+            "results": summary,
+        }, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,122 @@
+"""
+Login storm benchmark.
+
+Runs main.py in-process (httpx ASGITransport, in a scratch directory) and
+fires concurrent logins for a while, with a probe client hitting a cheap
+endpoint at the same time. Reports login throughput and latency, how many
+logins were turned away by admission control, and the probe's p50/p99 -
+the number that shows whether hashing starves the rest of the API.
+
+--inline hashes in the request threadpool instead of the bounded pool,
+for comparison.
+
+Usage:
+    python benchmarks/login_bench.py [--concurrency 64] [--duration 10] [--inline]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class InlineHasher:
+    """Hashes in the shared request threadpool, with no bound"""
+
+    async def hash(self, password):
+        from starlette.concurrency import run_in_threadpool
+        import passwords
+        return await run_in_threadpool(passwords.hash_password_sync, password)
+
+    async def verify(self, password, stored):
+        from starlette.concurrency import run_in_threadpool
+        import passwords
+        return await run_in_threadpool(passwords.verify_password_sync, password, stored)
+
+
+async def run(args):
+    import httpx
+    import main
+    import chat_server
+
+    # The endpoints look the hasher up in chat_server, where main.py's app lives
+    if args.inline:
+        chat_server.password_hasher = InlineHasher()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        users = [f"bench{i}" for i in range(args.concurrency)]
+        for username in users:
+            await client.post("/signup", json={"username": username, "password": "password123"})
+
+        deadline = time.perf_counter() + args.duration
+        login_times, probe_times = [], []
+        outcomes = {"ok": 0, "rejected": 0, "failed": 0}
+
+        async def login_worker(username):
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                r = await client.post("/login", json={"username": username, "password": "password123"})
+                elapsed = time.perf_counter() - start
+                if r.status_code == 200:
+                    outcomes["ok"] += 1
+                    login_times.append(elapsed)
+                elif r.status_code == 503:
+                    outcomes["rejected"] += 1
+                    await asyncio.sleep(min(float(r.headers.get("retry-after", "1")), 0.2))
+                else:
+                    outcomes["failed"] += 1
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(f"/online_status/{users[0]}")
+                probe_times.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(probe(), *[login_worker(u) for u in users])
+
+    print("=" * 60)
+    print(f"📊 {args.concurrency} concurrent logins for {args.duration}s "
+          f"({'inline hashing' if args.inline else 'bounded hashing pool'})")
+    print("=" * 60)
+    print(f"🔐 logins: {outcomes['ok']} ok ({outcomes['ok'] / args.duration:.1f}/s), "
+          f"{outcomes['rejected']} rejected with 503, {outcomes['failed']} failed")
+    if login_times:
+        print(f"⏱️  login  p50 {percentile(login_times, 50) * 1000:7.1f} ms   "
+              f"p99 {percentile(login_times, 99) * 1000:7.1f} ms")
+    print(f"⏱️  probe  p50 {percentile(probe_times, 50) * 1000:7.1f} ms   "
+          f"p99 {percentile(probe_times, 99) * 1000:7.1f} ms   "
+          f"mean {statistics.mean(probe_times) * 1000:.1f} ms ({len(probe_times)} requests)")
+    if not args.inline:
+        print(f"🧮 hasher: {chat_server.password_hasher.stats()}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark logins under load")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--inline", action="store_true", help="Hash in the request threadpool (no admission control)")
+    args = parser.parse_args()
+
+    # main.py keeps its JSON files in the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,93 @@
+"""
+Serialization and wire-size benchmark for a large conversation.
+
+Compares FastAPI's default response path (jsonable_encoder + JSONResponse)
+with fast_json.json_response for a synthetic 5,000-message conversation
+shaped like get_messages output, and reports the body size per encoding.
+
+Usage:
+    python benchmarks/serialization_bench.py [--messages 5000] [--rounds 20]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import compression
+import fast_json
+
+
+def make_conversation(count: int) -> dict:
+    rng = random.Random(42)
+    start = datetime(2026, 1, 1)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(500)]
+    messages = []
+    for i in range(count):
+        msg = {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "from": "alice" if i % 2 else "bob",
+            "to": "bob" if i % 2 else "alice",
+            "message": " ".join(rng.choices(words, k=rng.randint(3, 30))),
+            "timestamp": (start + timedelta(seconds=i * 37)).isoformat(),
+            "edited": rng.random() < 0.05,
+            "deleted_for": [],
+        }
+        if rng.random() < 0.1:
+            msg["file_url"] = f"/download_chat_file/{rng.getrandbits(256):064x}.jpg"
+            msg["file_name"] = "photo.jpg"
+            msg["file_type"] = "image"
+        messages.append(msg)
+    return {"messages": messages}
+
+
+def timed(fn, rounds: int) -> float:
+    fn()
+    start = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return (time.process_time() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and compression")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = make_conversation(args.messages)
+
+    print("=" * 60)
+    print(f"📊 {args.messages} messages, {args.rounds} rounds "
+          f"(orjson {'available' if fast_json.orjson else 'not installed'}, "
+          f"brotli {'available' if compression.brotli else 'not installed'})")
+    print("=" * 60)
+
+    default_ms = timed(lambda: JSONResponse(jsonable_encoder(payload)).body, args.rounds)
+    fast_ms = timed(lambda: fast_json.dumps(payload), args.rounds)
+    print(f"⏱️  jsonable_encoder + JSONResponse: {default_ms:8.2f} ms CPU")
+    print(f"⏱️  fast_json.dumps:                 {fast_ms:8.2f} ms CPU  ({default_ms / fast_ms:.1f}x)")
+
+    body = fast_json.dumps(payload)
+    print(f"\n📦 identity: {len(body) / 1024:8.1f} KB")
+    for encoding in compression.AVAILABLE_ENCODINGS:
+        if encoding == "identity":
+            continue
+        headers = {"accept-encoding": encoding}
+        ms = timed(lambda: fast_json.json_response(payload, headers).body, args.rounds)
+        size = len(fast_json.json_response(payload, headers).body)
+        print(f"📦 {encoding:<8}: {size / 1024:8.1f} KB  ({size / len(body):.0%} of identity, "
+              f"{ms:.2f} ms CPU including serialization)")
+
+
+if __name__ == "__main__":
+    main()
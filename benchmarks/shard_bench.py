@@ -0,0 +1,221 @@
+"""
+Concurrent sends in unrelated conversations, per storage engine.
+
+Each sender sends messages in its own conversation (disjoint pairs of
+users from a generated dataset) for --duration seconds, with 1, 2, 4 and 8
+senders (--threads). Senders are threads in one process, or with
+--processes separate processes, like uvicorn workers; threads share the
+GIL, so only processes show writes spreading over cores. Engines: json (one
+lock, whole-file rewrites; threads only, it has no lock between
+processes), sql on SQLite (one database file lock), and the sharded engine
+with one shard and with --shards shards, so the difference sharding makes
+is shown apart from the storage format. Every run starts from a scratch
+copy of the dataset. Reports sends/s and p50/p99 send latency.
+
+Usage:
+    python benchmarks/shard_bench.py [--users 2k] [--messages 50k] [--threads 1,2,4,8] [--processes]
+                                     [--shards 8] [--duration 5] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from load_test import git_commit, percentile
+from storage_bench import DATA_DIR, JSON_FILES, RESULTS_DIR, RESULT_MARKER, ensure_dataset, parse_count, short_count
+
+
+def configurations(shards: int, processes: bool) -> list:
+    # (label, STORAGE_ENGINE, MESSAGE_SHARDS)
+    json_engine = [] if processes else [("json", "json", None)]
+    return json_engine + [("sql", "sql", None), ("sharded-1", "sharded", 1), (f"sharded-{shards}", "sharded", shards)]
+
+
+# ===== WORKER (one engine and thread count, in a child process) =====
+
+def run_worker(dataset_dir: str, threads: int, duration: float, first_pair: int = 0, start_at: float = None) -> dict:
+    from storage_engine import create_storage
+
+    with open(os.path.join(dataset_dir, "dataset.json"), "r") as f:
+        manifest = json.load(f)
+    users = manifest["sample_users"]
+    if len(users) < (first_pair + threads) * 2:
+        raise SystemExit(f"Dataset has {len(users)} sample users; {first_pair + threads} senders need more")
+    storage = create_storage()
+    storage.init()
+
+    samples = []
+    lock = threading.Lock()
+    # Sibling processes start sending together
+    if start_at:
+        time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.perf_counter() + duration
+
+    def loop(sender: str, recipient: str):
+        times = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            storage.add_message(sender, recipient, "bench")
+            times.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(times)
+
+    pairs = range(first_pair, first_pair + threads)
+    workers = [threading.Thread(target=loop, args=(users[2 * i], users[2 * i + 1])) for i in pairs]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return summarize(samples, duration)
+
+
+def summarize(samples: list, duration: float) -> dict:
+    return {
+        "sends": len(samples),
+        "sends_per_second": round(len(samples) / duration, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 2) if samples else None,
+        "samples": samples,
+    }
+
+
+def worker_main(args):
+    # The engines print to stdout; keep it for the result line only
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    result = run_worker(args.dataset, args.worker_threads, args.duration, args.first_pair, args.start_at)
+    stdout.write(RESULT_MARKER + json.dumps(result) + "\n")
+    stdout.flush()
+
+
+# ===== ORCHESTRATOR =====
+
+def worker_result(stdout: str):
+    for line in stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return None
+
+
+def run_configuration(engine: str, shards, threads: int, dataset_dir: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        shutil.copy(os.path.join(dataset_dir, "dataset.json"), scratch_dir)
+        if engine == "sql":
+            shutil.copy(os.path.join(dataset_dir, "chatapp.db"), scratch_dir)
+        else:
+            # The sharded engine imports messages.json into its shards before the clock starts
+            for name in JSON_FILES:
+                shutil.copy(os.path.join(dataset_dir, name), scratch_dir)
+
+        env = dict(os.environ, STORAGE_ENGINE=engine, DATABASE_URL=f"sqlite:///{os.path.join(scratch_dir, 'chatapp.db')}",
+                   MESSAGE_SHARD_DIR=os.path.join(scratch_dir, "message_shards"))
+        if shards:
+            env["MESSAGE_SHARDS"] = str(shards)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--dataset", scratch_dir]
+        timeout = args.duration * 10 + 300
+        if not args.processes:
+            proc = subprocess.run(command + ["--worker-threads", str(threads), "--duration", str(args.duration)],
+                                  cwd=scratch_dir, env=env, stdout=subprocess.PIPE, text=True, timeout=timeout)
+            results = [worker_result(proc.stdout)]
+        else:
+            # Import messages.json / create tables once, then start every process at the same moment
+            subprocess.run(command + ["--worker-threads", "0", "--duration", "0"], cwd=scratch_dir, env=env,
+                           stdout=subprocess.PIPE, text=True, timeout=timeout)
+            start_at = time.time() + 2 + threads * 0.2
+            procs = [subprocess.Popen(command + ["--worker-threads", "1", "--duration", str(args.duration),
+                                                 "--first-pair", str(i), "--start-at", str(start_at)],
+                                      cwd=scratch_dir, env=env, stdout=subprocess.PIPE, text=True)
+                     for i in range(threads)]
+            results = [worker_result(proc.communicate(timeout=timeout)[0]) for proc in procs]
+
+    if any(result is None for result in results):
+        print("   ❌ a worker failed")
+        return {"error": "worker failed"}
+    result = summarize([sample for result in results for sample in result["samples"]], args.duration)
+    del result["samples"]
+    return result
+
+
+def print_table(results: dict, thread_counts: list):
+    width = 12 + 14 * len(thread_counts)
+    print("=" * width)
+    print(f"{'sends/s':12}" + "".join(f"{f'{threads} senders':>14}" for threads in thread_counts))
+    print("-" * width)
+    for label, by_threads in results.items():
+        cells = []
+        for threads in thread_counts:
+            result = by_threads.get(str(threads), {})
+            cells.append(f"{result['sends_per_second']:14.1f}" if "sends_per_second" in result else f"{'-':>14}")
+        print(f"{label:12}" + "".join(cells))
+    print("-" * width)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure concurrent sends in unrelated conversations per storage engine")
+    parser.add_argument("--users", default="2k")
+    parser.add_argument("--messages", default="50k")
+    parser.add_argument("--threads", default="1,2,4,8", help="Comma-separated thread counts")
+    parser.add_argument("--processes", action="store_true", help="One process per sender instead of threads")
+    parser.add_argument("--shards", type=int, default=8, help="MESSAGE_SHARDS for the sharded run")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Where generated datasets are cached")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/shards_<commit>_<time>.json)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-threads", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--first-pair", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--dataset", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    users, messages = parse_count(args.users), parse_count(args.messages)
+    thread_counts = [int(threads) for threads in args.threads.split(",") if threads.strip()]
+    commit = git_commit()
+    print(f"🚀 Concurrent sends (commit {commit}): {short_count(users)} users, {short_count(messages)} messages, "
+          f"{'processes' if args.processes else 'threads'} {args.threads}, {args.duration:g}s per run")
+    dataset_dir = ensure_dataset(args.data_dir, users, messages, args.seed)
+
+    results = {}
+    for label, engine, shards in configurations(args.shards, args.processes):
+        results[label] = {}
+        for threads in thread_counts:
+            print(f"\n⏱️  {label}, {threads} {'processes' if args.processes else 'threads'}")
+            result = results[label][str(threads)] = run_configuration(engine, shards, threads, dataset_dir, args)
+            if "sends_per_second" in result:
+                print(f"   {result['sends_per_second']:.1f} sends/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+    print()
+    print_table(results, thread_counts)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"shards_{commit}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "settings": {"users": users, "messages": messages, "threads": thread_counts, "processes": args.processes,
+                         "shards": args.shards,
+                         "duration": args.duration, "seed": args.seed},
+            "results": results,
+        }, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,204 @@
+"""
+SQLite read/write concurrency, before and after the production profile.
+
+Runs the sql storage engine (storage_sql.SqlStorage) against a generated
+dataset in two child processes, once with SQLITE_TUNING=0 (rollback
+journal, synchronous=FULL, one pool) and once with the default profile
+(WAL, synchronous=NORMAL, mmap, bigger cache, read-only pool for reads).
+In each, --readers threads poll conversations and online status like open
+chat tabs while --writers threads send heartbeats and messages, for
+--duration seconds. Reports operations/s, p50/p99 latency and errors
+("database is locked") for reads and writes side by side.
+
+Usage:
+    python benchmarks/sqlite_bench.py [--users 2k] [--messages 50k] [--readers 8] [--writers 2]
+                                      [--duration 10] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from load_test import git_commit, percentile
+from storage_bench import DATA_DIR, RESULTS_DIR, RESULT_MARKER, ensure_dataset, parse_count, short_count
+
+PROFILES = (("default", "0"), ("tuned", "1"))
+
+
+# ===== WORKER (one profile, in a child process) =====
+
+def run_worker(dataset_dir: str, readers: int, writers: int, duration: float) -> dict:
+    from storage_sql import SqlStorage
+
+    with open(os.path.join(dataset_dir, "dataset.json"), "r") as f:
+        manifest = json.load(f)
+    storage = SqlStorage()
+    hot, typical = manifest["hot_conversation"], manifest["typical_conversation"]
+    users = manifest["sample_users"]
+
+    # What chat.html's polling does (get_messages every 2s, online status every 5s)
+    # and what its writes are (heartbeats every 10s, occasional sends)
+    read_ops = [
+        ("get_messages (typical)", lambda rng: storage.conversation(typical[0], typical[1], viewer=typical[0])),
+        ("get_messages (hot)", lambda rng: storage.conversation(hot[0], hot[1], viewer=hot[0])),
+        ("all_online_status", lambda rng: storage.online_users()),
+        ("get_conversations", lambda rng: storage.contacts(rng.choice(users))),
+    ]
+    write_ops = [
+        ("heartbeat", lambda rng: storage.set_online(rng.choice(users))),
+        ("send_message", lambda rng: storage.add_message(typical[0], typical[1], "bench")),
+    ]
+
+    samples = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop(kind: str, operations: list, seed: int):
+        rng = random.Random(seed)
+        times, failed = [], 0
+        while time.perf_counter() < deadline:
+            name, operation = operations[rng.randrange(len(operations))]
+            start = time.perf_counter()
+            try:
+                operation(rng)
+                times.append(time.perf_counter() - start)
+            except Exception as e:
+                failed += 1
+                if failed == 1:
+                    print(f"   ⚠️  {kind} {name}: {e}", file=sys.stderr)
+        with lock:
+            samples[kind].extend(times)
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=loop, args=("read", read_ops, i)) for i in range(readers)]
+    threads += [threading.Thread(target=loop, args=("write", write_ops, 1000 + i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = {}
+    for kind in ("read", "write"):
+        times = samples[kind]
+        result[kind] = {
+            "ops": len(times),
+            "ops_per_second": round(len(times) / duration, 1),
+            "p50_ms": round(percentile(times, 50) * 1000, 2) if times else None,
+            "p99_ms": round(percentile(times, 99) * 1000, 2) if times else None,
+            "max_ms": round(max(times) * 1000, 2) if times else None,
+            "errors": errors[kind],
+        }
+    return result
+
+
+def worker_main(args):
+    # database.py prints to stdout; keep it for the result line only
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    result = run_worker(args.dataset, args.readers, args.writers, args.duration)
+    stdout.write(RESULT_MARKER + json.dumps(result) + "\n")
+    stdout.flush()
+
+
+# ===== ORCHESTRATOR =====
+
+def run_profile(profile: str, tuning: str, dataset_dir: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        shutil.copy(os.path.join(dataset_dir, "dataset.json"), scratch_dir)
+        db_path = os.path.join(scratch_dir, "chatapp.db")
+        shutil.copy(os.path.join(dataset_dir, "chatapp.db"), db_path)
+        # journal_mode is stored in the file; start every run from SQLite's default
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+        env = dict(os.environ, SQLITE_TUNING=tuning, DATABASE_URL=f"sqlite:///{db_path}")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--dataset", scratch_dir,
+                   "--readers", str(args.readers), "--writers", str(args.writers), "--duration", str(args.duration)]
+        proc = subprocess.run(command, cwd=scratch_dir, env=env, stdout=subprocess.PIPE, text=True,
+                              timeout=args.duration * 10 + 120)
+
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    print(f"   ❌ {profile} failed (exit code {proc.returncode})")
+    return {"error": f"exit code {proc.returncode}"}
+
+
+def print_table(results: dict):
+    print("=" * 86)
+    print(f"{'profile':10} {'kind':6} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10} {'errors':>8}")
+    print("-" * 86)
+    for profile, result in results.items():
+        if "error" in result:
+            print(f"{profile:10} {result['error']}")
+            continue
+        for kind in ("read", "write"):
+            stats = result[kind]
+            fmt = lambda value: f"{value:10.2f}" if value is not None else f"{'-':>10}"
+            print(f"{profile:10} {kind:6} {stats['ops_per_second']:10.1f} {fmt(stats['p50_ms'])} "
+                  f"{fmt(stats['p99_ms'])} {fmt(stats['max_ms'])} {stats['errors']:8d}")
+    print("-" * 86)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare SQLite read/write concurrency with and without the tuning profile")
+    parser.add_argument("--users", default="2k")
+    parser.add_argument("--messages", default="50k")
+    parser.add_argument("--readers", type=int, default=8, help="Threads polling like open chat tabs")
+    parser.add_argument("--writers", type=int, default=2, help="Threads sending heartbeats and messages")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per profile")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Where generated datasets are cached")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/sqlite_<commit>_<time>.json)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--dataset", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    users, messages = parse_count(args.users), parse_count(args.messages)
+    commit = git_commit()
+    print(f"🚀 SQLite concurrency (commit {commit}): {short_count(users)} users, {short_count(messages)} messages, "
+          f"{args.readers} readers, {args.writers} writers, {args.duration:g}s per profile")
+    dataset_dir = ensure_dataset(args.data_dir, users, messages, args.seed)
+
+    results = {}
+    for profile, tuning in PROFILES:
+        print(f"\n⏱️  {profile} profile (SQLITE_TUNING={tuning})")
+        results[profile] = run_profile(profile, tuning, dataset_dir, args)
+    print()
+    print_table(results)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"sqlite_{commit}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "settings": {"users": users, "messages": messages, "readers": args.readers,
+                         "writers": args.writers, "duration": args.duration, "seed": args.seed},
+            "profiles": results,
+        }, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
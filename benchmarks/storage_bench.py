@@ -0,0 +1,284 @@
+"""
+Storage-path microbenchmarks at increasing dataset sizes.
+
+For every dataset size (generated with generate_dataset.py and cached under
+--data-dir) and every storage engine (STORAGE_ENGINE: "json", "sql",
+"memory" and "sharded", the last two loaded from the dataset's JSON files) calls each
+chat_server endpoint function directly, without HTTP, rate limits or
+sessions, so the numbers are the storage path alone: load/filter/save for
+JSON, queries and commits for SQL, and the app's own overhead for memory.
+
+Each backend/size pair runs in its own process (the engine is picked at
+import) against a scratch copy of the dataset, so write
+benchmarks don't change the cached data (--in-place skips the copy, e.g.
+for a Postgres --database-url). An operation is repeated --repeat times or
+until --op-budget seconds have passed, whichever comes first, so the
+largest sizes still finish; peak memory is reported per run.
+
+Usage:
+    python benchmarks/storage_bench.py [--sizes 1k:10k,10k:100k,100k:1m] [--backends json,sql,memory]
+                                       [--repeat 5] [--op-budget 10] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from generate_dataset import DatasetSpec, generate
+from load_test import git_commit
+
+DATA_DIR = os.path.join(REPO_DIR, "benchmarks", "data")
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+JSON_FILES = ("users.json", "messages.json", "online_users.json", "banned_users.json")
+RESULT_MARKER = "STORAGE_BENCH_RESULT "
+
+
+def parse_count(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def parse_sizes(text: str) -> list:
+    sizes = []
+    for item in text.split(","):
+        users, _, messages = item.partition(":")
+        sizes.append((parse_count(users), parse_count(messages)))
+    return sizes
+
+
+def short_count(n: int) -> str:
+    for size, suffix in ((1000000, "M"), (1000, "k")):
+        if n >= size:
+            return f"{n / size:g}{suffix}"
+    return str(n)
+
+
+class FakeRequest:
+    """Enough of a Request for the endpoints that only read its headers"""
+    headers = {}
+
+
+# ===== WORKER (one backend, one dataset, in a child process) =====
+
+def operations(manifest: dict) -> list:
+    import chat_server as app
+
+    hot, typical = manifest["hot_conversation"], manifest["typical_conversation"]
+    user = manifest["sample_users"][0]
+    ids = manifest["sample_message_ids"]
+    request = FakeRequest()
+    return [
+        ("user lookup (login)", lambda i: app.storage.get_user(user)),
+        ("search_users", lambda i: app.search_users("user00001")),
+        ("get_messages (hot)", lambda i: app.get_messages(hot[0], hot[1], request, session=None)),
+        ("get_messages (typical)", lambda i: app.get_messages(typical[0], typical[1], request, session=None)),
+        ("get_conversations", lambda i: app.get_conversations(hot[0], session=None)),
+        ("all_online_status", lambda i: app.get_all_online_status()),
+        ("admin all_users", lambda i: app.get_all_users(request)),
+        ("admin all_conversations", lambda i: app.get_all_conversations()),
+        ("heartbeat", lambda i: app.heartbeat(typical[0], session=None)),
+        ("send_message", lambda i: app.send_message(
+            app.Message(from_user=typical[0], to_user=typical[1], message=f"bench {i}"), session=None)),
+        ("edit_message", lambda i: app.edit_message(
+            ids[i % len(ids)], app.MessageEdit(message=f"edited {i}"), session=None)),
+        ("delete_message (me)", lambda i: app.delete_message(
+            ids[-1 - i % len(ids)], "me", app.MessageDelete(username=user), session=None)),
+    ]
+
+
+def load_memory_engine(dataset_dir: str):
+    # The memory engine starts empty; fill it from the dataset's JSON files
+    import chat_server as app
+
+    def load(name):
+        with open(os.path.join(dataset_dir, name), "r") as f:
+            return json.load(f)
+
+    app.storage.bulk_load(load("users.json"), load("messages.json"), load("banned_users.json"))
+
+
+def run_worker(backend: str, dataset_dir: str, repeat: int, op_budget: float) -> dict:
+    with open(os.path.join(dataset_dir, "dataset.json"), "r") as f:
+        manifest = json.load(f)
+    if backend == "memory":
+        load_memory_engine(dataset_dir)
+    elif backend == "sharded":
+        # Imports the scratch copy of messages.json into the shards
+        import chat_server as app
+        app.storage.init()
+
+    results = {}
+    for name, operation in operations(manifest):
+        times = []
+        started = time.perf_counter()
+        for i in range(repeat):
+            start = time.perf_counter()
+            operation(i)
+            times.append(time.perf_counter() - start)
+            if time.perf_counter() - started > op_budget:
+                break
+        results[name] = {
+            "calls": len(times),
+            "p50_ms": round(statistics.median(times) * 1000, 3),
+            "mean_ms": round(statistics.mean(times) * 1000, 3),
+            "max_ms": round(max(times) * 1000, 3),
+        }
+        print(f"   {name:28} {results[name]['p50_ms']:12.2f} ms  ({len(times)} calls)", file=sys.stderr)
+
+    # ru_maxrss is in KiB on Linux
+    return {"operations": results, "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def worker_main(args):
+    # The apps print to stdout; keep it for the result line only
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    result = run_worker(args.worker, args.dataset, args.repeat, args.op_budget)
+    stdout.write(RESULT_MARKER + json.dumps(result) + "\n")
+    stdout.flush()
+
+
+# ===== ORCHESTRATOR =====
+
+def ensure_dataset(data_dir: str, users: int, messages: int, seed: int, database_url: str = None) -> str:
+    dataset_dir = os.path.join(data_dir, f"u{users}_m{messages}_s{seed}")
+    if os.path.exists(os.path.join(dataset_dir, "dataset.json")):
+        return dataset_dir
+    print(f"🧪 Generating dataset: {users} users, {messages} messages")
+    generate(DatasetSpec(users, messages, seed=seed), dataset_dir, "both", database_url)
+    return dataset_dir
+
+
+def prepare_scratch(backend: str, dataset_dir: str, scratch_dir: str):
+    shutil.copy(os.path.join(dataset_dir, "dataset.json"), scratch_dir)
+    if backend in ("json", "memory", "sharded"):
+        for name in JSON_FILES:
+            shutil.copy(os.path.join(dataset_dir, name), scratch_dir)
+    elif os.path.exists(os.path.join(dataset_dir, "chatapp.db")):
+        # Datasets generated into --database-url have no SQLite file to copy
+        shutil.copy(os.path.join(dataset_dir, "chatapp.db"), scratch_dir)
+
+
+def run_backend(backend: str, dataset_dir: str, args) -> dict:
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        if args.in_place:
+            workdir = dataset_dir
+        else:
+            prepare_scratch(backend, dataset_dir, scratch_dir)
+            workdir = scratch_dir
+        env["STORAGE_ENGINE"] = backend
+        env["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'chatapp.db')}"
+        # The background loops never get to run here, but keep startup quiet and cheap
+        env.setdefault("ATTACHMENT_GC_INTERVAL", "0")
+        command = [sys.executable, os.path.abspath(__file__), "--worker", backend, "--dataset", workdir,
+                   "--repeat", str(args.repeat), "--op-budget", str(args.op_budget)]
+        start = time.perf_counter()
+        try:
+            proc = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.PIPE, timeout=args.timeout,
+                                  text=True)
+        except subprocess.TimeoutExpired:
+            print(f"   ⏱️  {backend} did not finish within {args.timeout}s")
+            return {"error": f"timeout after {args.timeout}s"}
+
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+            result["seconds"] = round(time.perf_counter() - start, 1)
+            return result
+    print(f"   ❌ {backend} failed (exit code {proc.returncode})")
+    return {"error": f"exit code {proc.returncode}"}
+
+
+def print_table(results: list, backends: list):
+    for backend in backends:
+        runs = [(r["label"], r["backends"].get(backend, {})) for r in results]
+        names = []
+        for _, run in runs:
+            for name in run.get("operations", {}):
+                if name not in names:
+                    names.append(name)
+        print("\n" + "=" * (30 + 14 * len(runs)))
+        print(f"📊 {backend}: p50 ms per call (columns: users/messages)")
+        print(f"{'operation':30}" + "".join(f"{label:>14}" for label, _ in runs))
+        print("-" * (30 + 14 * len(runs)))
+        for name in names:
+            row = ""
+            for _, run in runs:
+                stats = run.get("operations", {}).get(name)
+                row += f"{stats['p50_ms']:14.2f}" if stats else f"{'-':>14}"
+            print(f"{name:30}{row}")
+        print(f"{'peak memory (MB)':30}" + "".join(
+            f"{run['peak_rss_mb']:14.1f}" if "peak_rss_mb" in run else f"{run.get('error', '-')[:13]:>14}"
+            for _, run in runs))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark each endpoint's storage path at growing dataset sizes")
+    parser.add_argument("--sizes", default="1k:10k,10k:100k,100k:1m",
+                        help="Comma-separated users:messages pairs (k/m suffixes allowed)")
+    parser.add_argument("--backends", default="json,sql,memory", help="Storage engines to run (json, sql, memory, sharded)")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls per operation")
+    parser.add_argument("--op-budget", type=float, default=10, help="Stop repeating an operation after this many seconds")
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up on one backend/size after this many seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Where generated datasets are cached")
+    parser.add_argument("--database-url", help="Use this database instead of each dataset's SQLite file (one size only)")
+    parser.add_argument("--in-place", action="store_true", help="Benchmark the dataset itself instead of a scratch copy")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/storage_<commit>_<time>.json)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--dataset", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args)
+        return
+
+    sizes = parse_sizes(args.sizes)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if args.database_url and len(sizes) > 1:
+        parser.error("--database-url holds one dataset; pass a single --sizes entry")
+
+    commit = git_commit()
+    print(f"🚀 Storage benchmark (commit {commit}): sizes {args.sizes}, backends {', '.join(backends)}")
+    results = []
+    for users, messages in sizes:
+        dataset_dir = ensure_dataset(args.data_dir, users, messages, args.seed, args.database_url)
+        label = f"{short_count(users)}/{short_count(messages)}"
+        entry = {"label": label, "users": users, "messages": messages, "backends": {}}
+        for backend in backends:
+            print(f"\n⏱️  {backend} @ {label}")
+            entry["backends"][backend] = run_backend(backend, dataset_dir, args)
+        results.append(entry)
+
+    print_table(results, backends)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"storage_{commit}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "settings": {"repeat": args.repeat, "op_budget": args.op_budget, "seed": args.seed,
+                         "database_url": bool(args.database_url)},
+            "sizes": results,
+        }, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
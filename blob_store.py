@@ -0,0 +1,240 @@
+"""
+Content-addressed, deduplicated storage for chat attachments.
+
+Every attachment is stored once under its SHA-256 in
+CHAT_FILES_DIR/.blobs/<ab>/<cd>/<sha256> and published as "<sha256><ext>",
+so identical uploads (forwarded images, re-sent videos) share one copy on
+disk. A SQLite index next to the blobs (.blobs/index.db) keeps:
+
+- blobs: sha256 -> size and creation time
+- refs: one row per (blob, message id) referencing it (its reference count)
+- names: legacy file names (from file_url values written before the blob
+  store existed) -> sha256, so old links keep working after migration
+
+Adding or dropping a reference touches one row instead of rewriting the
+whole index, and SQLite's file lock serializes writers across workers, so
+concurrent sends cannot lose each other's references.
+
+Files that were never migrated are still served from CHAT_FILES_DIR itself,
+using the sharded layout from sharding.py.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+import sharding
+
+BLOB_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+BUSY_TIMEOUT_SECONDS = 10
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    sha256 TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    PRIMARY KEY (sha256, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_names_sha256 ON names (sha256);
+"""
+
+
+class BlobStore:
+    def __init__(self, chat_files_dir: str):
+        self.chat_files_dir = chat_files_dir
+        self.blobs_dir = os.path.join(chat_files_dir, ".blobs")
+        self.tmp_dir = os.path.join(self.blobs_dir, "tmp")
+        self.index_file = os.path.join(self.blobs_dir, "index.db")
+        self._local = threading.local()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._db().executescript(INDEX_SCHEMA)
+
+    # ----- paths -----
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], sha256[2:4], sha256)
+
+    def temp_path(self) -> str:
+        """Scratch path for an upload whose hash is not known yet"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    @staticmethod
+    def public_name(sha256: str, original_name: str) -> str:
+        ext = os.path.splitext(original_name or "")[1].lower()
+        if not re.match(r"^\.[A-Za-z0-9]+$", ext):
+            ext = ""
+        return f"{sha256}{ext}"
+
+    @staticmethod
+    def is_content_addressed(filename: str) -> bool:
+        """Content-addressed names can never point at different bytes"""
+        return bool(BLOB_NAME_RE.match(filename))
+
+    @staticmethod
+    def filename_from_url(file_url: Optional[str]) -> Optional[str]:
+        if not file_url:
+            return None
+        return file_url.rstrip("/").rsplit("/", 1)[-1] or None
+
+    # ----- index -----
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.index_file, timeout=BUSY_TIMEOUT_SECONDS,
+                                                      isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction on the index. BEGIN IMMEDIATE takes SQLite's write
+        lock up front, so it also serializes blob file changes across workers.
+        """
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _write(self, *statements) -> sqlite3.Connection:
+        """Run (sql, params) statements in one write transaction"""
+        with self._transaction() as conn:
+            for sql, params in statements:
+                conn.execute(sql, params)
+        return conn
+
+    def sha_for_name(self, filename: str) -> Optional[str]:
+        match = BLOB_NAME_RE.match(filename)
+        if match:
+            return match.group(1)
+        row = self._db().execute("SELECT sha256 FROM names WHERE name = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    # ----- blobs -----
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.blob_path(sha256))
+
+    def commit(self, tmp_path: str, sha256: str, original_name: str, size: Optional[int] = None) -> str:
+        """
+        Move a fully written temp file into the store and return its public name.
+        If the content is already stored the temp file is simply dropped and
+        the blob's mtime refreshed, so the GC grace period covers the new use.
+        """
+        path = self.blob_path(sha256)
+        with self._transaction() as conn:
+            if self.exists(sha256):
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                sharding.ensure_parent(path)
+                os.replace(tmp_path, path)
+            size = size if size is not None else os.path.getsize(path)
+            conn.execute("INSERT INTO blobs (sha256, size, created_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT (sha256) DO UPDATE SET size = excluded.size WHERE blobs.size IS NULL",
+                         (sha256, size, time.time()))
+        return self.public_name(sha256, original_name)
+
+    def claim(self, sha256: str, original_name: str) -> Optional[str]:
+        """Public name for already-stored content, or None if it must be uploaded"""
+        if not BLOB_NAME_RE.match(sha256):
+            return None
+        # Checked and touched under the index lock, so a GC pass cannot delete it in between
+        with self._transaction():
+            if not self.exists(sha256):
+                return None
+            os.utime(self.blob_path(sha256))
+        return self.public_name(sha256, original_name)
+
+    def delete_unreferenced(self, sha256: str, older_than: float) -> bool:
+        """
+        Delete a blob unless a message references it or it was stored or
+        claimed after older_than, and drop it from the index. The checks and
+        the delete share commit()'s and claim()'s lock, so a dedupe hit
+        racing a GC pass either keeps the blob or finds it gone.
+        """
+        with self._transaction() as conn:
+            path = self.blob_path(sha256)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if st.st_mtime > older_than or self._count_refs(conn, sha256):
+                return False
+            os.remove(path)
+            for table in ("blobs", "refs", "names"):
+                conn.execute(f"DELETE FROM {table} WHERE sha256 = ?", (sha256,))
+        return True
+
+    def register_name(self, filename: str, sha256: str):
+        """Map a legacy file name onto a stored blob"""
+        self._write(("INSERT OR REPLACE INTO names (name, sha256) VALUES (?, ?)", (filename, sha256)))
+
+    def resolve(self, filename: str) -> Optional[str]:
+        """Path on disk for a public file name, or None if there is no such file"""
+        if not sharding.is_valid_name(filename):
+            return None
+        sha256 = self.sha_for_name(filename)
+        if sha256 and self.exists(sha256):
+            return self.blob_path(sha256)
+        # Not moved into the blob store yet
+        return sharding.resolve(self.chat_files_dir, filename)
+
+    # ----- reference counting -----
+
+    def add_ref(self, file_url: Optional[str], message_id: str) -> bool:
+        filename = self.filename_from_url(file_url)
+        sha256 = self.sha_for_name(filename) if filename else None
+        if not sha256:
+            return False
+        self._write(
+            ("INSERT OR IGNORE INTO blobs (sha256, size, created_at) VALUES (?, NULL, ?)", (sha256, time.time())),
+            ("INSERT OR IGNORE INTO refs (sha256, message_id) VALUES (?, ?)", (sha256, message_id)),
+        )
+        return True
+
+    def release_ref(self, file_url: Optional[str], message_id: str) -> int:
+        """Drop a message's reference. Returns the remaining reference count."""
+        filename = self.filename_from_url(file_url)
+        sha256 = self.sha_for_name(filename) if filename else None
+        if not sha256:
+            return 0
+        conn = self._write(("DELETE FROM refs WHERE sha256 = ? AND message_id = ?", (sha256, message_id)))
+        return self._count_refs(conn, sha256)
+
+    @staticmethod
+    def _count_refs(conn: sqlite3.Connection, sha256: str) -> int:
+        return conn.execute("SELECT COUNT(*) FROM refs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+    def refcount(self, sha256: str) -> int:
+        return self._count_refs(self._db(), sha256)
+
+    def stats(self) -> dict:
+        conn = self._db()
+        blobs, stored_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "blobs": blobs,
+            "legacy_names": conn.execute("SELECT COUNT(*) FROM names").fetchone()[0],
+            "stored_bytes": stored_bytes,
+            "references": conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0],
+        }
@@ -0,0 +1,811 @@
+"""
+The chat server: one FastAPI app over a pluggable storage engine.
+
+Endpoints only talk to `storage` (see storage_engine.py), so main.py (JSON
+files) and main_with_db.py (SQLAlchemy) are the same app with a different
+STORAGE_ENGINE, and a fix or speed-up made here reaches both.
+
+    STORAGE_ENGINE=json|sql|memory|sharded uvicorn chat_server:app
+"""
+
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, Request
+from fastapi.responses import HTMLResponse, Response
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+import os
+import asyncio
+from typing import List, Optional
+from datetime import datetime, timezone
+
+from delivery import hub, serve_websocket, message_event, presence_event
+from uploads import receive_upload, UploadTooLarge, InvalidUpload, MAX_CHAT_FILE_SIZE
+from resumable_uploads import ResumableUploadStore, create_resumable_router
+from blob_store import BlobStore
+from media_response import MediaFileResponse, guess_media_type
+from fast_json import json_response
+from sessions import SessionStore, SessionInfo
+from passwords import PasswordHasher
+from rate_limit import RateLimiter, RateLimitMiddleware
+from storage_engine import create_storage
+from frontend import PrecompressedPage
+import metrics
+import instrumentation
+import replica_routing
+import thumbnails
+import attachment_gc
+from starlette.concurrency import run_in_threadpool
+
+
+app = FastAPI()
+
+# Per-route request counts, latency and size histograms, served at /metrics
+request_metrics = metrics.RequestMetrics()
+app.add_middleware(metrics.MetricsMiddleware, metrics=request_metrics)
+
+# Users, presence and messages (STORAGE_ENGINE=json|sql|memory|sharded)
+storage = create_storage()
+
+# Storage time per request (Server-Timing header when STORAGE_TIMING_HEADER=1)
+instrumentation.set_metrics(request_metrics)
+storage.instrument()
+app.add_middleware(instrumentation.StorageStatsMiddleware)
+# Engine-specific middleware and metrics (the sql engine's replica routing)
+storage.install(app, request_metrics)
+
+CHAT_FILES_DIR = "./chat_files"
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = "admin"
+# Accept the built-in admin/admin login (main.py turns this on)
+BUILTIN_ADMIN_LOGIN = os.getenv("BUILTIN_ADMIN_LOGIN", "").lower() in ("1", "true", "yes")
+SEARCH_RESULTS_LIMIT = 10
+WS_POLICY_VIOLATION = 1008
+MAX_MESSAGES_PAGE_SIZE = 1000
+GROUP_MESSAGES_PAGE_SIZE = 100
+# Messages are stored once per group, so size is bounded by push fan-out and member listings, not storage
+MAX_GROUP_SIZE = int(os.getenv("MAX_GROUP_SIZE", "1000"))
+
+os.makedirs(CHAT_FILES_DIR, exist_ok=True)
+
+# Content-addressed attachment storage; identical uploads share one copy
+blob_store = BlobStore(CHAT_FILES_DIR)
+
+# Resumable uploads for large attachments on flaky connections
+resumable_uploads = ResumableUploadStore(CHAT_FILES_DIR)
+
+# chat.html, cached and precompressed (reloaded on change when DEV_MODE=1)
+chat_page = PrecompressedPage("chat.html")
+
+# scrypt hashing on its own bounded pool so logins cannot starve other endpoints
+password_hasher = PasswordHasher()
+
+# Session tokens issued on signup/login, validated from memory and persisted by the engine (except memory)
+session_store = SessionStore(storage.session_backend())
+# Writes pin their user's reads to the primary (sql engine with a replica)
+replica_routing.set_identify(session_store.username_for)
+
+# Per-user token buckets and per-class concurrency limits on write endpoints
+rate_limiter = RateLimiter(identify=session_store.username_for)
+# Upload bodies are the expensive part, so these are admitted before any of the body is read
+for method, path, limit_class in (("POST", "/upload_chat_file", "upload"), ("POST", "/upload_file", "upload"),
+                                  ("POST", "/uploads", "chunk"), ("GET", "/uploads/{upload_id}", "chunk"),
+                                  ("PUT", "/uploads/{upload_id}", "chunk"), ("DELETE", "/uploads/{upload_id}", "chunk"),
+                                  ("POST", "/uploads/{upload_id}/finalize", "chunk")):
+    rate_limiter.limit_route(method, path, limit_class)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# Allow all origins for testing; restrict in production. Outermost, so 429s
+# from the rate limiter carry CORS headers too
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+request_metrics.register_collector(metrics.rate_limiter_samples(rate_limiter))
+request_metrics.register_collector(metrics.password_hasher_samples(password_hasher))
+request_metrics.register_collector(metrics.session_store_samples(session_store))
+request_metrics.register_collector(metrics.delivery_samples(hub))
+
+# Removes attachments no live message references any more
+attachment_collector = attachment_gc.AttachmentGC(blob_store, storage.file_urls)
+
+# Pydantic models
+class UserSignup(BaseModel):
+    username: str
+    password: str
+
+class UserLogin(BaseModel):
+    username: str
+    password: str
+
+class Message(BaseModel):
+    from_user: str
+    to_user: str
+    message: str
+    file_url: Optional[str] = None
+    file_name: Optional[str] = None
+    file_type: Optional[str] = None
+
+class MessageEdit(BaseModel):
+    message: str
+
+class MessageDelete(BaseModel):
+    username: str
+
+class GroupCreate(BaseModel):
+    name: str
+    creator: str
+    members: List[str]
+
+class GroupMembers(BaseModel):
+    group_id: str
+    username: str
+    members: List[str]
+
+class GroupMemberRemove(BaseModel):
+    group_id: str
+    username: str
+    member: str
+
+class GroupMessageSend(BaseModel):
+    group_id: str
+    from_user: str
+    message: str
+    file_url: Optional[str] = None
+    file_name: Optional[str] = None
+    file_type: Optional[str] = None
+
+class GroupRead(BaseModel):
+    group_id: str
+    username: str
+    up_to: Optional[str] = None
+
+class BanUser(BaseModel):
+    username: str
+
+class ChangePassword(BaseModel):
+    username: str
+    new_password: str
+
+class PromoteAdmin(BaseModel):
+    username: str
+    secret_key: str = "admin_secret_2026"
+
+# Helper functions
+def update_user_status(username: str, status: str):
+    if status == "offline":
+        storage.set_offline(username)
+    else:
+        storage.set_online(username)
+    hub.broadcast(presence_event(username, status))
+
+def publish_message_event(event_type: str, msg: dict):
+    # Push to both sides so the sender's other devices stay in sync too
+    event = message_event(event_type, msg)
+    hub.publish_to(msg["to"], event)
+    hub.publish_to(msg["from"], event)
+
+def require_group_member(group_id: str, username: str) -> dict:
+    group = storage.get_group(group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if username not in group["members"]:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    return group
+
+def parse_iso_timestamp(value: Optional[str], field: str) -> Optional[str]:
+    # Stored timestamps are naive UTC, so offsets are converted and dropped before any comparison
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} must be an ISO timestamp")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+def chat_file_info(filename: str, original_name: str, content_type: Optional[str]) -> dict:
+    # Determine file type
+    file_type = "file"  # default
+    content_type = content_type or ""
+    if content_type.startswith("image/"):
+        file_type = "image"
+    elif content_type.startswith("video/"):
+        file_type = "video"
+    elif content_type.startswith("audio/"):
+        file_type = "audio"
+
+    return {
+        "file_url": f"/chat_files/{filename}",
+        "file_name": original_name,
+        "file_type": file_type
+    }
+
+async def receive_chat_upload(request: Request, tmp_path: str):
+    try:
+        return await receive_upload(request, tmp_path, max_size=MAX_CHAT_FILE_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail="File size exceeds 200MB limit")
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def commit_chat_file(path: str, sha256: str, original_name: str, content_type: Optional[str]) -> dict:
+    # Duplicate content is dropped here, so only the first copy hits the blob store
+    filename = blob_store.commit(path, sha256, original_name)
+    info = chat_file_info(filename, original_name, content_type)
+    info["file_size"] = os.path.getsize(blob_store.blob_path(sha256))
+    info["sha256"] = sha256
+    add_previews(info, filename, sha256)
+    return info
+
+def add_previews(info: dict, filename: str, sha256: str):
+    # Thumbnails are derived in the background; their URLs are valid right away
+    if not thumbnails.can_preview(info["file_type"]):
+        return
+    path = blob_store.blob_path(sha256)
+    thumbnails.pipeline.submit(path, info["file_type"])
+    info.update(thumbnails.preview_payload(
+        thumbnails.load_meta(path),
+        lambda size: f"/chat_thumbs/{size}/{filename}"
+    ))
+
+async def wait_for_previews(info: dict):
+    # Give the pool a moment so the response can carry dimensions and a placeholder
+    if "thumbnails" not in info or "width" in info:
+        return
+    meta = await thumbnails.pipeline.wait(
+        blob_store.blob_path(info["sha256"]), info["file_type"], thumbnails.PREVIEW_WAIT_SECONDS
+    )
+    if meta:
+        info.update(thumbnails.preview_payload(meta, lambda size: info["thumbnails"][str(size)]))
+
+def claim_chat_file(sha256: str, original_name: str, content_type: Optional[str]) -> Optional[dict]:
+    filename = blob_store.claim(sha256, original_name)
+    if filename is None:
+        return None
+    info = chat_file_info(filename, original_name, content_type)
+    info["file_size"] = os.path.getsize(blob_store.blob_path(sha256))
+    info["sha256"] = sha256
+    add_previews(info, filename, sha256)
+    return info
+
+# ===== STARTUP / SHUTDOWN =====
+
+@app.on_event("startup")
+def init_storage():
+    storage.init()
+
+@app.on_event("startup")
+async def start_resumable_upload_gc():
+    asyncio.create_task(resumable_uploads.gc_loop())
+
+@app.on_event("startup")
+async def start_session_purge():
+    asyncio.create_task(session_store.purge_loop())
+
+@app.on_event("startup")
+async def start_attachment_gc():
+    if attachment_gc.ATTACHMENT_GC_INTERVAL > 0:
+        asyncio.create_task(attachment_collector.loop())
+
+@app.on_event("startup")
+async def start_metrics_flush():
+    asyncio.create_task(request_metrics.flush_loop())
+
+@app.on_event("startup")
+def load_chat_page():
+    chat_page.load()
+
+@app.on_event("shutdown")
+def stop_preview_pipeline():
+    thumbnails.pipeline.shutdown()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(request_metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# ===== AUTHENTICATION =====
+
+# signup, login and change_password are async: storage work runs in the
+# threadpool and the password hash on password_hasher's pool, so waiting for
+# a hash never ties up a request thread.
+
+@app.post("/signup")
+async def signup(user: UserSignup):
+    if len(user.username) < 3:
+        raise HTTPException(status_code=400, detail="Username must be at least 3 characters")
+
+    if await run_in_threadpool(storage.get_user, user.username):
+        raise HTTPException(status_code=400, detail="Username already exists")
+
+    password_hash = await password_hasher.hash(user.password)
+    # Re-checked on insert: another signup may have taken the name while we were hashing
+    if not await run_in_threadpool(storage.create_user, user.username, password_hash, user.password):
+        raise HTTPException(status_code=400, detail="Username already exists")
+    await run_in_threadpool(update_user_status, user.username, "online")
+
+    token = session_store.issue(user.username)
+    return {"message": "User created successfully", "username": user.username, "token": token}
+
+@app.post("/login")
+async def login(user: UserLogin):
+    # Check for admin login
+    if BUILTIN_ADMIN_LOGIN and user.username == ADMIN_USERNAME and user.password == ADMIN_PASSWORD:
+        token = session_store.issue(user.username, is_admin=True)
+        await run_in_threadpool(update_user_status, user.username, "online")
+        # Return both keys for compatibility
+        return {"message": "Admin login successful", "username": user.username, "token": token, "is_admin": True, "admin": True}
+
+    db_user = await run_in_threadpool(storage.get_user, user.username)
+    if db_user and db_user["is_banned"]:
+        raise HTTPException(status_code=403, detail="Your account has been banned")
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # Legacy SHA-256 hashes verify too and come back upgraded to scrypt
+    ok, upgraded_hash = await password_hasher.verify(user.password, db_user["password"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    def finish_login():
+        if upgraded_hash:
+            storage.update_user(user.username, password=upgraded_hash)
+        update_user_status(user.username, "online")
+
+    await run_in_threadpool(finish_login)
+
+    is_admin_flag = db_user["is_admin"]
+    token = session_store.issue(user.username, is_admin=is_admin_flag)
+
+    # Return both keys for compatibility with older frontends
+    return {"message": "Login successful", "username": user.username, "token": token, "is_admin": is_admin_flag, "admin": is_admin_flag}
+
+@app.post("/logout/{username}")
+def logout(username: str, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, username)
+    if session is not None:
+        session_store.revoke_hash(session.token_hash)
+    update_user_status(username, "offline")
+    return {"message": "Logged out successfully"}
+
+# ===== PRESENCE =====
+
+@app.post("/heartbeat/{username}", dependencies=[Depends(rate_limiter.limit("heartbeat"))])
+def heartbeat(username: str, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, username)
+    # Check if user is banned
+    user = storage.get_user(username)
+    if user and user["is_banned"]:
+        raise HTTPException(status_code=403, detail="User has been banned")
+
+    # Update user's last seen time
+    update_user_status(username, "online")
+    return {"status": "ok", "is_banned": False}
+
+@app.get("/online_status/{username}")
+def get_online_status(username: str):
+    last_seen = storage.last_seen(username)
+    if last_seen is None:
+        return {"username": username, "status": "offline", "last_seen": None}
+    return {"username": username, "status": "online", "last_seen": last_seen}
+
+@app.get("/all_online_status")
+def get_all_online_status():
+    # Users without a heartbeat in the last ONLINE_TIMEOUT_SECONDS are left out
+    return {
+        username: {"status": "online", "last_seen": last_seen}
+        for username, last_seen in storage.online_users().items()
+    }
+
+@app.get("/check_ban_status/{username}")
+def check_ban_status(username: str):
+    """Check if a user is currently banned"""
+    user = storage.get_user(username)
+    return {"username": username, "is_banned": bool(user and user["is_banned"])}
+
+# ===== MESSAGES =====
+
+@app.get("/search_users/{query}")
+def search_users(query: str):
+    # Search for users whose username contains the query (case-insensitive)
+    return {"users": storage.search_users(query, SEARCH_RESULTS_LIMIT)}
+
+@app.post("/send_message", dependencies=[Depends(rate_limiter.limit("message"))])
+def send_message(msg: Message, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, msg.from_user)
+
+    # Verify both users exist
+    existing = storage.existing_usernames((msg.from_user, msg.to_user))
+    if msg.from_user not in existing:
+        raise HTTPException(status_code=404, detail="Sender not found")
+    if msg.to_user not in existing:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+
+    new_message = storage.add_message(msg.from_user, msg.to_user, msg.message,
+                                      msg.file_url, msg.file_name, msg.file_type)
+    blob_store.add_ref(msg.file_url, new_message["id"])
+    publish_message_event("message", new_message)
+
+    # "id" is what main_with_db.py returned, "message_id" what main.py returned
+    return {"message": "Message sent successfully", "message_id": new_message["id"], "id": new_message["id"]}
+
+@app.get("/get_messages/{from_user}/{to_user}")
+def get_messages(from_user: str, to_user: str, request: Request, before: Optional[str] = None,
+                 limit: Optional[int] = None, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, from_user)
+    if before is None and limit is None:
+        # Messages deleted for this user or for everyone are left out
+        messages = storage.conversation(from_user, to_user, viewer=from_user)
+        return json_response({"messages": messages}, request.headers)
+
+    # Paging back through history (?before=<oldest timestamp shown>&limit=N), into the archive if needed
+    before = parse_iso_timestamp(before, "before")
+    limit = max(1, min(limit or MAX_MESSAGES_PAGE_SIZE, MAX_MESSAGES_PAGE_SIZE))
+    messages = storage.conversation(from_user, to_user, viewer=from_user, before=before, limit=limit + 1)
+    return json_response({"messages": messages[-limit:], "has_more": len(messages) > limit}, request.headers)
+
+@app.get("/get_conversations/{username}")
+def get_conversations(username: str, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, username)
+    return {"conversations": storage.contacts(username)}
+
+@app.put("/edit_message/{message_id}", dependencies=[Depends(rate_limiter.limit("message"))])
+def edit_message(message_id: str, msg_edit: MessageEdit, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    message = storage.get_message(message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    session_store.authorize(session, message["from"])
+
+    message = storage.edit_message(message_id, msg_edit.message)
+    publish_message_event("message_edited", message)
+    return {"message": "Message edited successfully"}
+
+@app.delete("/delete_message/{message_id}/{delete_type}", dependencies=[Depends(rate_limiter.limit("message"))])
+def delete_message(message_id: str, delete_type: str, delete_data: Optional[MessageDelete] = None,
+                   session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    # The acting user comes from the session, or from the body for clients without one
+    if delete_data is not None:
+        session_store.authorize(session, delete_data.username)
+    username = session.username if session is not None else (delete_data.username if delete_data else None)
+    if not username:
+        raise HTTPException(status_code=401, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+    if delete_type not in ("everyone", "me"):
+        raise HTTPException(status_code=400, detail="Invalid delete type")
+
+    message = storage.get_message(message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    if delete_type == "everyone":
+        # Verify the user deleting is the sender
+        if username != message["from"]:
+            raise HTTPException(status_code=403, detail="Only sender can delete for everyone")
+        message = storage.delete_for_everyone(message_id)
+        blob_store.release_ref(message.get("file_url"), message["id"])
+        publish_message_event("message_deleted", message)
+    else:
+        if username not in (message["from"], message["to"]):
+            raise HTTPException(status_code=403, detail="Not your conversation")
+        message = storage.delete_for_user(message_id, username)
+        hub.publish_to(username, message_event("message_deleted", message))
+    return {"message": "Message deleted successfully"}
+
+# ===== GROUPS =====
+# A group message is stored once and pushed to the members online now; the rest catch
+# up from their read cursor (fan-out on read), instead of one copy per member
+
+@app.post("/create_group")
+def create_group(group: GroupCreate, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, group.creator)
+    if not group.name.strip():
+        raise HTTPException(status_code=400, detail="Group name is required")
+    usernames = set(group.members) | {group.creator}
+    if len(usernames) > MAX_GROUP_SIZE:
+        raise HTTPException(status_code=400, detail=f"Groups are limited to {MAX_GROUP_SIZE} members")
+    unknown = usernames - storage.existing_usernames(usernames)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Users not found: {', '.join(sorted(unknown))}")
+
+    created = storage.create_group(group.name.strip(), group.creator, group.members)
+    hub.publish_to_many(created["members"], {"type": "group_created", "group": created})
+    return {"message": "Group created successfully", "group": created}
+
+@app.get("/get_groups/{username}")
+def get_groups(username: str, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, username)
+    # Each with its unread count, computed from the member's read cursor
+    return {"groups": storage.user_groups(username)}
+
+@app.post("/add_group_members")
+def add_group_members(data: GroupMembers, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, data.username)
+    group = require_group_member(data.group_id, data.username)
+    new_members = set(data.members) - set(group["members"])
+    if len(group["members"]) + len(new_members) > MAX_GROUP_SIZE:
+        raise HTTPException(status_code=400, detail=f"Groups are limited to {MAX_GROUP_SIZE} members")
+    unknown = new_members - storage.existing_usernames(new_members)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Users not found: {', '.join(sorted(unknown))}")
+
+    storage.add_group_members(data.group_id, new_members)
+    group = storage.get_group(data.group_id)
+    hub.publish_to_many(group["members"], {"type": "group_members", "group": group})
+    return {"message": "Members added successfully", "group": group}
+
+@app.post("/remove_group_member")
+def remove_group_member(data: GroupMemberRemove, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, data.username)
+    group = require_group_member(data.group_id, data.username)
+    # Anyone can leave; only the creator can remove others
+    if data.member != data.username and data.username != group["created_by"]:
+        raise HTTPException(status_code=403, detail="Only the group creator can remove members")
+    if not storage.remove_group_member(data.group_id, data.member):
+        raise HTTPException(status_code=404, detail="Not a member of this group")
+
+    event = {"type": "group_members", "group": storage.get_group(data.group_id)}
+    hub.publish_to_many(group["members"], event)
+    return {"message": "Member removed successfully"}
+
+@app.post("/send_group_message", dependencies=[Depends(rate_limiter.limit("message"))])
+def send_group_message(msg: GroupMessageSend, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, msg.from_user)
+    group = require_group_member(msg.group_id, msg.from_user)
+
+    new_message = storage.add_group_message(msg.group_id, msg.from_user, msg.message,
+                                            msg.file_url, msg.file_name, msg.file_type)
+    blob_store.add_ref(msg.file_url, new_message["id"])
+    # One event object for every connected member, the sender's other devices included
+    hub.publish_to_many(group["members"], message_event("group_message", new_message))
+    return {"message": "Message sent successfully", "id": new_message["id"]}
+
+@app.get("/get_group_messages/{group_id}/{username}")
+def get_group_messages(group_id: str, username: str, request: Request, before: Optional[str] = None,
+                       limit: Optional[int] = None, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, username)
+    require_group_member(group_id, username)
+    before = parse_iso_timestamp(before, "before")
+
+    limit = max(1, min(limit or GROUP_MESSAGES_PAGE_SIZE, MAX_MESSAGES_PAGE_SIZE))
+    messages = storage.group_messages(group_id, before=before, limit=limit + 1)
+    return json_response({"messages": messages[-limit:], "has_more": len(messages) > limit}, request.headers)
+
+@app.post("/mark_group_read")
+def mark_group_read(data: GroupRead, session: Optional[SessionInfo] = Depends(session_store.optional_session)):
+    session_store.authorize(session, data.username)
+    require_group_member(data.group_id, data.username)
+    up_to = parse_iso_timestamp(data.up_to, "up_to")
+    if up_to is None:
+        # Everything so far: the newest message's timestamp
+        newest = storage.group_messages(data.group_id, limit=1)
+        up_to = newest[0]["timestamp"] if newest else None
+    last_read_at = None
+    if up_to is not None:
+        last_read_at = storage.mark_group_read(data.group_id, data.username, up_to)
+        if last_read_at is None:
+            raise HTTPException(status_code=404, detail="Not a member of this group")
+    return {"message": "Marked as read", "last_read_at": last_read_at}
+
+# ===== ATTACHMENTS =====
+
+@app.post("/upload_chat_file")
+async def upload_chat_file(request: Request):
+    # The multipart body is parsed as it arrives and the file streamed to a scratch file;
+    # the 200MB limit is enforced as bytes arrive
+    tmp_path = blob_store.temp_path()
+    file = await receive_chat_upload(request, tmp_path)
+
+    info = await run_in_threadpool(commit_chat_file, tmp_path, file.sha256, file.filename, file.content_type)
+    await wait_for_previews(info)
+    return info
+
+# Resumable chunked uploads (create, PUT chunks, query offset, finalize), limited as the
+# "chunk" class by RateLimitMiddleware
+app.include_router(create_resumable_router(resumable_uploads, commit_chat_file, claim_chat_file))
+
+@app.get("/chat_files/{filename}")
+def get_chat_file(filename: str, request: Request):
+    file_path = blob_store.resolve(filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+    # Supports Range for video seeking and ETag revalidation; the type comes from the
+    # public name's extension, since blobs are stored without one
+    return MediaFileResponse(
+        file_path,
+        request.headers,
+        media_type=guess_media_type(filename),
+        content_hash=blob_store.sha_for_name(filename),
+        immutable=blob_store.is_content_addressed(filename)
+    )
+
+@app.get("/download_chat_file/{filename}")
+def download_chat_file(filename: str, request: Request):
+    """Attachment URLs stored by main.py before both apps served /chat_files"""
+    file_path = blob_store.resolve(filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return MediaFileResponse(
+        file_path,
+        request.headers,
+        filename=filename.split("_", 2)[-1] if "_" in filename else filename,
+        media_type=guess_media_type(filename),
+        content_hash=blob_store.sha_for_name(filename),
+        immutable=blob_store.is_content_addressed(filename)
+    )
+
+@app.get("/chat_thumbs/{size}/{filename}")
+async def get_chat_thumbnail(size: int, filename: str, request: Request):
+    file_path = blob_store.resolve(filename)
+    if not file_path or size not in thumbnails.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    thumb_path = thumbnails.thumbnail_path(file_path, size)
+    if not os.path.exists(thumb_path):
+        # Not derived yet (or uploaded before the pipeline existed): derive now
+        meta = await thumbnails.pipeline.wait(file_path, thumbnails.guess_file_type(filename))
+        if not meta:
+            raise HTTPException(status_code=404, detail="Preview not available")
+
+    return MediaFileResponse(
+        thumb_path,
+        request.headers,
+        immutable=blob_store.is_content_addressed(filename)
+    )
+
+@app.post("/upload_file")
+async def upload_file(request: Request):
+    tmp_path = blob_store.temp_path()
+    file = await receive_chat_upload(request, tmp_path)
+
+    filename = await run_in_threadpool(blob_store.commit, tmp_path, file.sha256, file.filename, file.size)
+
+    return {
+        "file_url": f"/get_file/{filename}",
+        "file_name": file.filename
+    }
+
+@app.get("/get_file/{filename}")
+def get_file(filename: str, request: Request):
+    file_path = blob_store.resolve(filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return MediaFileResponse(
+        file_path,
+        request.headers,
+        media_type=guess_media_type(filename),
+        content_hash=blob_store.sha_for_name(filename),
+        immutable=blob_store.is_content_addressed(filename)
+    )
+
+# ===== PUSH DELIVERY =====
+
+@app.websocket("/ws/{username}")
+async def websocket_endpoint(websocket: WebSocket, username: str):
+    """Push channel for new messages, edits, deletes and presence updates (needs ?token=)"""
+    if await run_in_threadpool(session_store.socket_session, websocket, username) is None:
+        # Closing before accept rejects the handshake with a 403
+        await websocket.close(code=WS_POLICY_VIOLATION)
+        return
+    await serve_websocket(websocket, username)
+
+@app.get("/delivery/metrics")
+def delivery_metrics():
+    """Outbound queue depths and drop counters for connected clients"""
+    return hub.metrics()
+
+# ===== ADMIN ENDPOINTS =====
+
+@app.post("/admin/promote_to_admin")
+def promote_to_admin(req: PromoteAdmin):
+    # Simple secret key check
+    if req.secret_key != "admin_secret_2026":
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+
+    if not storage.update_user(req.username, is_admin=True):
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": f"User {req.username} promoted to admin", "username": req.username, "is_admin": True}
+
+@app.get("/admin/all_users", dependencies=[Depends(session_store.require_admin)])
+def get_all_users(request: Request):
+    """Get all registered users for admin"""
+    return json_response({
+        "users": [
+            {
+                "username": user["username"],
+                "is_admin": user["is_admin"],
+                "is_banned": user["is_banned"],
+                "created_at": user["created_at"],
+                "password": user["plain_password"] or "[Old user - no password stored]",  # Plain password
+                "password_hash": user["password"][:16] + "..." if user["password"] else "N/A"  # Show first 16 chars of hash
+            }
+            for user in storage.list_users()
+        ]
+    }, request.headers)
+
+@app.get("/admin/all_conversations", dependencies=[Depends(session_store.require_admin)])
+def get_all_conversations():
+    """Get all conversations for admin panel"""
+    return {"conversations": storage.conversation_summaries()}
+
+@app.get("/admin/messages/{user1}/{user2}", dependencies=[Depends(session_store.require_admin)])
+def get_admin_messages(user1: str, user2: str, request: Request):
+    """Get all messages between two users (admin view - no filtering)"""
+    return json_response({"messages": storage.conversation(user1, user2)}, request.headers)
+
+@app.post("/admin/ban_user", dependencies=[Depends(session_store.require_admin)])
+def ban_user(ban_data: BanUser):
+    """Ban a user"""
+    if not storage.update_user(ban_data.username, is_banned=True):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Remove user from online status
+    update_user_status(ban_data.username, "offline")
+    session_store.revoke_user(ban_data.username)
+    return {"message": f"User {ban_data.username} has been banned"}
+
+@app.post("/admin/unban_user", dependencies=[Depends(session_store.require_admin)])
+def unban_user(ban_data: BanUser):
+    """Unban a user"""
+    if not storage.update_user(ban_data.username, is_banned=False):
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": f"User {ban_data.username} has been unbanned"}
+
+@app.get("/admin/banned_users", dependencies=[Depends(session_store.require_admin)])
+def get_banned_users():
+    """Get list of all banned users"""
+    return {"banned_users": storage.banned_usernames()}
+
+@app.post("/admin/change_password", dependencies=[Depends(session_store.require_admin)])
+async def admin_change_password(change_data: ChangePassword):
+    """Admin can change any user's password"""
+    if not await run_in_threadpool(storage.get_user, change_data.username):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    password_hash = await password_hasher.hash(change_data.new_password)
+    # Update both hashed and plain password
+    await run_in_threadpool(storage.update_user, change_data.username,
+                            password=password_hash, plain_password=change_data.new_password)
+    session_store.revoke_user(change_data.username)
+    return {"message": f"Password for {change_data.username} has been changed successfully"}
+
+@app.post("/admin/attachment_gc", dependencies=[Depends(session_store.require_admin)])
+async def run_attachment_gc(dry_run: bool = True):
+    """Collect orphaned attachments now; dry_run (the default) only reports"""
+    return await attachment_collector.run_async(dry_run=dry_run)
+
+@app.get("/admin/attachment_gc", dependencies=[Depends(session_store.require_admin)])
+def get_attachment_gc_report():
+    """Report of the most recent GC pass"""
+    return attachment_collector.last_report or {}
+
+@app.get("/admin/rate_limits", dependencies=[Depends(session_store.require_admin)])
+def get_rate_limits():
+    """Configured limits, requests in flight and rejections per endpoint class"""
+    return rate_limiter.stats()
+
+# ===== FRONTEND =====
+
+# Serve the chat.html frontend from memory, precompressed, with ETag/304
+@app.get("/", response_class=HTMLResponse)
+@app.get("/chat", response_class=HTMLResponse)
+async def serve_chat(request: Request):
+    # Re-reading and recompressing (DEV_MODE, first request) blocks; keep it off the event loop
+    if chat_page.needs_load():
+        await run_in_threadpool(chat_page.load)
+    response = chat_page.response(request.headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="chat.html not found")
+    return response
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,65 @@
+"""
+Accept-Encoding negotiation and body compression shared by the frontend
+cache and the JSON API responses. brotli is optional; without it only gzip
+is offered.
+"""
+
+import gzip
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred order when the client accepts several encodings equally
+ENCODINGS = ("br", "gzip", "identity")
+AVAILABLE_ENCODINGS = ("br", "gzip", "identity") if brotli is not None else ("gzip", "identity")
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Map of encoding -> q-value from an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def choose_encoding(header: Optional[str], available=AVAILABLE_ENCODINGS) -> str:
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*")
+    best, best_q = "identity", -1.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q is None:
+            # identity is acceptable unless explicitly refused
+            q = 0.001 if encoding == "identity" else 0.0
+        if q > best_q and q > 0:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """
+    Compress body with a negotiated encoding. static=True spends more CPU for
+    a smaller result, for content that is compressed once and cached.
+    """
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if static else 5, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if static else 4)
+    return body
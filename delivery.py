@@ -0,0 +1,305 @@
+"""
+Push delivery layer for WebSocket clients.
+
+Every connection gets its own bounded outbound queue and a sender task, so a
+slow client (e.g. the Android WebView on a bad mobile network) only ever
+backs up its own queue. Presence updates are coalesced per user, queued
+events are sent as batched frames, and an overflowing queue either drops its
+oldest entries or disconnects the client, depending on the overflow policy.
+
+Events can be published from any thread (sync endpoints run in the
+threadpool); the sender tasks live on the event loop.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "256"))
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "50"))
+DELIVERY_SEND_TIMEOUT = float(os.getenv("DELIVERY_SEND_TIMEOUT", "10"))
+# "drop_oldest" keeps the client connected and sheds its oldest events,
+# "disconnect" closes the client so it can reconnect and resync by polling
+DELIVERY_OVERFLOW_POLICY = os.getenv("DELIVERY_OVERFLOW_POLICY", "drop_oldest")
+
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+# WebSocket close code sent when a client is disconnected for falling behind
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class Connection:
+    """One WebSocket client and its bounded outbound queue"""
+
+    def __init__(self, username: str, loop: asyncio.AbstractEventLoop,
+                 max_queue: int = DELIVERY_QUEUE_SIZE,
+                 overflow_policy: str = DELIVERY_OVERFLOW_POLICY):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.id = str(uuid.uuid4())
+        self.username = username
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.closed = False
+        self.close_reason: Optional[str] = None
+
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._events: deque = deque()
+        # Latest presence event per user; a newer update replaces the queued one
+        self._presence: "OrderedDict[str, dict]" = OrderedDict()
+
+        # Counters exposed through the metrics endpoint
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent_frames = 0
+        self.sent_events = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._events) + len(self._presence)
+
+    def enqueue(self, event: dict) -> bool:
+        """Queue an event for this client. Returns False if the client is gone."""
+        with self._lock:
+            if self.closed:
+                return False
+
+            if event.get("type") == "presence":
+                key = event.get("username")
+                if key in self._presence:
+                    self._presence[key] = event
+                    self.coalesced += 1
+                    return True
+
+            if self.depth >= self.max_queue:
+                if self.overflow_policy == "disconnect":
+                    self.closed = True
+                    self.close_reason = "outbound queue overflow"
+                    self._wake()
+                    return False
+                # Presence is cheapest to lose, so shed it before real events
+                if self._presence:
+                    self._presence.popitem(last=False)
+                else:
+                    self._events.popleft()
+                self.dropped += 1
+
+            if event.get("type") == "presence":
+                self._presence[event.get("username")] = event
+            else:
+                self._events.append(event)
+            self.max_depth = max(self.max_depth, self.depth)
+            self._wake()
+        return True
+
+    def drain(self, max_events: int = DELIVERY_BATCH_SIZE) -> List[dict]:
+        """Take up to max_events queued events, presence first"""
+        with self._lock:
+            batch = []
+            while self._presence and len(batch) < max_events:
+                batch.append(self._presence.popitem(last=False)[1])
+            while self._events and len(batch) < max_events:
+                batch.append(self._events.popleft())
+            if not self.depth and not self.closed:
+                self._wakeup.clear()
+            return batch
+
+    def close(self, reason: str):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.close_reason = reason
+            self._wake()
+
+    async def wait(self):
+        await self._wakeup.wait()
+
+    def _wake(self):
+        # May be called from a threadpool worker, so hop onto the loop
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Event loop already shut down
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "sent_frames": self.sent_frames,
+            "sent_events": self.sent_events,
+        }
+
+
+class DeliveryHub:
+    """Registry of live connections and the entry point for publishing events"""
+
+    def __init__(self, max_queue: int = DELIVERY_QUEUE_SIZE,
+                 batch_size: int = DELIVERY_BATCH_SIZE,
+                 overflow_policy: str = DELIVERY_OVERFLOW_POLICY,
+                 send_timeout: float = DELIVERY_SEND_TIMEOUT):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self._lock = threading.Lock()
+        self._connections: Dict[str, Set[Connection]] = {}
+        self.disconnects_for_overflow = 0
+        self.disconnects_for_timeout = 0
+        self.disconnects_for_send_error = 0
+
+    def register(self, username: str, loop: asyncio.AbstractEventLoop) -> Connection:
+        conn = Connection(username, loop, self.max_queue, self.overflow_policy)
+        with self._lock:
+            self._connections.setdefault(username, set()).add(conn)
+        return conn
+
+    def unregister(self, conn: Connection):
+        with self._lock:
+            conns = self._connections.get(conn.username)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del self._connections[conn.username]
+
+    def publish_to(self, username: str, event: dict) -> int:
+        """Queue an event for every connection of one user"""
+        with self._lock:
+            conns = list(self._connections.get(username, ()))
+        return self._enqueue_all(conns, event)
+
+    def publish_to_many(self, usernames: Iterable[str], event: dict) -> int:
+        """Queue one event for every connection of several users (group members); offline users are skipped"""
+        with self._lock:
+            conns = [conn for username in usernames for conn in self._connections.get(username, ())]
+        return self._enqueue_all(conns, event)
+
+    def broadcast(self, event: dict) -> int:
+        """Queue an event for every connected client"""
+        with self._lock:
+            conns = [conn for conns in self._connections.values() for conn in conns]
+        return self._enqueue_all(conns, event)
+
+    def _enqueue_all(self, conns: List[Connection], event: dict) -> int:
+        delivered = 0
+        for conn in conns:
+            was_closed = conn.closed
+            if conn.enqueue(event):
+                delivered += 1
+            elif not was_closed and conn.close_reason == "outbound queue overflow":
+                self.disconnects_for_overflow += 1
+        return delivered
+
+    def is_connected(self, username: str) -> bool:
+        with self._lock:
+            return bool(self._connections.get(username))
+
+    async def run_sender(self, conn: Connection, websocket: WebSocket):
+        """Flush a connection's queue to its socket until it closes"""
+        try:
+            while True:
+                await conn.wait()
+                if conn.closed:
+                    break
+                batch = conn.drain(self.batch_size)
+                if batch:
+                    if len(batch) == 1:
+                        frame = batch[0]
+                    else:
+                        frame = {"type": "batch", "events": batch}
+                    try:
+                        await asyncio.wait_for(
+                            websocket.send_text(json.dumps(frame, default=str)),
+                            timeout=self.send_timeout,
+                        )
+                    except asyncio.TimeoutError:
+                        self.disconnects_for_timeout += 1
+                        conn.close("send timeout")
+                        break
+                    except (WebSocketDisconnect, RuntimeError, OSError) as e:
+                        # Half-closed socket: stop queueing for it instead of letting the task die
+                        self.disconnects_for_send_error += 1
+                        conn.close(f"send failed: {type(e).__name__}")
+                        break
+                    conn.sent_frames += 1
+                    conn.sent_events += len(batch)
+        finally:
+            conn.close("disconnected")
+            self.unregister(conn)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            conns = [conn for conns in self._connections.values() for conn in conns]
+        stats = [conn.stats() for conn in conns]
+        depths = [s["depth"] for s in stats]
+        return {
+            "connections": len(stats),
+            "users": len({s["username"] for s in stats}),
+            "queue_capacity": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "total_queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_events": sum(s["dropped"] for s in stats),
+            "coalesced_events": sum(s["coalesced"] for s in stats),
+            "disconnects_for_overflow": self.disconnects_for_overflow,
+            "disconnects_for_timeout": self.disconnects_for_timeout,
+            "disconnects_for_send_error": self.disconnects_for_send_error,
+            "per_connection": stats,
+        }
+
+
+hub = DeliveryHub()
+
+
+async def serve_websocket(websocket: WebSocket, username: str, delivery_hub: DeliveryHub = hub):
+    """Accept a client socket and pump its queue until either side goes away"""
+    await websocket.accept()
+    conn = delivery_hub.register(username, asyncio.get_running_loop())
+    sender = asyncio.create_task(delivery_hub.run_sender(conn, websocket))
+    receiver = asyncio.create_task(_read_until_disconnect(websocket))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        conn.close("disconnected")
+        delivery_hub.unregister(conn)
+        for task in (sender, receiver):
+            task.cancel()
+        # Collect both results so a failed task never ends up as "exception was never retrieved"
+        for result in await asyncio.gather(sender, receiver, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"⚠️ WebSocket task for {username} failed: {result!r}")
+        if conn.close_reason in ("outbound queue overflow", "send timeout"):
+            try:
+                await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=conn.close_reason)
+            except Exception:
+                pass
+
+
+async def _read_until_disconnect(websocket: WebSocket):
+    # Clients only send keep-alive pings; anything they send is ignored
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+def message_event(event_type: str, message: dict) -> dict:
+    return {"type": event_type, "message": message}
+
+
+def presence_event(username: str, status: str) -> dict:
+    return {"type": "presence", "username": username, "status": status}
@@ -0,0 +1,49 @@
+"""
+Fast path for large JSON API responses.
+
+Endpoints that return big lists (conversation history, admin views) build
+plain dicts and strings already, so running them through FastAPI's
+jsonable_encoder only burns CPU. json_response serializes the payload
+directly - with orjson when it is installed, else the stdlib encoder - and
+compresses bodies above JSON_COMPRESS_MIN_SIZE with the best encoding the
+client accepts.
+"""
+
+import json
+import os
+from datetime import date, datetime
+
+from starlette.responses import Response
+
+from compression import choose_encoding, compress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_COMPRESS_MIN_SIZE = int(os.getenv("JSON_COMPRESS_MIN_SIZE", "1024"))
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def json_response(payload, request_headers=None, status_code: int = 200,
+                  min_size: int = JSON_COMPRESS_MIN_SIZE) -> Response:
+    body = dumps(payload)
+    headers = {"Vary": "Accept-Encoding"}
+    if request_headers is not None and len(body) >= min_size:
+        encoding = choose_encoding(request_headers.get("accept-encoding"))
+        if encoding != "identity":
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
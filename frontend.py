@@ -0,0 +1,83 @@
+"""
+Cached, precompressed serving of the chat.html frontend.
+
+The page is read once, compressed with gzip (and brotli when the brotli
+package is installed) and kept in memory. Each request picks the best
+encoding the client accepts and gets a strong ETag, so repeat visits are
+answered with a 304. With DEV_MODE=1 the file is re-read whenever its
+mtime or size changes, so edits show up without a restart.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from starlette.responses import Response
+
+from compression import AVAILABLE_ENCODINGS, choose_encoding, compress
+
+DEV_MODE = os.getenv("DEV_MODE", "").lower() in ("1", "true", "yes")
+
+
+class PrecompressedPage:
+    def __init__(self, path: str, media_type: str = "text/html; charset=utf-8", reload: bool = DEV_MODE):
+        self.path = path
+        self.media_type = media_type
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        # encoding -> (body, etag)
+        self._variants: Dict[str, Tuple[bytes, str]] = {}
+
+    def _current_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self) -> bool:
+        """(Re)read and compress the file. Returns False if it does not exist."""
+        with self._lock:
+            stamp = self._current_stamp()
+            if stamp is None:
+                self._stamp, self._variants = None, {}
+                return False
+            with open(self.path, "rb") as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            variants = {}
+            for encoding in AVAILABLE_ENCODINGS:
+                suffix = "" if encoding == "identity" else f"-{encoding}"
+                variants[encoding] = (compress(body, encoding, static=True), f'"{digest}{suffix}"')
+            self._stamp, self._variants = stamp, variants
+            return True
+
+    def needs_load(self) -> bool:
+        """Whether response() would have to (re)read the file first"""
+        return not self._variants or (self.reload and self._current_stamp() != self._stamp)
+
+    def response(self, request_headers) -> Optional[Response]:
+        """Response for a request, or None if the file does not exist"""
+        if self.needs_load() and not self.load():
+            return None
+        variants = self._variants
+        encoding = choose_encoding(request_headers.get("accept-encoding"), variants)
+        body, etag = variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            if "*" in tags or etag in tags or f"W/{etag}" in tags:
+                return Response(status_code=304, headers=headers)
+
+        return Response(content=body, media_type=self.media_type, headers=headers)
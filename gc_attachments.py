@@ -0,0 +1,82 @@
+"""
+Delete chat attachments that no live message references.
+
+Streams file_url references out of messages.json and group_messages.json,
+the message shards, or the database (and the message archive) and removes
+unreferenced files older than the grace period, in batches. The source
+defaults to the one STORAGE_ENGINE uses.
+
+Usage:
+    python gc_attachments.py [--dry-run] [--source json|sharded|db] [--grace-hours 168] [--batch-size 200]
+"""
+
+import argparse
+import itertools
+import os
+
+import attachment_gc
+from blob_store import BlobStore
+from storage_engine import STORAGE_ENGINE
+
+CHAT_FILES_DIR = "./chat_files"
+MESSAGES_FILE = "./messages.json"
+SOURCES = {"json": "json", "memory": "json", "sharded": "sharded", "sql": "db"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove orphaned chat attachments")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting")
+    default_source = SOURCES.get(STORAGE_ENGINE, "json")
+    parser.add_argument("--source", choices=["json", "sharded", "db"], default=default_source,
+                        help=f"Where to read message references from (default: {default_source}, from STORAGE_ENGINE)")
+    parser.add_argument("--grace-hours", type=float,
+                        default=attachment_gc.ATTACHMENT_GC_GRACE_SECONDS / 3600,
+                        help="Keep unreferenced files younger than this")
+    parser.add_argument("--batch-size", type=int, default=attachment_gc.ATTACHMENT_GC_BATCH_SIZE)
+    parser.add_argument("--chat-files-dir", default=CHAT_FILES_DIR)
+    parser.add_argument("--messages-file", default=MESSAGES_FILE)
+    args = parser.parse_args()
+
+    if args.source == "db":
+        from database import SessionLocal
+        from message_archive import MessageArchive
+        # Archived messages keep their attachments too
+        file_urls = lambda: itertools.chain(attachment_gc.db_file_urls(SessionLocal), MessageArchive().file_urls())
+    elif args.source == "sharded":
+        from storage_sharded import ShardedStorage
+        storage = ShardedStorage(os.path.dirname(args.messages_file) or ".")
+        # Until the import has finished, messages.json may hold references the shards do not have yet
+        pending = [] if storage.messages_imported() or not os.path.exists(args.messages_file) else [args.messages_file]
+        file_urls = lambda: itertools.chain(storage.file_urls(),
+                                            *(attachment_gc.json_file_urls(path) for path in pending))
+    else:
+        group_messages_file = os.path.join(os.path.dirname(args.messages_file), "group_messages.json")
+        sources = [args.messages_file] + ([group_messages_file] if os.path.exists(group_messages_file) else [])
+        file_urls = lambda: itertools.chain.from_iterable(attachment_gc.json_file_urls(path) for path in sources)
+
+    print("=" * 60)
+    print(f"🧹 Collecting orphaned attachments{' (dry run)' if args.dry_run else ''}")
+    print("=" * 60)
+
+    collector = attachment_gc.AttachmentGC(
+        BlobStore(args.chat_files_dir),
+        file_urls,
+        grace_seconds=int(args.grace_hours * 3600),
+        batch_size=args.batch_size,
+    )
+    report = collector.run(dry_run=args.dry_run)
+
+    print(f"📋 {report['live_references']} live references, {report['scanned']} files scanned")
+    print(f"⏳ {report['skipped_recent']} unreferenced files still inside the grace period")
+    if report["kept_on_recheck"]:
+        print(f"🔁 {report['kept_on_recheck']} files kept: referenced or re-uploaded during the pass")
+    for item in report["sample"]:
+        print(f"   {item['kind']:<6} {item['size'] / 1024:>10.1f} KB  {item['path']}")
+    if report["orphaned"] > len(report["sample"]):
+        print(f"   ... and {report['orphaned'] - len(report['sample'])} more")
+    print(f"✅ {'Would delete' if args.dry_run else 'Deleted'} {report['orphaned']} files "
+          f"({report['orphaned_bytes'] / 1024 / 1024:.1f} MB) in {report['duration_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
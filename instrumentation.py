@@ -0,0 +1,202 @@
+"""
+Storage-layer instrumentation: SQL queries and JSON file I/O per request.
+
+StorageStatsMiddleware gives every HTTP request a RequestStorageStats in a
+context variable (copied into the threadpool that runs sync endpoints), and
+the hooks below add to it:
+
+- instrument_engine(engine) registers SQLAlchemy cursor-execute listeners
+  that count queries and their time, and print any statement slower than
+  SLOW_QUERY_MS together with its parameters and route
+- load_json() / record_json_io() time the JSON store's reads and writes and
+  count their bytes
+
+Each request's totals go to /metrics (through metrics.RequestMetrics) as
+per-route histograms of queries, query time and JSON bytes, next to
+process-wide query and file I/O histograms. With STORAGE_TIMING_HEADER=1
+(on by default when DEV_MODE=1) every response also carries a Server-Timing
+header, which browser dev tools show in the network panel:
+
+    Server-Timing: db;dur=4.2;desc="7 queries", json-read;dur=1.3;desc="2 files, 48213 bytes"
+"""
+
+import contextvars
+import json
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import event
+
+from frontend import DEV_MODE
+
+STORAGE_TIMING_HEADER = os.getenv("STORAGE_TIMING_HEADER", "1" if DEV_MODE else "").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Longest statement / parameter text printed for a slow query
+SLOW_QUERY_LOG_CHARS = 1000
+
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+class RequestStorageStats:
+    __slots__ = ("scope", "queries", "query_seconds", "json_reads", "json_read_bytes", "json_read_seconds",
+                 "json_writes", "json_write_bytes", "json_write_seconds")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.json_reads = 0
+        self.json_read_bytes = 0
+        self.json_read_seconds = 0.0
+        self.json_writes = 0
+        self.json_write_bytes = 0
+        self.json_write_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the scope before the endpoint runs
+        return _route(self.scope) if self.scope is not None else "-"
+
+    def server_timing(self) -> str:
+        parts = []
+        if self.queries:
+            parts.append(f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries"')
+        if self.json_reads:
+            parts.append(f'json-read;dur={self.json_read_seconds * 1000:.1f};'
+                         f'desc="{self.json_reads} files, {self.json_read_bytes} bytes"')
+        if self.json_writes:
+            parts.append(f'json-write;dur={self.json_write_seconds * 1000:.1f};'
+                         f'desc="{self.json_writes} files, {self.json_write_bytes} bytes"')
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[RequestStorageStats]] = contextvars.ContextVar("storage_stats", default=None)
+_metrics = None
+
+
+def current_stats() -> Optional[RequestStorageStats]:
+    return _current.get()
+
+
+def set_metrics(request_metrics):
+    """Send storage timings to a metrics.RequestMetrics"""
+    global _metrics
+    _metrics = request_metrics
+
+
+# ===== SQLALCHEMY =====
+
+def instrument_engine(engine, slow_query_ms: float = SLOW_QUERY_MS):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+        if _metrics is not None:
+            _metrics.histogram("db_query_duration_seconds", "SQL statement execution time",
+                               QUERY_BUCKETS).observe((), elapsed)
+        if elapsed * 1000 >= slow_query_ms:
+            route = stats.route if stats is not None else "-"
+            if _metrics is not None:
+                _metrics.counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS").inc()
+            print(f"🐢 Slow query ({elapsed * 1000:.1f} ms, {route}): "
+                  f"{' '.join(statement.split())[:SLOW_QUERY_LOG_CHARS]} "
+                  f"params={str(parameters)[:SLOW_QUERY_LOG_CHARS]}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # Keep the start-time stack balanced when a statement fails
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+# ===== JSON FILES =====
+
+def record_json_io(operation: str, path: str, size: int, seconds: float):
+    """Record one JSON file read or write ("read" / "write")"""
+    stats = _current.get()
+    if stats is not None:
+        if operation == "read":
+            stats.json_reads += 1
+            stats.json_read_bytes += size
+            stats.json_read_seconds += seconds
+        else:
+            stats.json_writes += 1
+            stats.json_write_bytes += size
+            stats.json_write_seconds += seconds
+    if _metrics is not None:
+        labels = (("file", os.path.basename(path)), ("operation", operation))
+        _metrics.histogram("json_io_duration_seconds", "JSON store file read/write time (load or dump included)",
+                           QUERY_BUCKETS).observe(labels, seconds)
+        _metrics.counter("json_io_bytes_total", "JSON store bytes read and written").inc(labels, size)
+
+
+def load_json(path: str):
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    value = json.loads(data)
+    record_json_io("read", path, len(data), time.perf_counter() - start)
+    return value
+
+
+# ===== MIDDLEWARE =====
+
+class StorageStatsMiddleware:
+    """Pure ASGI middleware collecting storage stats per request"""
+
+    def __init__(self, app, header: bool = STORAGE_TIMING_HEADER):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStorageStats(scope)
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.header:
+                timing = stats.server_timing()
+                if timing:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if _metrics is not None:
+                _record_request(stats.route, stats)
+
+
+def _route(scope) -> str:
+    return getattr(scope.get("route"), "path", None) or "<unmatched>"
+
+
+def _record_request(route: str, stats: RequestStorageStats):
+    labels = (("route", route),)
+    if stats.queries:
+        _metrics.histogram("db_queries_per_request", "SQL statements per request",
+                           QUERIES_PER_REQUEST_BUCKETS).observe(labels, stats.queries)
+        _metrics.histogram("db_time_per_request_seconds", "Total SQL time per request",
+                           QUERY_BUCKETS).observe(labels, stats.query_seconds)
+    if stats.json_reads or stats.json_writes:
+        _metrics.histogram("json_bytes_per_request", "JSON store bytes read and written per request",
+                           BYTES_BUCKETS).observe(labels, stats.json_read_bytes + stats.json_write_bytes)
+        _metrics.histogram("json_time_per_request_seconds", "JSON store I/O time per request",
+                           QUERY_BUCKETS).observe(labels, stats.json_read_seconds + stats.json_write_seconds)
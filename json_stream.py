@@ -0,0 +1,80 @@
+"""
+Incremental reader for large top-level JSON arrays (messages.json).
+
+iter_json_array yields one element at a time while reading the file in
+fixed-size chunks, so memory stays bounded by the largest single element
+instead of the whole file.
+"""
+
+import json
+from typing import Any, Iterator
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_json_array_from(f, chunk_size)
+
+
+def iter_json_array_from(f, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        data = f.read(chunk_size)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+
+    while True:
+        skip_whitespace()
+        # Decode the next element, reading more data until it is complete
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end == len(buf) and not eof:
+                    raise ValueError("possibly truncated")
+                break
+            except ValueError:
+                if eof:
+                    raise
+                fill()
+        pos = end
+        yield value
+
+        skip_whitespace()
+        if pos >= len(buf):
+            raise ValueError("Unexpected end of JSON array")
+        if buf[pos] == ",":
+            pos += 1
+        elif buf[pos] == "]":
+            return
+        else:
+            raise ValueError(f"Unexpected character {buf[pos]!r} in JSON array")
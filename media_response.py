@@ -0,0 +1,195 @@
+"""
+File responses for chat media with HTTP caching and Range support.
+
+- Range: single byte ranges get 206 Partial Content (multi-range requests
+  fall back to the full file), so video seeking only fetches what it needs
+- Validators: a strong ETag from the content hash for content-addressed
+  names, a weak ETag from mtime/size otherwise, plus Last-Modified;
+  If-None-Match / If-Modified-Since answer 304 and If-Range is honoured
+- Cache-Control: content-addressed names never change, so they are cached
+  for a year as immutable; anything else must be revalidated
+- Transfer: uses the ASGI zero-copy send extension (os.sendfile) when the
+  server offers it, and falls back to chunked reads in a worker thread
+"""
+
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+CHUNK_SIZE = 256 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header into an inclusive (start, end) pair.
+    Returns None when the header should be ignored and raises ValueError
+    when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multi-range: serve the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as required for If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def guess_media_type(name: str) -> str:
+    """Content type from a file name's extension, for paths that have none (blobs)"""
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class MediaFileResponse(Response):
+    def __init__(self, path: str, request_headers: Mapping[str, str],
+                 filename: Optional[str] = None, content_hash: Optional[str] = None,
+                 immutable: bool = False, media_type: Optional[str] = None,
+                 stat_result: Optional[os.stat_result] = None):
+        self.path = path
+        self.background = None
+        self.body = b""
+        st = stat_result or os.stat(path)
+        size = st.st_size
+
+        if media_type is None:
+            # Blob paths carry no extension; callers serving blobs pass media_type
+            media_type = guess_media_type(filename or path)
+        self.media_type = media_type
+
+        if content_hash:
+            etag = f'"{content_hash}"'
+        else:
+            etag = f'W/"{st.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        }
+        if filename:
+            if quote(filename) == filename:
+                headers["content-disposition"] = f'attachment; filename="{filename}"'
+            else:
+                headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+
+        self.offset = 0
+        self.count = size
+        self.status_code = 200
+
+        if self._not_modified(request_headers, etag, st.st_mtime):
+            self.status_code = 304
+            self.count = 0
+            headers.pop("content-disposition", None)
+            self.init_headers(headers)
+            return
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self.status_code = 416
+                self.count = 0
+                headers["content-range"] = f"bytes */{size}"
+                self.init_headers(headers)
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                self.status_code = 206
+                self.offset = start
+                self.count = end - start + 1
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        headers["content-length"] = str(self.count)
+        self.init_headers(headers)
+
+    @staticmethod
+    def _not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.count == 0 or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in extensions:
+                # The server calls os.sendfile on our descriptor
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+
+            await anyio.to_thread.run_sync(f.seek, self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # File shrank underneath us; end the response cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
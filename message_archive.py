@@ -0,0 +1,395 @@
+"""
+Cold message history in per-month SQLite files.
+
+archive_old_messages() moves every month older than ARCHIVE_AFTER_MONTHS
+out of the messages table into ARCHIVE_DIR/messages_YYYY_MM.db. On
+Postgres with a partitioned messages table (message_partitions.py) the
+month's partition is then detached and dropped; elsewhere the month's rows
+are deleted in batches. A month is only removed from the database after its
+file holds every one of its rows, so an interrupted run just repeats.
+
+Rows are only deleted from the database if they still match what was
+copied: a message edited or deleted between the copy and the drop stays
+behind and the month is copied again, so no change is lost. On Postgres the
+partition is locked and compared before it is detached.
+
+Archive files are ordinary SQLite databases (sqlite3 archive/messages_2025_01.db
+opens one). A new month is written to a temp file and renamed into place.
+They store usernames rather than user ids, so they read back without the
+users table. MessageArchive serves them: get_messages pages into them,
+newest month first, once a client scrolls past what is left in the messages
+table (unpaged reads include them all); get_message, edits, deletes, contacts and conversation summaries fall
+back to them; and attachment GC counts their attachments as live.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set
+
+from sqlalchemy import bindparam, delete, func, select, text
+from sqlalchemy.orm import aliased
+
+from database import Message, User
+from message_partitions import add_months, is_partitioned, is_postgres, list_partitions, month_start
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "6"))
+ARCHIVE_BATCH_SIZE = 5000
+# Copy-and-drop rounds per month before giving up on a month that keeps changing
+ARCHIVE_ATTEMPTS = 5
+ARCHIVE_FILE = re.compile(r"^messages_(\d{4})_(\d{2})\.db$")
+
+COLUMNS = ("id", "from_user", "to_user", "message", "file_url", "file_name", "file_type", "timestamp",
+           "edited", "deleted_for_sender", "deleted_for_receiver", "deleted_for_everyone")
+# Columns edits and deletes change after a message is sent
+MUTABLE_COLUMNS = ("message", "edited", "deleted_for_sender", "deleted_for_receiver", "deleted_for_everyone")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    from_user TEXT NOT NULL,
+    to_user TEXT NOT NULL,
+    message TEXT,
+    file_url TEXT,
+    file_name TEXT,
+    file_type TEXT,
+    timestamp TEXT NOT NULL,
+    edited INTEGER NOT NULL DEFAULT 0,
+    deleted_for_sender INTEGER NOT NULL DEFAULT 0,
+    deleted_for_receiver INTEGER NOT NULL DEFAULT 0,
+    deleted_for_everyone INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_archive_pair_time ON messages (from_user, to_user, timestamp);
+"""
+
+
+def row_to_message(row) -> dict:
+    msg = dict(zip(COLUMNS, row))
+    return {
+        "id": msg["id"],
+        "from": msg["from_user"],
+        "to": msg["to_user"],
+        "message": msg["message"],
+        "file_url": msg["file_url"],
+        "file_name": msg["file_name"],
+        "file_type": msg["file_type"],
+        "timestamp": msg["timestamp"],
+        "edited": bool(msg["edited"]),
+        "deleted_for_everyone": bool(msg["deleted_for_everyone"]),
+        "archived": True
+    }
+
+
+class MessageArchive:
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        # Conversation pairs per file, reused until a file changes
+        self._pairs_lock = threading.Lock()
+        self._pairs_key = None
+        self._pairs: Dict[str, Set[str]] = {}
+
+    def path(self, month: datetime) -> str:
+        return os.path.join(self.directory, f"messages_{month:%Y_%m}.db")
+
+    def months(self) -> List[datetime]:
+        """Archived months, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        months = []
+        for name in names:
+            match = ARCHIVE_FILE.match(name)
+            if match:
+                months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months, reverse=True)
+
+    def _connect(self, month: datetime, write: bool = False):
+        # Edits and later archive runs update files in place, so reads take SQLite's normal locks
+        return sqlite3.connect(f"file:{self.path(month)}?mode={'rw' if write else 'ro'}", uri=True)
+
+    def _find(self, message_id: str):
+        """(month, row) of an archived message, or None"""
+        for month in self.months():
+            conn = self._connect(month)
+            try:
+                row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM messages WHERE id = ?", (message_id,)).fetchone()
+            finally:
+                conn.close()
+            if row:
+                return month, row
+        return None
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        found = self._find(message_id)
+        return row_to_message(found[1]) if found else None
+
+    def update_message(self, message_id: str, **fields) -> Optional[dict]:
+        """Set MUTABLE_COLUMNS of an archived message; returns it, or None if it is not archived"""
+        found = self._find(message_id)
+        if not found:
+            return None
+        assignments = ", ".join(f"{column} = ?" for column in fields if column in MUTABLE_COLUMNS)
+        conn = self._connect(found[0], write=True)
+        try:
+            with conn:
+                conn.execute(f"UPDATE messages SET {assignments} WHERE id = ?",
+                             [value for column, value in fields.items() if column in MUTABLE_COLUMNS] + [message_id])
+            row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM messages WHERE id = ?", (message_id,)).fetchone()
+        finally:
+            conn.close()
+        return row_to_message(row)
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        message = self.get_message(message_id)
+        if not message:
+            return None
+        fields = {}
+        if username is None or username == message["from"]:
+            fields["deleted_for_sender"] = 1
+        if username is None or username == message["to"]:
+            fields["deleted_for_receiver"] = 1
+        return self.update_message(message_id, **fields) if fields else message
+
+    def _pair_map(self) -> Dict[str, Set[str]]:
+        months = self.months()
+        key = []
+        for month in months:
+            try:
+                stat = os.stat(self.path(month))
+            except FileNotFoundError:
+                continue
+            key.append((month, stat.st_mtime_ns, stat.st_size))
+        with self._pairs_lock:
+            if key != self._pairs_key:
+                pairs = {}
+                for month, _, _ in key:
+                    conn = self._connect(month)
+                    try:
+                        # Covered by ix_archive_pair_time, so the table itself is not read
+                        for from_user, to_user in conn.execute("SELECT DISTINCT from_user, to_user FROM messages"):
+                            if from_user and to_user and from_user != to_user:
+                                pairs.setdefault(from_user, set()).add(to_user)
+                                pairs.setdefault(to_user, set()).add(from_user)
+                    finally:
+                        conn.close()
+                self._pairs, self._pairs_key = pairs, key
+            return self._pairs
+
+    def contacts(self, username: str) -> Set[str]:
+        """Users with archived messages to or from username"""
+        return set(self._pair_map().get(username, ()))
+
+    def has_conversation(self, user1: str, user2: str) -> bool:
+        """Whether any archived message is between user1 and user2 (cached, so cheap to ask on every read)"""
+        if user1 == user2:
+            # Notes to self are not in the pair map
+            return bool(self.months())
+        return user2 in self._pair_map().get(user1, ())
+
+    def pair_summaries(self) -> Iterator[tuple]:
+        """(from_user, to_user, message count, last timestamp) per direction and month"""
+        for month in self.months():
+            conn = self._connect(month)
+            try:
+                yield from conn.execute(
+                    "SELECT from_user, to_user, count(*), max(timestamp) FROM messages GROUP BY from_user, to_user"
+                ).fetchall()
+            finally:
+                conn.close()
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = 50) -> List[dict]:
+        """The newest `limit` (or all, for None) archived messages older than `before`, oldest first"""
+        conditions = ["((from_user = :u1 AND to_user = :u2) OR (from_user = :u2 AND to_user = :u1))"]
+        if viewer is not None:
+            conditions.append("deleted_for_everyone = 0 AND ((from_user = :viewer AND deleted_for_sender = 0) "
+                              "OR (to_user = :viewer AND deleted_for_receiver = 0))")
+        if before is not None:
+            conditions.append("timestamp < :before")
+        query = (f"SELECT {', '.join(COLUMNS)} FROM messages WHERE {' AND '.join(conditions)} "
+                 f"ORDER BY timestamp DESC LIMIT :limit")
+
+        newest_first = []
+        for month in self.months():
+            if before is not None and month.isoformat() >= before:
+                continue
+            conn = self._connect(month)
+            try:
+                rows = conn.execute(query, {"u1": user1, "u2": user2, "viewer": viewer, "before": before,
+                                            # SQLite reads LIMIT -1 as no limit
+                                            "limit": -1 if limit is None else limit - len(newest_first)}).fetchall()
+            finally:
+                conn.close()
+            newest_first.extend(row_to_message(row) for row in rows)
+            if limit is not None and len(newest_first) >= limit:
+                break
+        return newest_first[::-1]
+
+    def file_urls(self) -> Iterator[str]:
+        """file_url of every archived message not deleted for everyone"""
+        for month in self.months():
+            conn = self._connect(month)
+            try:
+                for file_url, in conn.execute(
+                    "SELECT file_url FROM messages WHERE file_url IS NOT NULL AND deleted_for_everyone = 0"
+                ):
+                    yield file_url
+            finally:
+                conn.close()
+
+    def write_month(self, month: datetime, rows) -> int:
+        """Add or refresh rows (tuples in COLUMNS order) in a month's file; returns its total row count"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(month)
+        # A month archived by an interrupted run is extended in one transaction, so edits
+        # made to its archived messages meanwhile are kept; a new month is renamed into place
+        exists = os.path.exists(path)
+        target = path if exists else f"{path}.{uuid.uuid4().hex}.tmp"
+        conn = sqlite3.connect(target)
+        try:
+            conn.executescript(SCHEMA)
+            placeholders = ", ".join("?" for _ in COLUMNS)
+            with conn:
+                # The database copy is the newer one for any row still there
+                conn.executemany(f"INSERT OR REPLACE INTO messages ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows)
+            total = conn.execute("SELECT count(*) FROM messages").fetchone()[0]
+        finally:
+            conn.close()
+        if not exists:
+            os.replace(target, path)
+        return total
+
+
+# ===== ARCHIVAL JOB =====
+
+def month_range(month: datetime):
+    return (Message.timestamp >= month) & (Message.timestamp < add_months(month, 1))
+
+
+def archivable_months(conn, cutoff: datetime) -> List[datetime]:
+    first = conn.execute(select(func.min(Message.timestamp))).scalar()
+    if first is None:
+        return []
+    months = []
+    month = month_start(first)
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def month_rows(conn, month: datetime) -> list:
+    sender, receiver = aliased(User), aliased(User)
+    # Outer joins: a row whose user is gone must still be archived before it is deleted
+    query = select(
+        Message.id, func.coalesce(sender.username, ""), func.coalesce(receiver.username, ""), Message.message, Message.file_url, Message.file_name,
+        Message.file_type, Message.timestamp, Message.edited, Message.deleted_for_sender,
+        Message.deleted_for_receiver, Message.deleted_for_everyone
+    ).outerjoin(sender, sender.id == Message.from_user_id).outerjoin(receiver, receiver.id == Message.to_user_id).where(
+        month_range(month)
+    )
+    return [
+        (row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7].isoformat(),
+         int(bool(row[8])), int(bool(row[9])), int(bool(row[10])), int(bool(row[11])))
+        for row in conn.execute(query)
+    ]
+
+
+def drop_month(engine, month: datetime, partitions: dict, rows: list) -> int:
+    """
+    Remove the month's rows that still equal the archived copy in rows;
+    returns how many rows of the month are left (changed or added since)
+    """
+    if month in partitions:
+        # Detaching a partition is a catalog change; no rows are deleted one by one.
+        # The lock holds off writes while the partition is compared with the copy.
+        name = partitions[month]
+        with engine.begin() as conn:
+            # Already gone when an earlier attempt detached it and only default-partition rows changed
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+                conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+                if sorted(month_rows(conn, month)) != sorted(rows):
+                    return conn.execute(select(func.count()).select_from(Message).where(month_range(month))).scalar()
+                conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+            present = set(conn.execute(select(Message.id).where(month_range(month))).scalars())
+        rows = [row for row in rows if row[0] in present]
+
+    # Rows outside a monthly partition (SQLite, or the default partition) go in batches,
+    # each deleted only if none of its mutable columns changed since it was copied
+    statement = delete(Message).where(
+        Message.id == bindparam("row_id"),
+        Message.message.is_not_distinct_from(bindparam("row_message")),
+        *[getattr(Message, column) == bindparam(f"row_{column}") for column in MUTABLE_COLUMNS[1:]]
+    )
+    for start in range(0, len(rows), ARCHIVE_BATCH_SIZE):
+        params = [
+            dict({"row_id": row[0], "row_message": row[3]},
+                 **{f"row_{column}": bool(row[COLUMNS.index(column)]) for column in MUTABLE_COLUMNS[1:]})
+            for row in rows[start:start + ARCHIVE_BATCH_SIZE]
+        ]
+        with engine.begin() as conn:
+            conn.execute(statement, params)
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(Message).where(month_range(month))).scalar()
+
+
+def archive_old_messages(engine, archive: MessageArchive = None, keep_months: int = ARCHIVE_AFTER_MONTHS,
+                         dry_run: bool = False, now: Optional[datetime] = None) -> dict:
+    """Move months older than keep_months into archive files; dry_run only reports"""
+    archive = archive or MessageArchive()
+    cutoff = add_months(month_start(now or datetime.utcnow()), -keep_months)
+    report = {"dry_run": dry_run, "cutoff": cutoff.isoformat(), "months": []}
+    start = time.perf_counter()
+
+    with engine.connect() as conn:
+        partitions = {}
+        if is_postgres(engine) and is_partitioned(conn):
+            partitions = {month: name for name, month in list_partitions(conn) if month}
+        # Empty partitions older than the first message are retired too
+        months = sorted(set(archivable_months(conn, cutoff)) | {month for month in partitions if month < cutoff})
+
+    for month in months:
+        with engine.connect() as conn:
+            rows = month_rows(conn, month)
+        entry = {"month": f"{month:%Y-%m}", "rows": len(rows)}
+        if not rows and month not in partitions:
+            continue
+        if not dry_run and not rows:
+            drop_month(engine, month, partitions, rows)
+            entry["dropped_partition"] = partitions[month]
+        elif not dry_run:
+            archived = set()
+            for attempt in range(ARCHIVE_ATTEMPTS):
+                total = archive.write_month(month, rows)
+                # Every row of the month must be readable from the file before it leaves the database
+                conn = archive._connect(month)
+                try:
+                    archived_ids = {row_id for row_id, in conn.execute("SELECT id FROM messages")}
+                finally:
+                    conn.close()
+                missing = [row[0] for row in rows if row[0] not in archived_ids]
+                if missing:
+                    raise RuntimeError(f"{len(missing)} messages of {month:%Y-%m} missing from {archive.path(month)}")
+                archived.update(row[0] for row in rows)
+                if not drop_month(engine, month, partitions, rows):
+                    break
+                # Rows edited, deleted or added after the copy stayed behind: copy them again
+                with engine.connect() as conn:
+                    rows = month_rows(conn, month)
+            else:
+                raise RuntimeError(f"{month:%Y-%m} kept changing during {ARCHIVE_ATTEMPTS} archive attempts; run again")
+            entry["rows"] = len(archived)
+            entry["archive_rows"] = total
+            entry["file"] = archive.path(month)
+            entry["dropped_partition"] = partitions.get(month)
+        report["months"].append(entry)
+
+    report["archived_rows"] = sum(entry["rows"] for entry in report["months"])
+    report["duration_seconds"] = round(time.perf_counter() - start, 3)
+    return report
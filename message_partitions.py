@@ -0,0 +1,136 @@
+"""
+Monthly range partitioning of the messages table on Postgres.
+
+convert_to_partitioned() rebuilds messages as a table partitioned by
+RANGE (timestamp): one partition per month (messages_pYYYY_MM) plus a
+default partition for anything outside them. ensure_partitions() keeps
+PARTITION_MONTHS_AHEAD months created ahead of time, so new rows never
+land in the default partition. Vacuum and index maintenance then work per
+month, and message_archive.py retires a whole month by detaching and
+dropping its partition instead of deleting rows.
+
+Postgres requires the partition key in every unique constraint, so the
+primary key becomes (id, timestamp); ids are UUIDs and stay unique.
+SQLite has no partitioning; there, archival deletes rows by month instead.
+"""
+
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_NAME = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y_%m}"
+
+
+def is_postgres(engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def is_partitioned(conn) -> bool:
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    )).scalar())
+
+
+def list_partitions(conn) -> List[Tuple[str, Optional[datetime]]]:
+    """(name, month) of every partition; month is None for the default partition"""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('messages') ORDER BY c.relname"
+    )).all()
+    partitions = []
+    for name, in rows:
+        match = PARTITION_NAME.match(name)
+        partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1) if match else None))
+    return partitions
+
+
+def create_partition(conn, month: datetime):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+def ensure_partitions(engine, months_ahead: int = PARTITION_MONTHS_AHEAD, now: Optional[datetime] = None) -> List[str]:
+    """Create this month's and the next months_ahead months' partitions; returns the new ones"""
+    if not is_postgres(engine):
+        return []
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        existing = {month for _, month in list_partitions(conn) if month}
+        current = month_start(now or datetime.utcnow())
+        for i in range(months_ahead + 1):
+            month = add_months(current, i)
+            if month not in existing:
+                create_partition(conn, month)
+                created.append(partition_name(month))
+    return created
+
+
+def convert_to_partitioned(engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> dict:
+    """Rebuild messages as a partitioned table, copying every row, in one transaction"""
+    if not is_postgres(engine):
+        raise ValueError("Partitioning needs Postgres; SQLite archives by deleting rows instead")
+
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return {"converted": False, "partitions": len(list_partitions(conn))}
+
+        # Every row needs a partition key; rows from before the column had a default get "now"
+        conn.execute(text("UPDATE messages SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL"))
+        first, = conn.execute(text("SELECT min(timestamp) FROM messages")).one()
+        rows = conn.execute(text("SELECT count(*) FROM messages")).scalar()
+
+        # The old table keeps its data until the copy is verified; move its names out of the way
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+        conn.execute(text("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey"))
+        conn.execute(text("ALTER INDEX IF EXISTS ix_messages_id RENAME TO ix_messages_unpartitioned_id"))
+
+        conn.execute(text("""
+            CREATE TABLE messages (
+                LIKE messages_unpartitioned INCLUDING DEFAULTS,
+                PRIMARY KEY (id, timestamp),
+                FOREIGN KEY (from_user_id) REFERENCES users (id),
+                FOREIGN KEY (to_user_id) REFERENCES users (id)
+            ) PARTITION BY RANGE (timestamp)
+        """))
+        conn.execute(text("CREATE INDEX ix_messages_id ON messages (id)"))
+        # Conversation reads filter on the pair and order by time
+        conn.execute(text("CREATE INDEX ix_messages_pair_time ON messages (from_user_id, to_user_id, timestamp)"))
+        conn.execute(text("CREATE TABLE messages_default PARTITION OF messages DEFAULT"))
+
+        month = month_start(first or datetime.utcnow())
+        last = add_months(month_start(datetime.utcnow()), months_ahead)
+        partitions = 0
+        while month <= last:
+            create_partition(conn, month)
+            partitions += 1
+            month = add_months(month, 1)
+
+        # LIKE copied the column order, so SELECT * lines up
+        conn.execute(text("INSERT INTO messages SELECT * FROM messages_unpartitioned"))
+        copied = conn.execute(text("SELECT count(*) FROM messages")).scalar()
+        if copied != rows:
+            raise RuntimeError(f"Copied {copied} of {rows} messages; rolled back")
+        conn.execute(text("DROP TABLE messages_unpartitioned"))
+
+    return {"converted": True, "rows": rows, "partitions": partitions}
@@ -0,0 +1,389 @@
+"""
+Request metrics in the Prometheus text format, served at /metrics.
+
+MetricsMiddleware is a plain ASGI middleware that records, per method and
+route template ("/get_messages/{from_user}/{to_user}", never the raw path,
+so usernames don't turn into label values):
+
+- http_requests_total{method, route, status}
+- http_request_duration_seconds{method, route} (histogram)
+- http_response_size_bytes{method, route} (histogram)
+- http_requests_in_progress{method}
+
+Requests that match no route are recorded as route="<unmatched>". All
+bookkeeping happens on the event loop thread, so it is a few dict updates
+and a bisect per request with no locking.
+
+Components (rate limiter, password hasher, sessions, push delivery) add
+their own counters and gauges through register_collector(); they are read
+at scrape time. Code that records from worker threads (storage timings in
+instrumentation.py) uses counter() and histogram(), which take a lock.
+
+With several uvicorn workers each one only sees its own requests, so set
+METRICS_DIR to a directory shared by the workers: every worker writes a
+snapshot there every METRICS_FLUSH_INTERVAL seconds and /metrics sums the
+snapshots of all workers (gauges only from workers that are still running).
+Clear the directory when restarting the server.
+"""
+
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"}
+UNMATCHED = "<unmatched>"
+
+HELP = {
+    "http_requests_total": "HTTP requests by method, route template and status code",
+    "http_request_duration_seconds": "Time from request start to the end of the response",
+    "http_response_size_bytes": "Response body size",
+    "http_requests_in_progress": "Requests currently being handled",
+}
+
+# (kind, name, help, labels, value) with kind "counter" or "gauge"
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Iterable[Tuple[str, str]]) -> str:
+    text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + text + "}" if text else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Labelled counter that can be incremented from any thread"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[self.name, [list(pair) for pair in labels], value] for labels, value in self.values.items()]
+
+
+class Histogram:
+    """Labelled histogram that can be observed from any thread"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[self.name, [list(pair) for pair in labels], list(self.buckets), list(counts), total]
+                    for labels, (counts, total) in self.values.items()]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RequestMetrics:
+    def __init__(self, directory: Optional[str] = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL,
+                 latency_buckets: tuple = LATENCY_BUCKETS, size_buckets: tuple = SIZE_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.latency_buckets = latency_buckets
+        self.size_buckets = size_buckets
+        self.pid = os.getpid()
+        self.requests: Dict[tuple, int] = {}
+        # (method, route) -> [per-bucket counts (last one is +Inf), sum]
+        self.latency: Dict[tuple, list] = {}
+        self.sizes: Dict[tuple, list] = {}
+        self.in_progress: Dict[str, int] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._families: Dict[str, object] = {}
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self._collectors.append(collector)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        """Counter recorded directly by the caller; labels are ((key, value), ...) tuples"""
+        if name not in self._families:
+            self._families[name] = Counter(name, help_text)
+        return self._families[name]
+
+    def histogram(self, name: str, help_text: str, buckets: tuple) -> Histogram:
+        if name not in self._families:
+            self._families[name] = Histogram(name, help_text, buckets)
+        return self._families[name]
+
+    # ----- recording -----
+
+    def observe(self, method: str, route: str, status: int, seconds: float, size: int):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        key = (method, route)
+        entry = self.latency.get(key)
+        if entry is None:
+            entry = self.latency[key] = [[0] * (len(self.latency_buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.latency_buckets, seconds)] += 1
+        entry[1] += seconds
+
+        entry = self.sizes.get(key)
+        if entry is None:
+            entry = self.sizes[key] = [[0] * (len(self.size_buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.size_buckets, size)] += 1
+        entry[1] += size
+
+    # ----- snapshots -----
+
+    def snapshot(self) -> dict:
+        """This worker's metrics as plain lists, the format of the METRICS_DIR files"""
+        # /metrics renders on a worker thread while the event loop keeps recording;
+        # list() copies each dict in one step before it is iterated
+        counters = [["http_requests_total", [["method", m], ["route", r], ["status", str(s)]], n]
+                    for (m, r, s), n in list(self.requests.items())]
+        gauges = [["http_requests_in_progress", [["method", m]], n] for m, n in list(self.in_progress.items())]
+        histograms = []
+        for name, buckets, data in (("http_request_duration_seconds", self.latency_buckets, self.latency),
+                                    ("http_response_size_bytes", self.size_buckets, self.sizes)):
+            for (m, r), (counts, total) in list(data.items()):
+                histograms.append([name, [["method", m], ["route", r]], list(buckets), list(counts), total])
+
+        help_texts = {}
+        for family in list(self._families.values()):
+            help_texts[family.name] = family.help
+            target = histograms if isinstance(family, Histogram) else counters
+            target.extend(family.snapshot())
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"⚠️  Metrics collector failed: {e}")
+                continue
+            for kind, name, help_text, labels, value in samples:
+                help_texts[name] = help_text
+                target = counters if kind == "counter" else gauges
+                target.append([name, sorted([k, str(v)] for k, v in labels.items()), value])
+        return {"pid": self.pid, "time": time.time(), "counters": counters, "gauges": gauges,
+                "histograms": histograms, "help": help_texts}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    def flush(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(self.pid)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    async def flush_loop(self):
+        if not self.directory:
+            return
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Metrics flush failed: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    def _all_snapshots(self) -> List[dict]:
+        snapshots = [self.snapshot()]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith("metrics_") and filename.endswith(".json")):
+                continue
+            try:
+                pid = int(filename[len("metrics_"):-len(".json")])
+            except ValueError:
+                continue
+            if pid == self.pid:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), "r") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshot["alive"] = _pid_alive(pid)
+            snapshots.append(snapshot)
+        return snapshots
+
+    # ----- exposition -----
+
+    def render(self) -> str:
+        counters: Dict[str, Dict[tuple, float]] = {}
+        gauges: Dict[str, Dict[tuple, float]] = {}
+        histograms: Dict[str, Dict[tuple, list]] = {}
+        help_texts = dict(HELP)
+
+        for snapshot in self._all_snapshots():
+            help_texts.update(snapshot.get("help", {}))
+            for name, labels, value in snapshot["counters"]:
+                series = counters.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in labels)
+                series[key] = series.get(key, 0) + value
+            if snapshot.get("alive", True):
+                for name, labels, value in snapshot["gauges"]:
+                    series = gauges.setdefault(name, {})
+                    key = tuple(tuple(pair) for pair in labels)
+                    series[key] = series.get(key, 0) + value
+            for name, labels, buckets, counts, total in snapshot["histograms"]:
+                series = histograms.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in labels)
+                entry = series.get(key)
+                if entry is None:
+                    series[key] = [buckets, list(counts), total]
+                elif entry[0] == buckets:
+                    entry[1] = [a + b for a, b in zip(entry[1], counts)]
+                    entry[2] += total
+
+        lines = []
+        for kind, families in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(families):
+                lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(families[name].items()):
+                    lines.append(f"{name}{_labels(key)} {_format_number(value)}")
+        for name in sorted(histograms):
+            lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (buckets, counts, total) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(list(buckets) + [float("inf")], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(key + (('le', _format_number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key)} {_format_number(total)}")
+                lines.append(f"{name}_count{_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware overhead) feeding a RequestMetrics"""
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        method = scope["method"] if scope["method"] in METHODS else "OTHER"
+        response = [500, 0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                response[1] += len(message.get("body", b""))
+            await send(message)
+
+        metrics.in_progress[method] = metrics.in_progress.get(method, 0) + 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_progress[method] -= 1
+            # The router stores the matched route in the scope; its path is the template
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED
+            metrics.observe(method, route, response[0], elapsed, response[1])
+
+
+# ===== COLLECTORS FOR APP COMPONENTS =====
+
+def rate_limiter_samples(limiter) -> Callable[[], Iterable[Sample]]:
+    def collect():
+        stats = limiter.stats()
+        yield ("counter", "rate_limit_backend_errors_total", "Rate limit backend failures (requests let through)",
+               {}, stats["backend_errors"])
+        for name, data in stats["classes"].items():
+            yield ("counter", "rate_limit_rejected_total", "Requests rejected with 429 by endpoint class",
+                   {"class": name}, data["rejected"])
+            yield ("gauge", "rate_limit_in_flight", "Limited requests in flight by endpoint class",
+                   {"class": name}, data["in_flight"])
+    return collect
+
+
+def password_hasher_samples(hasher) -> Callable[[], Iterable[Sample]]:
+    def collect():
+        stats = hasher.stats()
+        yield ("gauge", "password_hash_pending", "Password hashes waiting or running", {}, stats["pending"])
+        yield ("counter", "password_hash_completed_total", "Password hashes computed", {}, stats["completed"])
+        yield ("counter", "password_hash_rejected_total", "Hash requests rejected with 503", {}, stats["rejected"])
+    return collect
+
+
+def session_store_samples(store) -> Callable[[], Iterable[Sample]]:
+    def collect():
+        stats = store.stats()
+        yield ("gauge", "sessions_cached", "Sessions held in the in-memory cache", {}, stats["cached_sessions"])
+    return collect
+
+
+def replica_routing_samples(router) -> Callable[[], Iterable[Sample]]:
+    def collect():
+        stats = router.stats()
+        yield ("counter", "db_reads_total", "Storage reads by database they were routed to",
+               {"target": "primary"}, stats["primary_reads"])
+        yield ("counter", "db_reads_total", "Storage reads by database they were routed to",
+               {"target": "replica"}, stats["replica_reads"])
+        yield ("counter", "db_read_your_writes_requests_total",
+               "Requests sent to the primary because the client wrote recently", {}, stats["pinned_requests"])
+    return collect
+
+
+def delivery_samples(hub) -> Callable[[], Iterable[Sample]]:
+    def collect():
+        stats = hub.metrics()
+        yield ("gauge", "delivery_connections", "Open push connections", {}, stats["connections"])
+        yield ("gauge", "delivery_queued_events", "Events queued for push connections", {}, stats["total_queued"])
+        yield ("counter", "delivery_disconnects_total", "Push connections closed by the server",
+               {"reason": "overflow"}, stats["disconnects_for_overflow"])
+        yield ("counter", "delivery_disconnects_total", "Push connections closed by the server",
+               {"reason": "timeout"}, stats["disconnects_for_timeout"])
+    return collect
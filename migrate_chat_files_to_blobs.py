@@ -0,0 +1,136 @@
+"""
+Migrate chat_files into the content-addressed blob store.
+
+Every plain file in CHAT_FILES_DIR (flat or sharded) is hashed and moved into
+CHAT_FILES_DIR/.blobs; identical files collapse into one blob. The old file
+name is recorded in the blob index, so existing file_url values in messages
+keep working without rewriting any message. Finally the reference counts are
+rebuilt from messages.json and/or the messages table.
+
+Usage:
+    python migrate_chat_files_to_blobs.py [--dry-run] [--source json|db|both]
+"""
+
+import argparse
+import hashlib
+import json
+
+import sharding
+from blob_store import BlobStore
+
+CHAT_FILES_DIR = "./chat_files"
+MESSAGES_FILE = "./messages.json"
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def dedupe_files(store: BlobStore, dry_run: bool):
+    print("📋 Moving chat files into the blob store...")
+    seen = {}
+    migrated = 0
+    duplicates = 0
+    reclaimed = 0
+
+    # Flat and sharded legacy files alike; the blob store itself is a dot-directory
+    for _, entry in list(sharding.iter_files(store.chat_files_dir)):
+        size = entry.stat().st_size
+        sha256 = file_sha256(entry.path)
+        is_duplicate = sha256 in seen or store.exists(sha256)
+        if is_duplicate:
+            duplicates += 1
+            reclaimed += size
+        seen.setdefault(sha256, entry.name)
+
+        if not dry_run:
+            store.commit(entry.path, sha256, entry.name, size)
+            store.register_name(entry.name, sha256)
+        migrated += 1
+
+    print(f"✅ {'Would migrate' if dry_run else 'Migrated'} {migrated} files "
+          f"into {len(seen)} blobs ({duplicates} duplicates, {reclaimed / 1024 / 1024:.1f} MB reclaimed)")
+
+
+def json_references():
+    try:
+        with open(MESSAGES_FILE, "r") as f:
+            messages = json.load(f)
+    except FileNotFoundError:
+        print("⚠️  messages.json not found, skipping")
+        return
+    for msg in messages:
+        if msg.get("file_url") and not msg.get("deleted_for_everyone", False) and msg.get("id"):
+            yield msg["file_url"], msg["id"]
+
+
+def db_references():
+    from database import SessionLocal, Message
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Message.id, Message.file_url).filter(
+            Message.file_url.isnot(None),
+            Message.deleted_for_everyone == False
+        ).yield_per(1000)
+        for message_id, file_url in rows:
+            yield file_url, message_id
+    finally:
+        db.close()
+
+
+def rebuild_refs(store: BlobStore, source: str, dry_run: bool):
+    print("\n📋 Rebuilding reference counts...")
+    sources = []
+    if source in ("json", "both"):
+        sources.append(json_references())
+    if source in ("db", "both"):
+        sources.append(db_references())
+
+    linked = 0
+    unknown = 0
+    for refs in sources:
+        for file_url, message_id in refs:
+            filename = store.filename_from_url(file_url)
+            if not filename or not store.sha_for_name(filename):
+                unknown += 1
+                continue
+            if not dry_run:
+                store.add_ref(file_url, message_id)
+            linked += 1
+
+    print(f"✅ {'Would link' if dry_run else 'Linked'} {linked} message attachments "
+          f"({unknown} pointing at files not in the blob store)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dedupe chat_files into the blob store")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without moving anything")
+    parser.add_argument("--source", choices=["json", "db", "both"], default="json",
+                        help="Where to read message references from (default: json)")
+    parser.add_argument("--chat-files-dir", default=CHAT_FILES_DIR)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🚀 Migrating chat_files to content-addressed storage")
+    print("=" * 60)
+
+    store = BlobStore(args.chat_files_dir)
+    dedupe_files(store, args.dry_run)
+    rebuild_refs(store, args.source, args.dry_run)
+
+    if not args.dry_run:
+        stats = store.stats()
+        print(f"\n📦 {stats['blobs']} blobs, {stats['stored_bytes'] / 1024 / 1024:.1f} MB stored, "
+              f"{stats['references']} references")
+
+
+if __name__ == "__main__":
+    main()
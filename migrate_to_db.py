@@ -1,161 +1,276 @@
 """
 Migration script to move data from JSON files to SQL database
 Run this once to migrate your existing data
+
+messages.json is streamed element by element (json_stream.py) and written
+in bulk INSERTs of --batch-size rows, with one existence query per batch,
+so memory stays flat and large histories migrate in minutes. Progress is
+checkpointed after every batch; re-running the script resumes where it
+stopped (use --restart to start over). Re-running is always safe: rows
+that already exist are skipped.
+
+Usage:
+    python migrate_to_db.py [--batch-size 5000] [--checkpoint FILE] [--restart]
 """
 
+import argparse
 import json
+import os
 import sys
-from database import SessionLocal, init_db, User, Message, OnlineUser
+import time
+import uuid
 from datetime import datetime
-import hashlib
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+from sqlalchemy import insert, select
+
+from database import SessionLocal, init_db, User, Message
+from json_stream import iter_json_array
+from passwords import hash_password_sync
+
+USERS_FILE = "./users.json"
+MESSAGES_FILE = "./messages.json"
+BANNED_USERS_FILE = "./banned_users.json"
+CHECKPOINT_FILE = "./.migrate_to_db.checkpoint.json"
+BATCH_SIZE = 5000
+# Keep IN (...) lists under SQLite's bound-parameter limit
+IN_CLAUSE_SIZE = 500
+
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def existing_values(db, column, values) -> set:
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), IN_CLAUSE_SIZE):
+        found.update(db.execute(select(column).where(column.in_(values[i:i + IN_CLAUSE_SIZE]))).scalars())
+    return found
+
+
+def parse_timestamp(value) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
 
-def migrate_users(db):
+class Progress:
+    def __init__(self, label: str):
+        self.label = label
+        self.start = time.perf_counter()
+        self.rows = 0
+
+    def add(self, rows: int, scanned: int):
+        self.rows += rows
+        elapsed = time.perf_counter() - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0
+        print(f"   ... {scanned} {self.label} scanned, {self.rows} inserted ({rate:,.0f} rows/s)")
+
+    def done(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0
+        return f"{self.rows} in {elapsed:.1f}s ({rate:,.0f} rows/s)"
+
+
+def migrate_users(db, users_file: str, batch_size: int):
     print("📋 Migrating users...")
     try:
-        with open("./users.json", "r") as f:
+        with open(users_file, "r") as f:
             users_data = json.load(f)
-        
-        user_map = {}  # Map username to user_id
-        
-        for username, user_info in users_data.items():
-            # Check if user already exists
-            existing_user = db.query(User).filter(User.username == username).first()
-            if existing_user:
-                print(f"   ⚠️  User '{username}' already exists, skipping...")
-                user_map[username] = existing_user.id
-                continue
-            
-            user = User(
-                username=username,
-                password=user_info.get("password", hash_password("password123")),
-                plain_password=user_info.get("plain_password", "password123"),
-                is_admin=user_info.get("admin", False),
-                is_banned=False
-            )
-            db.add(user)
-            db.flush()  # Get the ID
-            user_map[username] = user.id
-            print(f"   ✅ Migrated user: {username}")
-        
-        db.commit()
-        print(f"✅ Migrated {len(users_data)} users")
-        return user_map
-    
     except FileNotFoundError:
         print("⚠️  users.json not found, skipping user migration")
-        return {}
-    except Exception as e:
-        print(f"❌ Error migrating users: {e}")
-        db.rollback()
-        return {}
+        return
 
-def migrate_messages(db, user_map):
-    print("\n📋 Migrating messages...")
-    try:
-        with open("./messages.json", "r") as f:
-            messages_data = json.load(f)
-        
-        migrated = 0
-        for msg_data in messages_data:
-            from_username = msg_data.get("from_user")
-            to_username = msg_data.get("to_user")
-            
-            # Skip if users don't exist in map
-            if from_username not in user_map or to_username not in user_map:
-                print(f"   ⚠️  Skipping message from {from_username} to {to_username} (users not found)")
+    progress = Progress("users")
+    usernames = list(users_data)
+    for i in range(0, len(usernames), batch_size):
+        batch = usernames[i:i + batch_size]
+        existing = existing_values(db, User.username, batch)
+        rows = []
+        for username in batch:
+            if username in existing:
                 continue
-            
-            # Check if message already exists
-            msg_id = msg_data.get("id", str(datetime.utcnow().timestamp()))
-            existing_msg = db.query(Message).filter(Message.id == msg_id).first()
-            if existing_msg:
-                continue
-            
-            message = Message(
-                id=msg_id,
-                from_user_id=user_map[from_username],
-                to_user_id=user_map[to_username],
-                message=msg_data.get("message", ""),
-                file_url=msg_data.get("file_url"),
-                file_name=msg_data.get("file_name"),
-                file_type=msg_data.get("file_type"),
-                timestamp=datetime.fromisoformat(msg_data.get("timestamp", datetime.utcnow().isoformat())),
-                edited=msg_data.get("edited", False),
-                deleted_for_sender=msg_data.get("deleted_for", {}).get(from_username, False),
-                deleted_for_receiver=msg_data.get("deleted_for", {}).get(to_username, False),
-                deleted_for_everyone=msg_data.get("deleted_for_everyone", False)
-            )
-            db.add(message)
-            migrated += 1
-        
-        db.commit()
-        print(f"✅ Migrated {migrated} messages")
-    
-    except FileNotFoundError:
+            user_info = users_data[username]
+            rows.append({
+                "username": username,
+                # Hashes from main.py are kept as-is and upgraded on first login
+                "password": user_info.get("password") or hash_password_sync("password123"),
+                "plain_password": user_info.get("plain_password", "password123"),
+                "is_admin": user_info.get("is_admin", user_info.get("admin", False)),
+                "is_banned": False,
+                "created_at": parse_timestamp(user_info.get("created_at")),
+            })
+        if rows:
+            db.execute(insert(User), rows)
+            db.commit()
+        progress.add(len(rows), i + len(batch))
+
+    print(f"✅ Migrated users: {progress.done()}, {len(usernames) - progress.rows} already present")
+
+
+def message_row(msg_data: dict, user_ids: dict):
+    # main.py writes "from"/"to"; very old files used "from_user"/"to_user"
+    from_username = msg_data.get("from", msg_data.get("from_user"))
+    to_username = msg_data.get("to", msg_data.get("to_user"))
+    if from_username not in user_ids or to_username not in user_ids:
+        return None
+
+    msg_id = msg_data.get("id")
+    if not msg_id:
+        # Stable id for messages written before ids existed, so re-runs don't duplicate them
+        key = f"{from_username}|{to_username}|{msg_data.get('timestamp')}|{msg_data.get('message')}"
+        msg_id = str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+    # deleted_for is the list of usernames who deleted the message for themselves
+    deleted_for = msg_data.get("deleted_for") or []
+    if isinstance(deleted_for, dict):
+        deleted_for = [name for name, deleted in deleted_for.items() if deleted]
+
+    return {
+        "id": msg_id,
+        "from_user_id": user_ids[from_username],
+        "to_user_id": user_ids[to_username],
+        "message": msg_data.get("message", ""),
+        "file_url": msg_data.get("file_url"),
+        "file_name": msg_data.get("file_name"),
+        "file_type": msg_data.get("file_type"),
+        "timestamp": parse_timestamp(msg_data.get("timestamp")),
+        "edited": msg_data.get("edited", False),
+        "deleted_for_sender": from_username in deleted_for,
+        "deleted_for_receiver": to_username in deleted_for,
+        "deleted_for_everyone": msg_data.get("deleted_for_everyone", False),
+    }
+
+
+def insert_message_batch(db, batch: list) -> int:
+    existing = existing_values(db, Message.id, {row["id"] for row in batch})
+    rows = []
+    seen = set()
+    for row in batch:
+        if row["id"] in existing or row["id"] in seen:
+            continue
+        seen.add(row["id"])
+        rows.append(row)
+    if rows:
+        db.execute(insert(Message), rows)
+    db.commit()
+    return len(rows)
+
+
+def migrate_messages(db, messages_file: str, batch_size: int, checkpoint: dict, checkpoint_file: str):
+    print("\n📋 Migrating messages...")
+    if not os.path.exists(messages_file):
         print("⚠️  messages.json not found, skipping message migration")
-    except Exception as e:
-        print(f"❌ Error migrating messages: {e}")
-        db.rollback()
+        return
+
+    user_ids = dict(db.execute(select(User.username, User.id)).all())
+    if checkpoint.get("messages_file") != os.path.abspath(messages_file):
+        checkpoint.clear()
+    checkpoint["messages_file"] = os.path.abspath(messages_file)
+    resume_at = checkpoint.get("messages_done", 0)
+    if resume_at:
+        print(f"   ↪️  Resuming after {resume_at} messages (checkpoint)")
+
+    progress = Progress("messages")
+    skipped_users = 0
+    batch = []
+    scanned = 0
+    for scanned, msg_data in enumerate(iter_json_array(messages_file), start=1):
+        if scanned <= resume_at:
+            continue
+        row = message_row(msg_data, user_ids)
+        if row is None:
+            skipped_users += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            progress.add(insert_message_batch(db, batch), scanned)
+            batch = []
+            checkpoint["messages_done"] = scanned
+            save_checkpoint(checkpoint_file, checkpoint)
+
+    if batch:
+        progress.add(insert_message_batch(db, batch), scanned)
+    checkpoint["messages_done"] = max(scanned, resume_at)
+    save_checkpoint(checkpoint_file, checkpoint)
 
-def migrate_banned_users(db, user_map):
+    print(f"✅ Migrated messages: {progress.done()}")
+    if skipped_users:
+        print(f"   ⚠️  Skipped {skipped_users} messages whose sender or recipient does not exist")
+
+
+def migrate_banned_users(db, banned_file: str):
     print("\n📋 Migrating banned users...")
     try:
-        with open("./banned_users.json", "r") as f:
+        with open(banned_file, "r") as f:
             banned_users = json.load(f)
-        
-        for username in banned_users:
-            if username in user_map:
-                user = db.query(User).filter(User.id == user_map[username]).first()
-                if user:
-                    user.is_banned = True
-                    print(f"   ✅ Banned user: {username}")
-        
-        db.commit()
-        print(f"✅ Migrated {len(banned_users)} banned users")
-    
     except FileNotFoundError:
         print("⚠️  banned_users.json not found, skipping banned users migration")
-    except Exception as e:
-        print(f"❌ Error migrating banned users: {e}")
-        db.rollback()
+        return
+
+    for i in range(0, len(banned_users), IN_CLAUSE_SIZE):
+        db.query(User).filter(User.username.in_(banned_users[i:i + IN_CLAUSE_SIZE])).update(
+            {User.is_banned: True}, synchronize_session=False
+        )
+    db.commit()
+    print(f"✅ Migrated {len(banned_users)} banned users")
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Migrate the JSON data files into the SQL database")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per INSERT batch")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Progress file used to resume")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and scan everything again")
+    parser.add_argument("--users-file", default=USERS_FILE)
+    parser.add_argument("--messages-file", default=MESSAGES_FILE)
+    parser.add_argument("--banned-file", default=BANNED_USERS_FILE)
+    args = parser.parse_args()
+
     print("=" * 60)
     print("🚀 Starting JSON to SQL Database Migration")
     print("=" * 60)
-    
+
     # Initialize database
     print("\n📦 Initializing database...")
     init_db()
-    
-    # Create session
+
+    checkpoint = {} if args.restart else load_checkpoint(args.checkpoint)
     db = SessionLocal()
-    
+
     try:
         # Migrate users first (needed for foreign keys)
-        user_map = migrate_users(db)
-        
-        if not user_map:
+        migrate_users(db, args.users_file, args.batch_size)
+
+        if db.query(User).count() == 0:
             print("\n⚠️  No users migrated. Creating default admin user...")
             admin = User(
                 username="admin",
-                password=hash_password("admin"),
+                password=hash_password_sync("admin"),
                 plain_password="admin",
                 is_admin=True
             )
             db.add(admin)
             db.commit()
             print("✅ Default admin user created (username: admin, password: admin)")
-        
+
         # Migrate messages
-        migrate_messages(db, user_map)
-        
+        migrate_messages(db, args.messages_file, args.batch_size, checkpoint, args.checkpoint)
+
         # Migrate banned users
-        migrate_banned_users(db, user_map)
-        
+        migrate_banned_users(db, args.banned_file)
+
         print("\n" + "=" * 60)
         print("✅ Migration completed successfully!")
         print("=" * 60)
@@ -164,9 +279,11 @@ def main():
         print("2. Backup your JSON files")
         print("3. Update your deployment configuration")
         print("\n⚠️  Remember to set DATABASE_URL environment variable for PostgreSQL")
-        
+
     except Exception as e:
+        db.rollback()
         print(f"\n❌ Migration failed: {e}")
+        print(f"   Progress is saved in {args.checkpoint}; run the script again to resume")
         import traceback
         traceback.print_exc()
         sys.exit(1)
@@ -1,89 +1,422 @@
 """
 Migrate data from local SQLite to Railway PostgreSQL
+
+Copies every table defined in database.py, parents before children (users,
+then messages, online status and sessions):
+
+- users are matched by username; users that already exist on the target
+  keep their row, and every foreign key pointing at users.id is remapped
+  to the target's ids
+- other tables are split into primary-key ranges of --batch-size rows that
+  are loaded in parallel by --workers threads. On PostgreSQL each batch is
+  streamed with COPY into a temporary staging table and merged with
+  INSERT ... ON CONFLICT DO NOTHING; other targets fall back to a bulk
+  INSERT with the same conflict handling
+- finished batches are checkpointed, so an interrupted run picks up where
+  it stopped when started again, and rows already on the target are
+  never duplicated
+- at the end every batch is verified: row counts and a checksum of the
+  row contents (with user ids translated back to usernames) must match
+  between source and target
+
+Usage:
+    set DATABASE_URL=your_database_url
+    python migrate_to_railway.py [--source sqlite:///chatapp.db] [--workers 4] [--batch-size 10000]
+                                 [--restart] [--verify-only] [--no-verify]
 """
+import argparse
+import hashlib
+import io
+import json
 import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from database import User, Message, OnlineUser, Base
-
-# Local SQLite database
-local_engine = create_engine('sqlite:///chatapp.db')
-LocalSession = sessionmaker(bind=local_engine)
-
-# Railway PostgreSQL database
-railway_db_url = os.getenv('DATABASE_URL')
-if not railway_db_url:
-    print("❌ Error: DATABASE_URL environment variable not set!")
-    print("\nTo get your DATABASE_URL:")
-    print("1. Go to Railway dashboard")
-    print("2. Click on PostgreSQL database")
-    print("3. Go to 'Connect' tab")
-    print("4. Copy the DATABASE_URL")
-    print("\nThen run:")
-    print('set DATABASE_URL=your_database_url')
-    print('python migrate_to_railway.py')
-    exit(1)
-
-# Fix postgres:// to postgresql:// if needed (Railway uses postgres:// but SQLAlchemy needs postgresql://)
-if railway_db_url.startswith('postgres://'):
-    railway_db_url = railway_db_url.replace('postgres://', 'postgresql://', 1)
-
-railway_engine = create_engine(railway_db_url)
-RailwaySession = sessionmaker(bind=railway_engine)
-
-print("🚀 Starting migration to Railway...")
-print(f"📍 Local: SQLite (chatapp.db)")
-print(f"📍 Remote: PostgreSQL (Railway)")
-
-# Create tables in Railway if they don't exist
-Base.metadata.create_all(railway_engine)
-print("✅ Tables created/verified in Railway database")
-
-# Migrate users
-local_session = LocalSession()
-railway_session = RailwaySession()
-
-try:
-    # Get all users from local database
-    local_users = local_session.query(User).all()
-    print(f"\n📋 Found {len(local_users)} users in local database")
-    
-    migrated_count = 0
-    skipped_count = 0
-    
-    for user in local_users:
-        # Check if user already exists in Railway
-        existing = railway_session.query(User).filter_by(username=user.username).first()
-        
-        if existing:
-            print(f"⏭️  Skipped: {user.username} (already exists)")
-            skipped_count += 1
-            continue
-        
-        # Create new user in Railway
-        new_user = User(
-            username=user.username,
-            password=user.password,
-            plain_password=user.plain_password,
-            is_admin=user.is_admin,
-            is_banned=user.is_banned
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from sqlalchemy import Integer, create_engine, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import Base, User
+
+SOURCE_URL = "sqlite:///chatapp.db"
+CHECKPOINT_FILE = "./.migrate_to_railway.checkpoint.json"
+BATCH_SIZE = 10000
+WORKERS = 4
+# Keep IN (...) lists under SQLite's bound-parameter limit
+IN_CLAUSE_SIZE = 500
+
+
+def normalize_url(url: str) -> str:
+    # Railway uses postgres:// but SQLAlchemy needs postgresql://
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+# ===== TABLE LAYOUT =====
+
+def is_surrogate_key(table) -> bool:
+    """Autoincrement integer ids are not copied; the target assigns its own"""
+    pk = list(table.primary_key.columns)
+    return len(pk) == 1 and isinstance(pk[0].type, Integer) and pk[0].autoincrement in (True, "auto")
+
+
+def user_fk_columns(table) -> list:
+    return [
+        column.name for column in table.columns
+        if any(fk.column.table.name == User.__tablename__ and fk.column.name == "id" for fk in column.foreign_keys)
+    ]
+
+
+def copied_columns(table) -> list:
+    pk_name = list(table.primary_key.columns)[0].name
+    return [c.name for c in table.columns if not (is_surrogate_key(table) and c.name == pk_name)]
+
+
+def natural_key(table) -> str:
+    """Column identifying a row on both sides: the primary key, or a unique column for surrogate-keyed tables"""
+    if not is_surrogate_key(table):
+        return list(table.primary_key.columns)[0].name
+    for column in table.columns:
+        if column.unique:
+            return column.name
+    raise ValueError(f"Table {table.name} has no key that survives the copy")
+
+
+# ===== CHECKPOINT =====
+
+class Checkpoint:
+    def __init__(self, path: str, target_url: str, restart: bool):
+        self.path = path
+        self._lock = threading.Lock()
+        target_id = hashlib.sha256(target_url.encode()).hexdigest()[:16]
+        self.state = {}
+        if not restart and os.path.exists(path):
+            with open(path, "r") as f:
+                self.state = json.load(f)
+        if self.state.get("target") != target_id:
+            self.state = {"target": target_id, "tables": {}}
+
+    def table(self, name: str) -> dict:
+        return self.state["tables"].setdefault(name, {"boundaries": None, "done": []})
+
+    def mark_done(self, name: str, index: int):
+        with self._lock:
+            done = self.table(name)["done"]
+            if index not in done:
+                done.append(index)
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
+
+def key_boundaries(engine, table, batch_size: int) -> list:
+    """Every batch_size-th primary key; batch i covers (b[i-1], b[i]]"""
+    pk = list(table.primary_key.columns)[0]
+    boundaries = []
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(select(pk).order_by(pk))
+        for i, key in enumerate(result.scalars(), start=1):
+            if i % batch_size == 0:
+                boundaries.append(key)
+    return boundaries
+
+
+def batch_ranges(boundaries: list):
+    lows = [None] + boundaries
+    highs = boundaries + [None]
+    return list(enumerate(zip(lows, highs)))
+
+
+def read_batch(engine, table, low, high) -> list:
+    pk = list(table.primary_key.columns)[0]
+    query = select(table).order_by(pk)
+    if low is not None:
+        query = query.where(pk > low)
+    if high is not None:
+        query = query.where(pk <= high)
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(query)]
+
+
+# ===== LOADING =====
+
+def copy_value(value) -> str:
+    """Encode a value for COPY ... FROM STDIN (text format)"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def load_with_copy(engine, table, columns: list, rows: list):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(row[c]) for c in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    stage = f"stage_{table.name}_{threading.get_ident()}"
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'CREATE TEMP TABLE "{stage}" (LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+        cursor.copy_expert(f'COPY "{stage}" ({column_list}) FROM STDIN', buffer)
+        cursor.execute(
+            f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM "{stage}" ON CONFLICT DO NOTHING'
         )
-        railway_session.add(new_user)
-        print(f"✅ Migrated: {user.username} {'(admin)' if user.is_admin else ''}")
-        migrated_count += 1
-    
-    railway_session.commit()
-    print(f"\n🎉 Migration completed!")
-    print(f"   ✅ Migrated: {migrated_count} users")
-    print(f"   ⏭️  Skipped: {skipped_count} users (already existed)")
-    
-except Exception as e:
-    print(f"\n❌ Error during migration: {e}")
-    railway_session.rollback()
-    raise
-finally:
-    local_session.close()
-    railway_session.close()
-
-print("\n✅ Done! Your users are now on Railway.")
-print("🚀 You can now login with your existing accounts in the app!")
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+def load_with_insert(engine, table, columns: list, rows: list):
+    dialect_insert = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(engine.dialect.name)
+    if dialect_insert is None:
+        raise RuntimeError(f"Unsupported target database: {engine.dialect.name}")
+    statement = dialect_insert(table).on_conflict_do_nothing()
+    with engine.begin() as conn:
+        conn.execute(statement, [{c: row[c] for c in columns} for row in rows])
+
+
+def load_rows(engine, table, columns: list, rows: list):
+    if not rows:
+        return
+    if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+        load_with_copy(engine, table, columns, rows)
+    else:
+        load_with_insert(engine, table, columns, rows)
+
+
+# ===== USERS =====
+
+def user_names(engine) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(select(User.id, User.username)).all())
+
+
+def copy_users(source, target, checkpoint: Checkpoint, batch_size: int) -> dict:
+    """Copy users by username and return the source id -> target id map"""
+    table = User.__table__
+    print(f"📋 Copying {table.name}...")
+    state = checkpoint.table(table.name)
+    if state["boundaries"] is None:
+        state["boundaries"] = key_boundaries(source, table, batch_size)
+        checkpoint.save()
+
+    columns = copied_columns(table)
+    start = time.perf_counter()
+    copied = 0
+    for index, (low, high) in batch_ranges(state["boundaries"]):
+        if index in state["done"]:
+            continue
+        rows = read_batch(source, table, low, high)
+        load_rows(target, table, columns, rows)
+        copied += len(rows)
+        checkpoint.mark_done(table.name, index)
+    print(f"✅ {table.name}: {copied} rows read in {time.perf_counter() - start:.1f}s "
+          f"(existing usernames kept as they are)")
+
+    target_ids = {name: user_id for user_id, name in user_names(target).items()}
+    return {
+        source_id: target_ids[name]
+        for source_id, name in user_names(source).items()
+        if name in target_ids
+    }
+
+
+# ===== OTHER TABLES =====
+
+def copy_table(source, target, table, user_map: dict, checkpoint: Checkpoint, batch_size: int, workers: int):
+    print(f"\n📋 Copying {table.name}...")
+    state = checkpoint.table(table.name)
+    if state["boundaries"] is None:
+        state["boundaries"] = key_boundaries(source, table, batch_size)
+        checkpoint.save()
+
+    columns = copied_columns(table)
+    fk_columns = user_fk_columns(table)
+    pending = [(i, r) for i, r in batch_ranges(state["boundaries"]) if i not in state["done"]]
+    total = len(state["boundaries"]) + 1
+    if len(pending) < total:
+        print(f"   ↪️  Resuming: {total - len(pending)} of {total} batches already copied")
+
+    lock = threading.Lock()
+    counters = {"rows": 0, "orphans": 0, "batches": total - len(pending)}
+    start = time.perf_counter()
+
+    def run_batch(index, low, high):
+        rows = []
+        orphans = 0
+        for row in read_batch(source, table, low, high):
+            for column in fk_columns:
+                if row[column] is not None:
+                    mapped = user_map.get(row[column])
+                    if mapped is None:
+                        break
+                    row[column] = mapped
+            else:
+                rows.append(row)
+                continue
+            orphans += 1
+        load_rows(target, table, columns, rows)
+        checkpoint.mark_done(table.name, index)
+        with lock:
+            counters["rows"] += len(rows)
+            counters["orphans"] += orphans
+            counters["batches"] += 1
+            elapsed = time.perf_counter() - start
+            print(f"   ... batch {counters['batches']}/{total}, {counters['rows']} rows "
+                  f"({counters['rows'] / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run_batch, i, low, high) for i, (low, high) in pending]:
+            future.result()
+
+    print(f"✅ {table.name}: {counters['rows']} rows in {time.perf_counter() - start:.1f}s")
+    if counters["orphans"]:
+        print(f"   ⚠️  Skipped {counters['orphans']} rows pointing at users that do not exist")
+
+
+# ===== VERIFICATION =====
+
+def row_digest(row: dict, columns: list, fk_columns: list, names: dict) -> int:
+    values = []
+    for column in columns:
+        value = row[column]
+        if column in fk_columns:
+            value = names.get(value)
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        values.append(value)
+    encoded = json.dumps(values, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "big")
+
+
+def verify_table(source, target, table, user_map: dict, batch_size: int, workers: int) -> bool:
+    columns = copied_columns(table)
+    fk_columns = user_fk_columns(table)
+    key = natural_key(table)
+    source_names = user_names(source)
+    target_names = user_names(target)
+    boundaries = key_boundaries(source, table, batch_size)
+
+    def verify_batch(low, high):
+        source_rows = read_batch(source, table, low, high)
+        keys = []
+        source_sum = 0
+        for row in source_rows:
+            target_key = user_map.get(row[key]) if key in fk_columns else row[key]
+            if key in fk_columns and target_key is None:
+                continue
+            keys.append(target_key)
+            source_sum += row_digest(row, columns, fk_columns, source_names)
+
+        target_count = 0
+        target_sum = 0
+        key_column = table.c[key]
+        with target.connect() as conn:
+            for i in range(0, len(keys), IN_CLAUSE_SIZE):
+                for row in conn.execute(select(table).where(key_column.in_(keys[i:i + IN_CLAUSE_SIZE]))):
+                    target_count += 1
+                    target_sum += row_digest(dict(row._mapping), columns, fk_columns, target_names)
+        return len(keys), target_count, source_sum % 2 ** 64, target_sum % 2 ** 64
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda r: verify_batch(*r), [r for _, r in batch_ranges(boundaries)]))
+
+    expected = sum(r[0] for r in results)
+    found = sum(r[1] for r in results)
+    mismatched = sum(1 for r in results if r[2] != r[3])
+    with source.connect() as conn:
+        source_total = conn.execute(select(func.count()).select_from(table)).scalar()
+    with target.connect() as conn:
+        target_total = conn.execute(select(func.count()).select_from(table)).scalar()
+
+    ok = expected == found and mismatched == 0
+    print(f"   {'✅' if ok else '❌'} {table.name}: source {source_total} rows, target {target_total} rows, "
+          f"{found}/{expected} copied rows found, "
+          f"{'checksums match' if mismatched == 0 else f'{mismatched} batches with differing content'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy every table from SQLite to PostgreSQL")
+    parser.add_argument("--source", default=SOURCE_URL, help="Source database URL (default: sqlite:///chatapp.db)")
+    parser.add_argument("--target", default=os.getenv("DATABASE_URL"), help="Target database URL (default: $DATABASE_URL)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Batches loaded in parallel")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and copy everything again")
+    parser.add_argument("--verify-only", action="store_true", help="Only compare source and target")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the final verification")
+    args = parser.parse_args()
+
+    if not args.target:
+        print("❌ Error: DATABASE_URL environment variable not set!")
+        print("\nTo get your DATABASE_URL:")
+        print("1. Go to Railway dashboard")
+        print("2. Click on PostgreSQL database")
+        print("3. Go to 'Connect' tab")
+        print("4. Copy the DATABASE_URL")
+        print("\nThen run:")
+        print('set DATABASE_URL=your_database_url')
+        print('python migrate_to_railway.py')
+        sys.exit(1)
+
+    target_url = normalize_url(args.target)
+    source = create_engine(normalize_url(args.source), pool_size=args.workers + 1)
+    target = create_engine(target_url, pool_size=args.workers + 1)
+
+    print("🚀 Starting migration to Railway...")
+    print(f"📍 Source: {source.url.render_as_string(hide_password=True)}")
+    print(f"📍 Target: {target.url.render_as_string(hide_password=True)}")
+
+    # Create tables in the target if they don't exist
+    Base.metadata.create_all(target)
+    print("✅ Tables created/verified in target database\n")
+
+    tables = [t for t in Base.metadata.sorted_tables if t.name != User.__tablename__]
+    checkpoint = Checkpoint(args.checkpoint, target_url, args.restart)
+
+    try:
+        if args.verify_only:
+            target_ids = {name: user_id for user_id, name in user_names(target).items()}
+            user_map = {i: target_ids[n] for i, n in user_names(source).items() if n in target_ids}
+        else:
+            user_map = copy_users(source, target, checkpoint, args.batch_size)
+            for table in tables:
+                copy_table(source, target, table, user_map, checkpoint, args.batch_size, args.workers)
+
+        if not args.no_verify:
+            print("\n🔍 Verifying...")
+            results = [verify_table(source, target, User.__table__, user_map, args.batch_size, args.workers)]
+            for table in tables:
+                results.append(verify_table(source, target, table, user_map, args.batch_size, args.workers))
+            if not all(results):
+                print("\n⚠️  Verification found differences (rows that already existed on the target are kept as they were)")
+                sys.exit(2)
+    except Exception as e:
+        print(f"\n❌ Error during migration: {e}")
+        print(f"   Progress is saved in {args.checkpoint}; run the script again to resume")
+        raise
+
+    print("\n✅ Done! All tables are now on Railway.")
+    print("🚀 You can now login with your existing accounts in the app!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Move STORAGE_DIR and CHAT_FILES_DIR onto the hash-prefix sharded layout.
+
+Flat files in either directory move to <dir>/<ab>/<cd>/<name> (see
+sharding.py), together with any "<name>.previews" directory. The blob store
+under CHAT_FILES_DIR/.blobs is already sharded and is left alone.
+
+Safe to re-run: files already in place are left alone, and the apps find
+files in either location while the migration is in progress.
+
+Usage:
+    python migrate_to_sharded_layout.py [--dry-run]
+"""
+
+import argparse
+import os
+
+import sharding
+
+STORAGE_DIR = os.getenv("STORAGE_DIR", "./storage")
+CHAT_FILES_DIR = "./chat_files"
+
+
+def move(src: str, dest: str, dry_run: bool) -> bool:
+    if os.path.exists(dest):
+        print(f"   ⚠️  {dest} already exists, leaving {src} in place")
+        return False
+    if not dry_run:
+        sharding.ensure_parent(dest)
+        os.replace(src, dest)
+    return True
+
+
+def shard_flat_files(base_dir: str, dry_run: bool):
+    print(f"📋 Sharding {base_dir}...")
+    moved = 0
+    with os.scandir(base_dir) as it:
+        entries = [e for e in it if e.is_file() and not e.name.startswith(".")]
+    for entry in entries:
+        dest = sharding.sharded_path(base_dir, entry.name)
+        if move(entry.path, dest, dry_run):
+            moved += 1
+            previews = entry.path + ".previews"
+            if os.path.isdir(previews):
+                move(previews, dest + ".previews", dry_run)
+    print(f"✅ {'Would move' if dry_run else 'Moved'} {moved} files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move storage onto the sharded directory layout")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would move without touching files")
+    parser.add_argument("--storage-dir", default=STORAGE_DIR)
+    parser.add_argument("--chat-files-dir", default=CHAT_FILES_DIR)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🚀 Migrating to the sharded directory layout")
+    print("=" * 60)
+
+    shard_flat_files(args.storage_dir, args.dry_run)
+    print()
+    shard_flat_files(args.chat_files_dir, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Password hashing with scrypt on a dedicated, bounded worker pool.
+
+New hashes are scrypt with a random salt, stored as
+"scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64). Hashes from before this module
+are a bare SHA-256 hex digest; they still verify, and verify() hands back a
+scrypt replacement so the caller can upgrade the stored hash after a
+successful login.
+
+scrypt is deliberately slow and memory-hard, so it runs on its own small
+thread pool (hashlib releases the GIL while hashing) instead of the request
+threadpool. Admission control keeps a login storm from queueing without
+bound: when PASSWORD_HASH_QUEUE jobs are already waiting or running, new
+requests are turned away at once with 503 and a Retry-After estimate, and
+the rest of the API stays responsive.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs allowed to wait or run at once before new ones are rejected
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(PASSWORD_HASH_WORKERS * 8)))
+
+LEGACY_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def hash_password_sync(password: str) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def is_legacy_hash(stored: Optional[str]) -> bool:
+    return bool(stored) and bool(LEGACY_SHA256_RE.match(stored))
+
+
+def needs_rehash(stored: str) -> bool:
+    if is_legacy_hash(stored):
+        return True
+    try:
+        _, n, r, p, _, _ = stored.split("$")
+    except ValueError:
+        return True
+    return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+def verify_password_sync(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    Check a password against a stored hash. Returns (ok, new_hash); new_hash
+    is set when the stored hash is outdated and should be replaced.
+    """
+    if not stored:
+        return False, None
+    if is_legacy_hash(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy, stored):
+            return False, None
+        return True, hash_password_sync(password)
+    try:
+        scheme, n, r, p, salt, digest = stored.split("$")
+        if scheme != "scrypt":
+            return False, None
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False, None
+    if not hmac.compare_digest(actual, expected):
+        return False, None
+    return True, hash_password_sync(password) if needs_rehash(stored) else None
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_QUEUE):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._avg_seconds = 0.05
+        self.completed = 0
+        self.rejected = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                # Time for the queue ahead to drain, rounded up to whole seconds
+                retry_after = int(self._pending / self.workers * self._avg_seconds) + 1
+                raise HTTPException(status_code=503, detail="Too many login attempts in progress, try again shortly",
+                                    headers={"Retry-After": str(retry_after)})
+            self._pending += 1
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+                self._avg_seconds = self._avg_seconds * 0.9 + elapsed * 0.1
+
+    async def _submit(self, fn, *args):
+        self._admit()
+        try:
+            future = self._executor.submit(self._run, fn, *args)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password_sync, password)
+
+    async def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+        return await self._submit(verify_password_sync, password, stored)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_hash_ms": round(self._avg_seconds * 1000, 1),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,302 @@
+"""
+Per-user rate limiting and admission control for write endpoints.
+
+Every limited endpoint belongs to a class (message, heartbeat, upload,
+chunk). Each class has:
+
+- a token bucket per user: `rate` requests per second on average, with
+  bursts of up to `burst`. The user is the session's owner when a valid
+  token is sent, else the client address (never a username taken from the
+  URL, which would let anyone drain another user's bucket). Behind a proxy
+  the address is only the real client's when uvicorn runs with
+  --proxy-headers (see Procfile); otherwise all tokenless clients share
+  the proxy's bucket.
+- a concurrency limit per process: requests of that class allowed in
+  flight at once, so a flood cannot tie up every threadpool thread or DB
+  connection.
+
+Both answer 429 with Retry-After when exceeded.
+
+Endpoints are limited either by the limit() dependency or, for routes
+whose body is the expensive part (uploads), by RateLimitMiddleware: FastAPI
+reads form and JSON bodies before it resolves dependencies, while the
+middleware admits a request from its method and path before any of the
+body is received. Such routes are registered with limit_route().
+
+Bucket state lives in a backend: in process memory by default, or in Redis
+(RATE_LIMIT_REDIS_URL, needs the redis package) so all workers share one
+budget per user. Redis calls run in the threadpool, never on the event
+loop. A backend error lets the request through rather than failing it.
+
+Limits can be tuned per class with RATE_LIMIT_<CLASS>="<rate>/<burst>" and
+CONCURRENCY_LIMIT_<CLASS>=<n>, or switched off with RATE_LIMIT_ENABLED=0.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+# class -> (requests per second, burst), max concurrent requests
+DEFAULT_LIMITS = {
+    "message": ((5.0, 30), 64),
+    "heartbeat": ((1.0, 10), 32),
+    "upload": ((1.0, 10), 16),
+    "chunk": ((20.0, 100), 16),
+}
+
+
+def _env_limits(name: str, default: Tuple[Tuple[float, int], int]) -> Tuple[Tuple[float, int], int]:
+    (rate, burst), concurrency = default
+    spec = os.getenv(f"RATE_LIMIT_{name.upper()}")
+    if spec:
+        rate_text, _, burst_text = spec.partition("/")
+        rate = float(rate_text)
+        burst = int(burst_text) if burst_text else max(1, int(math.ceil(rate)))
+    concurrency = int(os.getenv(f"CONCURRENCY_LIMIT_{name.upper()}", str(concurrency)))
+    return (rate, burst), concurrency
+
+
+class MemoryBackend:
+    """Token buckets in this process only"""
+
+    MAX_BUCKETS = 100000
+    # take() only touches a dict, so it runs on the event loop
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take cost tokens. Returns (allowed, seconds until enough tokens)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (cost - tokens) / rate
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now, rate)
+        return allowed, retry_after
+
+    def _prune(self, now: float, rate: float):
+        # Buckets idle long enough to have refilled carry no state worth keeping
+        idle = [k for k, (_, updated) in self._buckets.items() if now - updated > 3600]
+        for key in idle:
+            del self._buckets[key]
+
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every worker"""
+
+    # take() is a network round trip, so it runs in the threadpool
+    blocking = True
+
+    # Refill, take and store atomically; returns {allowed, retry_after}
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> Tuple[bool, float]:
+        allowed, retry_after = self._script(keys=[self.prefix + key], args=[rate, burst, time.time(), cost])
+        return bool(allowed), float(retry_after)
+
+
+def create_backend():
+    if RATE_LIMIT_REDIS_URL:
+        return RedisBackend(RATE_LIMIT_REDIS_URL)
+    return MemoryBackend()
+
+
+class RateLimiter:
+    def __init__(self, identify: Optional[Callable[[HTTPConnection], Optional[str]]] = None, backend=None,
+                 limits: Optional[dict] = None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.identify = identify
+        self.backend = backend if backend is not None else create_backend()
+        self.enabled = enabled
+        self.limits = {name: _env_limits(name, default) for name, default in (limits or DEFAULT_LIMITS).items()}
+        self.in_flight = {name: 0 for name in self.limits}
+        self.rejected = {name: 0 for name in self.limits}
+        self.backend_errors = 0
+        self.backend_failing = False
+        # (method, compiled path pattern, class) for RateLimitMiddleware
+        self.routes: List[Tuple[str, "re.Pattern", str]] = []
+
+    def client_key(self, request: HTTPConnection) -> str:
+        user = self.identify(request) if self.identify else None
+        if user:
+            return f"user:{user}"
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    def _check_class(self, name: str):
+        # Unknown classes fail at startup, not on the first request
+        if name not in self.limits:
+            raise KeyError(f"Unknown rate limit class: {name}")
+
+    async def _take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        if getattr(self.backend, "blocking", True):
+            return await run_in_threadpool(self.backend.take, key, rate, burst)
+        return self.backend.take(key, rate, burst)
+
+    async def _admit(self, name: str, request: HTTPConnection) -> Optional[Tuple[float, str]]:
+        """
+        Take a token and a concurrency slot of one class. Returns None when
+        admitted (release with _release) or (retry_after, detail) when not.
+        """
+        (rate, burst), max_concurrent = self.limits[name]
+        if self.in_flight[name] >= max_concurrent:
+            self.rejected[name] += 1
+            return 1, "Server busy, try again shortly"
+        # Hold the slot while the backend answers, so concurrent requests cannot overshoot it
+        self.in_flight[name] += 1
+
+        key = f"{name}:{self.client_key(request)}"
+        try:
+            allowed, retry_after = await self._take(key, rate, burst)
+        except Exception as e:
+            # Never fail a request because the limiter's store is down; counted in
+            # rate_limit_backend_errors_total and printed once per outage
+            self.backend_errors += 1
+            if not self.backend_failing:
+                self.backend_failing = True
+                print(f"⚠️  Rate limit backend error, letting requests through: {e}")
+            allowed, retry_after = True, 0.0
+        else:
+            if self.backend_failing:
+                self.backend_failing = False
+                print("✅ Rate limit backend recovered")
+        if not allowed:
+            self._release(name)
+            self.rejected[name] += 1
+            return retry_after, "Too many requests, slow down"
+        return None
+
+    def _release(self, name: str):
+        self.in_flight[name] -= 1
+
+    @staticmethod
+    def retry_after_header(retry_after: float) -> str:
+        return str(max(1, int(math.ceil(retry_after))))
+
+    def limit(self, name: str):
+        """FastAPI dependency enforcing the limits of one endpoint class"""
+        self._check_class(name)
+
+        async def dependency(request: Request):
+            if not self.enabled:
+                yield
+                return
+            rejection = await self._admit(name, request)
+            if rejection is not None:
+                retry_after, detail = rejection
+                raise HTTPException(status_code=429, detail=detail,
+                                    headers={"Retry-After": self.retry_after_header(retry_after)})
+            try:
+                yield
+            finally:
+                self._release(name)
+
+        return dependency
+
+    def limit_route(self, method: str, path: str, name: str):
+        """Limit a route in RateLimitMiddleware; path uses FastAPI's {param} syntax"""
+        self._check_class(name)
+        pattern = re.sub(r"\\{[^/]+?\\}", "[^/]+", re.escape(path))
+        self.routes.append((method.upper(), re.compile(f"^{pattern}$"), name))
+
+    def route_class(self, method: str, path: str) -> Optional[str]:
+        for route_method, pattern, name in self.routes:
+            if route_method == method and pattern.match(path):
+                return name
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "backend_errors": self.backend_errors,
+            "backend_failing": self.backend_failing,
+            "classes": {
+                name: {
+                    "rate": rate,
+                    "burst": burst,
+                    "max_concurrent": max_concurrent,
+                    "in_flight": self.in_flight[name],
+                    "rejected": self.rejected[name],
+                }
+                for name, ((rate, burst), max_concurrent) in self.limits.items()
+            },
+        }
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware admitting limit_route() routes before their body is read"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        name = None
+        if scope["type"] == "http" and self.limiter.enabled:
+            name = self.limiter.route_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = await self.limiter._admit(name, HTTPConnection(scope))
+        if rejection is not None:
+            retry_after, detail = rejection
+            body = json.dumps({"detail": detail}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", self.limiter.retry_after_header(retry_after).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter._release(name)
@@ -0,0 +1,137 @@
+"""
+Primary/replica routing for the sql engine's reads.
+
+With DATABASE_REPLICA_URL set, database.read_engine points at a read
+replica. SqlStorage asks use_replica() before each pure read; reads go to
+the replica only when:
+
+- the request is a GET (or there is no request at all, e.g. background
+  jobs); other methods read from the primary what they are about to change
+- nothing has been written earlier in the same request (pin_primary())
+- the client has not written within READ_YOUR_WRITES_SECONDS, so a user
+  sees their own message right after sending it however far the replica
+  lags. A successful write pins its session's user to the primary for the
+  window (set_identify() tells the middleware who that is), which works for
+  cross-origin frontends that send a bearer token but no cookies. Pins are
+  per worker, so the response also sets a short-lived cookie that same-site
+  clients carry to every worker; it is SameSite=None; Secure over https so
+  credentialed cross-origin requests carry it as well.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from http.cookies import SimpleCookie
+from typing import Callable, Dict, Optional
+
+from starlette.requests import HTTPConnection
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+PRIMARY_COOKIE = "db_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+_use_primary: contextvars.ContextVar[bool] = contextvars.ContextVar("use_primary", default=False)
+_lock = threading.Lock()
+_reads = {"primary": 0, "replica": 0}
+_pinned_requests = 0
+# username -> time until which their reads go to the primary
+_pinned_users: Dict[str, float] = {}
+PINNED_USERS_SWEEP = 1024
+_identify: Optional[Callable[[HTTPConnection], Optional[str]]] = None
+
+
+def set_identify(identify: Optional[Callable[[HTTPConnection], Optional[str]]]):
+    """Name the user behind a request (without blocking), for per-user pins"""
+    global _identify
+    _identify = identify
+
+
+def use_replica() -> bool:
+    """Whether the current read may go to the replica; counted for /metrics"""
+    target = "primary" if _use_primary.get() else "replica"
+    with _lock:
+        _reads[target] += 1
+    return target == "replica"
+
+
+def pin_primary():
+    """Send the rest of the current request's reads to the primary"""
+    _use_primary.set(True)
+
+
+def stats() -> dict:
+    with _lock:
+        return {"primary_reads": _reads["primary"], "replica_reads": _reads["replica"],
+                "pinned_requests": _pinned_requests}
+
+
+def _pin_user(username: str, until: float):
+    with _lock:
+        if len(_pinned_users) >= PINNED_USERS_SWEEP:
+            now = time.time()
+            for name in [name for name, pinned in _pinned_users.items() if pinned <= now]:
+                del _pinned_users[name]
+        _pinned_users[username] = until
+
+
+def _is_https(scope) -> bool:
+    if scope.get("scheme") == "https":
+        return True
+    # Behind a TLS-terminating proxy (Railway) the app itself sees http
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-proto":
+            return value.split(b",")[0].strip() == b"https"
+    return False
+
+
+def _pinned_until(scope) -> float:
+    for name, value in scope.get("headers", ()):
+        if name == b"cookie":
+            morsel = SimpleCookie(value.decode("latin-1")).get(PRIMARY_COOKIE)
+            if morsel:
+                try:
+                    return float(morsel.value)
+                except ValueError:
+                    return 0.0
+    return 0.0
+
+
+class ReplicaRoutingMiddleware:
+    """Pure ASGI middleware choosing primary or replica reads per request"""
+
+    def __init__(self, app, window_seconds: float = READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.window_seconds = window_seconds
+
+    async def __call__(self, scope, receive, send):
+        global _pinned_requests
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        is_read = scope["method"] in READ_METHODS
+        username = _identify(HTTPConnection(scope)) if _identify else None
+        now = time.time()
+        with _lock:
+            user_pinned = username is not None and _pinned_users.get(username, 0.0) > now
+        recent_write = is_read and (user_pinned or _pinned_until(scope) > now)
+        if recent_write:
+            with _lock:
+                _pinned_requests += 1
+        token = _use_primary.set(not is_read or recent_write)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and not is_read and message["status"] < 400:
+                until = time.time() + self.window_seconds
+                if username is not None:
+                    _pin_user(username, until)
+                same_site = "None; Secure" if _is_https(scope) else "Lax"
+                cookie = f"{PRIMARY_COOKIE}={until:.3f}; Max-Age={int(self.window_seconds) + 1}; Path=/; SameSite={same_site}"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _use_primary.reset(token)
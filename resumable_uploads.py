@@ -0,0 +1,348 @@
+"""
+Resumable chunked uploads for chat attachments.
+
+A client creates an upload session, PUTs the file in chunks at explicit
+offsets (each chunk optionally carrying its SHA-256 in X-Chunk-SHA256),
+asks for the current offset after a dropped connection, and finalizes once
+everything has arrived. Finalize moves the file into the blob store and
+returns the same file_url/file_name/file_type payload as /upload_chat_file,
+so the result can go straight into send_message. A client that sends the
+file's SHA-256 when creating the session gets that payload back at once if
+the content is already stored.
+
+Session state lives next to the partial data in CHAT_FILES_DIR/.resumable
+as one JSON file per upload, so uploads survive a server restart. Sessions
+that are not touched for RESUMABLE_UPLOAD_TTL seconds are garbage-collected.
+Chunk writes and finalize hold an flock on the session's partial file, so
+workers sharing CHAT_FILES_DIR never interleave writes to one upload; on
+platforms without fcntl only one worker may serve resumable uploads.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from uploads import MAX_CHAT_FILE_SIZE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RESUMABLE_UPLOAD_TTL = int(os.getenv("RESUMABLE_UPLOAD_TTL", str(24 * 60 * 60)))
+RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024
+RESUMABLE_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+RESUMABLE_GC_INTERVAL = 15 * 60
+
+
+class UploadCreate(BaseModel):
+    file_name: str
+    total_size: int
+    content_type: Optional[str] = None
+    # Lets the server skip the transfer entirely when it already has the content
+    sha256: Optional[str] = None
+
+
+class ResumableUploadStore:
+    """Partial uploads and their session metadata on disk"""
+
+    def __init__(self, chat_files_dir: str, ttl: int = RESUMABLE_UPLOAD_TTL,
+                 max_size: int = MAX_CHAT_FILE_SIZE):
+        self.chat_files_dir = chat_files_dir
+        self.sessions_dir = os.path.join(chat_files_dir, ".resumable")
+        self.ttl = ttl
+        self.max_size = max_size
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.sessions_dir, f"{upload_id}.json")
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self.sessions_dir, f"{upload_id}.part")
+
+    def _save(self, session: dict):
+        tmp_path = self._meta_path(session["id"]) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, self._meta_path(session["id"]))
+
+    @asynccontextmanager
+    async def _locked(self, upload_id: str):
+        """
+        Serialize work on one upload. The asyncio lock orders requests within
+        this process; the flock on the partial file orders them across workers.
+        Raises KeyError before creating any lock if the upload does not exist.
+        """
+        await run_in_threadpool(self.get, upload_id)
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        self._lock_users[upload_id] = self._lock_users.get(upload_id, 0) + 1
+        try:
+            async with lock:
+                if fcntl is None:
+                    yield
+                    return
+                try:
+                    f = await run_in_threadpool(open, self._data_path(upload_id), "rb")
+                except FileNotFoundError:
+                    raise KeyError(upload_id)
+                try:
+                    await run_in_threadpool(fcntl.flock, f.fileno(), fcntl.LOCK_EX)
+                    yield
+                finally:
+                    f.close()
+        finally:
+            # The last request for an upload drops its lock, so ids never pile up
+            self._lock_users[upload_id] -= 1
+            if not self._lock_users[upload_id]:
+                del self._lock_users[upload_id]
+                del self._locks[upload_id]
+
+    def create(self, file_name: str, total_size: int, content_type: Optional[str] = None) -> dict:
+        if total_size < 0:
+            raise ValueError("total_size must not be negative")
+        if total_size > self.max_size:
+            raise OverflowError(f"Upload exceeds {self.max_size} bytes")
+        now = time.time()
+        session = {
+            "id": uuid.uuid4().hex,
+            "file_name": os.path.basename(file_name),
+            "content_type": content_type,
+            "total_size": total_size,
+            "offset": 0,
+            "created_at": now,
+            "expires_at": now + self.ttl,
+        }
+        open(self._data_path(session["id"]), "wb").close()
+        self._save(session)
+        return session
+
+    def get(self, upload_id: str) -> dict:
+        """Load a live session; raises KeyError if unknown or expired"""
+        # Upload ids are hex uuids; anything else cannot be ours
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        try:
+            with open(self._meta_path(upload_id), "r") as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        if session["expires_at"] < time.time():
+            self.discard(upload_id)
+            raise KeyError(upload_id)
+        return session
+
+    def _write_chunk(self, session: dict, offset: int, chunk_path: str):
+        # Chunks are staged to a side file first so a failed checksum or a
+        # dropped connection never corrupts the data received so far
+        with open(self._data_path(session["id"]), "r+b") as dest, open(chunk_path, "rb") as src:
+            dest.seek(offset)
+            dest.truncate()
+            while True:
+                data = src.read(1024 * 1024)
+                if not data:
+                    break
+                dest.write(data)
+        os.remove(chunk_path)
+
+    async def append(self, upload_id: str, offset: int, request: Request,
+                     checksum: Optional[str] = None) -> dict:
+        async with self._locked(upload_id):
+            session = await run_in_threadpool(self.get, upload_id)
+            if offset != session["offset"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Offset mismatch",
+                    headers={"Upload-Offset": str(session["offset"])},
+                )
+
+            chunk_path = self._data_path(upload_id) + ".chunk"
+            hasher = hashlib.sha256()
+            received = 0
+            f = await run_in_threadpool(open, chunk_path, "wb")
+            try:
+                async for data in request.stream():
+                    received += len(data)
+                    if received > RESUMABLE_MAX_CHUNK_SIZE:
+                        raise HTTPException(status_code=413, detail="Chunk too large")
+                    if offset + received > session["total_size"]:
+                        raise HTTPException(status_code=400, detail="Chunk extends past total_size")
+                    hasher.update(data)
+                    await run_in_threadpool(f.write, data)
+            except BaseException:
+                await run_in_threadpool(f.close)
+                await run_in_threadpool(os.remove, chunk_path)
+                raise
+            await run_in_threadpool(f.close)
+
+            if checksum and hasher.hexdigest() != checksum.lower():
+                await run_in_threadpool(os.remove, chunk_path)
+                raise HTTPException(status_code=422, detail="Chunk checksum mismatch")
+
+            await run_in_threadpool(self._write_chunk, session, offset, chunk_path)
+            session["offset"] = offset + received
+            session["expires_at"] = time.time() + self.ttl
+            await run_in_threadpool(self._save, session)
+            return session
+
+    def _hash_file(self, path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                hasher.update(data)
+        return hasher.hexdigest()
+
+    async def finalize(self, upload_id: str, commit: Callable[[str, dict], dict]) -> dict:
+        """
+        Hash a complete upload and hand its data file to commit(path, session),
+        which must move it into permanent storage. Returns commit's result.
+        """
+        async with self._locked(upload_id):
+            session = await run_in_threadpool(self.get, upload_id)
+            if session["offset"] != session["total_size"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Upload incomplete",
+                    headers={"Upload-Offset": str(session["offset"])},
+                )
+            data_path = self._data_path(upload_id)
+            session["sha256"] = await run_in_threadpool(self._hash_file, data_path)
+            result = await run_in_threadpool(commit, data_path, session)
+            await run_in_threadpool(self.discard, upload_id)
+        return result
+
+    def discard(self, upload_id: str):
+        for path in (self._meta_path(upload_id), self._data_path(upload_id),
+                     self._data_path(upload_id) + ".chunk"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def collect_expired(self) -> int:
+        """Delete expired sessions and orphaned partial files. Returns sessions removed."""
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.sessions_dir):
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext == ".json":
+                try:
+                    with open(entry.path, "r") as f:
+                        expires_at = json.load(f)["expires_at"]
+                except (ValueError, KeyError, OSError):
+                    expires_at = 0
+                if expires_at < now:
+                    self.discard(upload_id)
+                    removed += 1
+            elif ext in (".part", ".chunk", ".tmp"):
+                # Data whose metadata is gone (e.g. a crash between writes)
+                upload_id = entry.name.split(".", 1)[0]
+                stale = entry.stat().st_mtime < now - self.ttl
+                if stale and not os.path.exists(self._meta_path(upload_id)):
+                    os.remove(entry.path)
+        return removed
+
+    async def gc_loop(self, interval: int = RESUMABLE_GC_INTERVAL):
+        while True:
+            try:
+                removed = await run_in_threadpool(self.collect_expired)
+                if removed:
+                    print(f"🧹 Removed {removed} expired resumable uploads")
+            except Exception as e:
+                print(f"❌ Resumable upload GC failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def session_status(session: dict) -> dict:
+    return {
+        "complete": False,
+        "upload_id": session["id"],
+        "file_name": session["file_name"],
+        "offset": session["offset"],
+        "total_size": session["total_size"],
+        "chunk_size": RESUMABLE_CHUNK_SIZE,
+        "expires_at": session["expires_at"],
+    }
+
+
+def create_resumable_router(store: ResumableUploadStore,
+                            commit_file: Callable[[str, str, str, Optional[str]], dict],
+                            claim_file: Callable[[str, str, Optional[str]], Optional[dict]]) -> APIRouter:
+    """
+    Build the /uploads endpoints for an app.
+
+    commit_file(path, sha256, file name, content type) moves a finished
+    upload into permanent storage and returns the same payload as the app's
+    /upload_chat_file. claim_file(sha256, file name, content type) returns
+    that payload for content the app already stores, or None.
+    """
+    router = APIRouter()
+
+    def load_or_404(upload_id: str) -> dict:
+        try:
+            return store.get(upload_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+    @router.post("/uploads")
+    def create_upload(req: UploadCreate):
+        if req.total_size > store.max_size:
+            raise HTTPException(status_code=400, detail="File size exceeds 200MB limit")
+        # Duplicate content: finish immediately without transferring the payload
+        if req.sha256:
+            info = claim_file(req.sha256.lower(), req.file_name, req.content_type)
+            if info is not None:
+                return {"complete": True, "offset": req.total_size, "total_size": req.total_size, "file": info}
+        try:
+            session = store.create(req.file_name, req.total_size, req.content_type)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return session_status(session)
+
+    @router.get("/uploads/{upload_id}")
+    def get_upload(upload_id: str, response: Response):
+        session = load_or_404(upload_id)
+        response.headers["Upload-Offset"] = str(session["offset"])
+        return session_status(session)
+
+    @router.put("/uploads/{upload_id}")
+    async def put_chunk(upload_id: str, offset: int, request: Request, response: Response):
+        try:
+            session = await store.append(
+                upload_id, offset, request, request.headers.get("X-Chunk-SHA256")
+            )
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+        response.headers["Upload-Offset"] = str(session["offset"])
+        return session_status(session)
+
+    @router.post("/uploads/{upload_id}/finalize")
+    async def finalize_upload(upload_id: str):
+        def commit(path: str, session: dict) -> dict:
+            return commit_file(path, session["sha256"], session["file_name"], session["content_type"])
+
+        try:
+            return await store.finalize(upload_id, commit)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+    @router.delete("/uploads/{upload_id}")
+    def abort_upload(upload_id: str):
+        load_or_404(upload_id)
+        store.discard(upload_id)
+        return {"message": "Upload aborted"}
+
+    return router
@@ -0,0 +1,343 @@
+"""
+Server-side session tokens.
+
+/signup and /login issue a random token; the store maps it to the user it
+belongs to in an in-memory dict, so resolving a token on a request is a
+single lookup and never reads users.json or the users table. Tokens expire
+after SESSION_TTL seconds and are revoked on logout, ban and password change.
+
+Only a SHA-256 of each token is kept, in memory and in the persistent
+backend (the sessions table in database.py for the sql engine, a
+sessions.db SQLite file next to the JSON files otherwise), which lets
+sessions survive restarts and be shared between workers. Cached entries
+are re-checked against the backend every SESSION_CACHE_SECONDS, so a
+logout in one worker reaches the others within that window.
+
+Clients send the token as "Authorization: Bearer <token>" (or
+X-Session-Token). While SESSION_ENFORCE is off, requests without a token
+are still accepted so older clients keep working; a token that is sent
+must be valid and belong to the user the request acts as. Admin endpoints
+and the /ws push socket (?token=) always need one.
+"""
+
+import asyncio
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from fastapi import HTTPException, Request, WebSocket
+from starlette.requests import HTTPConnection
+from starlette.concurrency import run_in_threadpool
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 60 * 60)))
+SESSION_CACHE_SECONDS = int(os.getenv("SESSION_CACHE_SECONDS", "60"))
+SESSION_ENFORCE = os.getenv("SESSION_ENFORCE", "").lower() in ("1", "true", "yes")
+SESSION_PURGE_INTERVAL = 10 * 60
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def token_from_request(request: HTTPConnection) -> Optional[str]:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, value = authorization.partition(" ")
+    if scheme.lower() == "bearer" and value.strip():
+        return value.strip()
+    return request.headers.get("x-session-token") or None
+
+
+class SessionInfo:
+    __slots__ = ("token_hash", "username", "is_admin", "expires_at", "checked_at")
+
+    def __init__(self, token_hash: str, username: str, is_admin: bool, expires_at: float,
+                 checked_at: Optional[float] = None):
+        self.token_hash = token_hash
+        self.username = username
+        self.is_admin = is_admin
+        self.expires_at = expires_at
+        self.checked_at = checked_at if checked_at is not None else time.time()
+
+
+class DatabaseSessionBackend:
+    """Persists sessions in the sessions table (database.SessionToken)"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def save(self, info: SessionInfo):
+        from database import SessionToken
+
+        db = self.session_factory()
+        try:
+            db.add(SessionToken(
+                token_hash=info.token_hash,
+                username=info.username,
+                is_admin=info.is_admin,
+                expires_at=datetime.utcfromtimestamp(info.expires_at),
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def load(self, token_hash: str) -> Optional[SessionInfo]:
+        from database import SessionToken
+
+        db = self.session_factory()
+        try:
+            row = db.get(SessionToken, token_hash)
+            if row is None:
+                return None
+            expires_at = (row.expires_at - datetime(1970, 1, 1)).total_seconds()
+            return SessionInfo(row.token_hash, row.username, row.is_admin, expires_at)
+        finally:
+            db.close()
+
+    def delete(self, token_hash: str):
+        from database import SessionToken
+
+        db = self.session_factory()
+        try:
+            db.query(SessionToken).filter(SessionToken.token_hash == token_hash).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def delete_user(self, username: str):
+        from database import SessionToken
+
+        db = self.session_factory()
+        try:
+            db.query(SessionToken).filter(SessionToken.username == username).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def purge(self, now: float):
+        from database import SessionToken
+
+        db = self.session_factory()
+        try:
+            db.query(SessionToken).filter(
+                SessionToken.expires_at < datetime.utcfromtimestamp(now)
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+
+
+class SqliteSessionBackend:
+    """Persists sessions in a SQLite file, for engines without a database (json, sharded)"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        token_hash TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        is_admin INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_sessions_username ON sessions (username);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._db().executescript(self.SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def save(self, info: SessionInfo):
+        self._db().execute(
+            "INSERT OR REPLACE INTO sessions (token_hash, username, is_admin, expires_at) VALUES (?, ?, ?, ?)",
+            (info.token_hash, info.username, int(info.is_admin), info.expires_at),
+        )
+
+    def load(self, token_hash: str) -> Optional[SessionInfo]:
+        row = self._db().execute(
+            "SELECT token_hash, username, is_admin, expires_at FROM sessions WHERE token_hash = ?", (token_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return SessionInfo(row[0], row[1], bool(row[2]), row[3])
+
+    def delete(self, token_hash: str):
+        self._db().execute("DELETE FROM sessions WHERE token_hash = ?", (token_hash,))
+
+    def delete_user(self, username: str):
+        self._db().execute("DELETE FROM sessions WHERE username = ?", (username,))
+
+    def purge(self, now: float):
+        self._db().execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+
+class SessionStore:
+    def __init__(self, backend=None, ttl: int = SESSION_TTL, enforce: bool = SESSION_ENFORCE,
+                 cache_seconds: int = SESSION_CACHE_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.enforce = enforce
+        self.cache_seconds = cache_seconds
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, SessionInfo] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+
+    # ----- cache -----
+
+    def _cache(self, info: SessionInfo):
+        with self._lock:
+            self._sessions[info.token_hash] = info
+            self._by_user.setdefault(info.username, set()).add(info.token_hash)
+
+    def _evict(self, token_hash: str):
+        with self._lock:
+            info = self._sessions.pop(token_hash, None)
+            if info is not None:
+                tokens = self._by_user.get(info.username)
+                if tokens is not None:
+                    tokens.discard(token_hash)
+                    if not tokens:
+                        del self._by_user[info.username]
+
+    # ----- lifecycle -----
+
+    def issue(self, username: str, is_admin: bool = False) -> str:
+        token = secrets.token_urlsafe(32)
+        info = SessionInfo(hash_token(token), username, is_admin, time.time() + self.ttl)
+        if self.backend is not None:
+            self.backend.save(info)
+        self._cache(info)
+        return token
+
+    def resolve(self, token: Optional[str]) -> Optional[SessionInfo]:
+        """Session for a token, or None if it is unknown, revoked or expired"""
+        if not token:
+            return None
+        token_hash = hash_token(token)
+        now = time.time()
+        info = self._sessions.get(token_hash)
+
+        if info is not None and self.backend is not None and now - info.checked_at > self.cache_seconds:
+            # Pick up revocations made by other workers
+            self._evict(token_hash)
+            info = None
+        if info is None and self.backend is not None:
+            info = self.backend.load(token_hash)
+            if info is not None:
+                self._cache(info)
+
+        if info is None:
+            return None
+        if info.expires_at <= now:
+            self.revoke_hash(token_hash)
+            return None
+        return info
+
+    def revoke(self, token: Optional[str]):
+        if token:
+            self.revoke_hash(hash_token(token))
+
+    def revoke_hash(self, token_hash: str):
+        self._evict(token_hash)
+        if self.backend is not None:
+            self.backend.delete(token_hash)
+
+    def revoke_user(self, username: str):
+        """Drop every session of a user (ban, password change)"""
+        with self._lock:
+            token_hashes = list(self._by_user.get(username, ()))
+        for token_hash in token_hashes:
+            self._evict(token_hash)
+        if self.backend is not None:
+            self.backend.delete_user(username)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [h for h, info in self._sessions.items() if info.expires_at <= now]
+        for token_hash in expired:
+            self._evict(token_hash)
+        if self.backend is not None:
+            self.backend.purge(now)
+
+    async def purge_loop(self, interval: int = SESSION_PURGE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(self.purge_expired)
+            except Exception as e:
+                print(f"❌ Session purge failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached_sessions": len(self._sessions), "users": len(self._by_user)}
+
+    def username_for(self, request: Request) -> Optional[str]:
+        """
+        Owner of the request's session from the in-memory cache only, or None.
+        Never raises or touches the backend, so it is safe on the event loop.
+        """
+        token = token_from_request(request)
+        info = self._sessions.get(hash_token(token)) if token else None
+        if info is None or info.expires_at <= time.time():
+            return None
+        return info.username
+
+    # ----- FastAPI dependencies -----
+
+    def optional_session(self, request: Request) -> Optional[SessionInfo]:
+        """The request's session; None if no token was sent. A bad token is a 401."""
+        token = token_from_request(request)
+        if token is None:
+            if self.enforce:
+                raise HTTPException(status_code=401, detail="Not authenticated",
+                                    headers={"WWW-Authenticate": "Bearer"})
+            return None
+        info = self.resolve(token)
+        if info is None:
+            raise HTTPException(status_code=401, detail="Session expired or invalid",
+                                headers={"WWW-Authenticate": "Bearer"})
+        return info
+
+    def require_session(self, request: Request) -> SessionInfo:
+        info = self.resolve(token_from_request(request))
+        if info is None:
+            raise HTTPException(status_code=401, detail="Not authenticated",
+                                headers={"WWW-Authenticate": "Bearer"})
+        return info
+
+    def require_admin(self, request: Request) -> SessionInfo:
+        # Always needs a token, even with SESSION_ENFORCE off: admin endpoints are destructive
+        info = self.require_session(request)
+        if not info.is_admin:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        return info
+
+    def socket_session(self, websocket: WebSocket, username: str) -> Optional[SessionInfo]:
+        """
+        Session of a WebSocket handshake acting as username, or None. Browsers
+        cannot set headers on a WebSocket, so the token may come as ?token=.
+        Always required: a socket receives the user's private pushes.
+        """
+        token = websocket.query_params.get("token") or token_from_request(websocket)
+        info = self.resolve(token)
+        if info is None or (info.username != username and not info.is_admin):
+            return None
+        return info
+
+    @staticmethod
+    def authorize(info: Optional[SessionInfo], username: str):
+        """Reject a session acting as another user (admins may act as anyone)"""
+        if info is not None and info.username != username and not info.is_admin:
+            raise HTTPException(status_code=403, detail="Session does not belong to this user")
@@ -0,0 +1,106 @@
+"""
+Hash-prefix sharded directory layout for STORAGE_DIR and CHAT_FILES_DIR.
+
+A file called <name> lives at <base>/<ab>/<cd>/<name>, where abcd are the
+first four hex digits of md5(<name>). That keeps every directory small
+(65,536 leaves) no matter how many files are stored, so lookups, creates and
+listings stay fast past a few hundred thousand files.
+
+Files from before the layout existed sit directly in <base>; lookups fall
+back to them until migrate_to_sharded_layout.py has moved them.
+"""
+
+import hashlib
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+
+
+def shard_parts(name: str) -> Tuple[str, str]:
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def sharded_path(base_dir: str, name: str) -> str:
+    first, second = shard_parts(name)
+    return os.path.join(base_dir, first, second, name)
+
+
+def ensure_parent(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def is_valid_name(name: str) -> bool:
+    return bool(name) and os.path.basename(name) == name and not name.startswith(".")
+
+
+def resolve(base_dir: str, name: str) -> Optional[str]:
+    """Existing path for a stored file, sharded or legacy flat. None if absent."""
+    if not is_valid_name(name):
+        return None
+    path = sharded_path(base_dir, name)
+    if os.path.isfile(path):
+        return path
+    legacy_path = os.path.join(base_dir, name)
+    if os.path.isfile(legacy_path):
+        return legacy_path
+    return None
+
+
+def _sorted_entries(path: str):
+    try:
+        with os.scandir(path) as it:
+            return sorted(it, key=lambda e: e.name)
+    except FileNotFoundError:
+        return []
+
+
+def iter_files(base_dir: str, after: Optional[str] = None) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    Yield (cursor, DirEntry) for every stored file in a stable order: legacy
+    flat files first, then shard by shard. The cursor of an entry can be
+    passed back as ``after`` to resume right behind it.
+
+    Only one leaf directory is held in memory at a time.
+    """
+    after_key = _cursor_key(after) if after else None
+
+    # Legacy files in the base directory; cursors look like "/<name>"
+    shard_dirs = []
+    for entry in _sorted_entries(base_dir):
+        if entry.is_dir(follow_symlinks=False):
+            if SHARD_RE.match(entry.name):
+                shard_dirs.append(entry)
+            continue
+        if entry.name.startswith(".") or not entry.is_file():
+            continue
+        cursor = f"/{entry.name}"
+        if after_key is None or _cursor_key(cursor) > after_key:
+            yield cursor, entry
+
+    for first in shard_dirs:
+        if after_key is not None and after_key[0] == 1 and first.name < after_key[1]:
+            continue
+        for second in _sorted_entries(first.path):
+            if not second.is_dir(follow_symlinks=False) or not SHARD_RE.match(second.name):
+                continue
+            if after_key is not None and after_key[0] == 1 and (first.name, second.name) < after_key[1:3]:
+                continue
+            for entry in _sorted_entries(second.path):
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                cursor = f"{first.name}/{second.name}/{entry.name}"
+                if after_key is None or _cursor_key(cursor) > after_key:
+                    yield cursor, entry
+
+
+def _cursor_key(cursor: str):
+    # Legacy entries ("/<name>") sort before every shard entry ("ab/cd/<name>")
+    if cursor.startswith("/"):
+        return (0, "", "", cursor[1:])
+    parts = cursor.split("/", 2)
+    if len(parts) != 3:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (1, parts[0], parts[1], parts[2])
@@ -0,0 +1,57 @@
+"""
+Keep a second SQLite file as a lagging copy of the database, for trying
+DATABASE_REPLICA_URL locally.
+
+Every --interval seconds the primary is copied into the replica with
+SQLite's online backup API, which takes a consistent snapshot while the
+server keeps writing. Replica reads are up to --interval seconds stale, like
+a Postgres standby under load; that is the lag read-your-writes routing
+(replica_routing.py) hides from the user who wrote.
+
+Usage:
+    python sqlite_replica.py [--primary chatapp.db] [--replica chatapp_replica.db] [--interval 2] [--once]
+    DATABASE_REPLICA_URL=sqlite:///./chatapp_replica.db uvicorn main_with_db:app
+"""
+
+import argparse
+import sqlite3
+import time
+
+
+def sync(primary: str, replica: str) -> float:
+    """Copy primary into replica; returns seconds taken"""
+    start = time.perf_counter()
+    source = sqlite3.connect(primary)
+    target = sqlite3.connect(replica)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy a SQLite database to a replica file periodically")
+    parser.add_argument("--primary", default="chatapp.db")
+    parser.add_argument("--replica", default="chatapp_replica.db")
+    parser.add_argument("--interval", type=float, default=2, help="Seconds between copies (the replica's lag)")
+    parser.add_argument("--once", action="store_true", help="Copy once and exit")
+    args = parser.parse_args()
+
+    print(f"🔁 Replicating {args.primary} → {args.replica}" + ("" if args.once else f" every {args.interval:g}s"))
+    while True:
+        try:
+            elapsed = sync(args.primary, args.replica)
+            if args.once:
+                print(f"✅ Copied in {elapsed * 1000:.0f} ms")
+                return
+        except sqlite3.Error as e:
+            print(f"⚠️  Copy failed: {e}")
+            if args.once:
+                raise
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
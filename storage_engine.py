@@ -0,0 +1,201 @@
+"""
+Storage engine interface for the chat server.
+
+chat_server.py reaches users, presence and messages only through a
+StorageEngine, so a backend can be tuned or replaced without touching
+endpoint code. Implementations:
+
+- storage_json.JsonStorage: users.json, messages.json, online_users.json and
+  banned_users.json in the working directory (the original main.py format)
+- storage_sql.SqlStorage: the database.py schema through SQLAlchemy
+- storage_memory.MemoryStorage: plain dicts in process memory, for
+  benchmarks and throwaway instances
+- storage_sharded.ShardedStorage: JsonStorage's users and presence, with
+  messages in per-conversation SQLite shards that take writes in parallel
+
+STORAGE_ENGINE=json|sql|memory|sharded picks one; by default it is sql when
+DATABASE_URL is set and json otherwise.
+
+Records are plain dicts. Users:
+    {"username", "password", "plain_password", "is_admin", "is_banned", "created_at"}
+Messages:
+    {"id", "from", "to", "message", "timestamp", "edited",
+     "file_url", "file_name", "file_type", "deleted_for_everyone"}
+Groups and group messages (stored once per group, not once per member):
+    {"id", "name", "created_by", "created_at", "members"}
+    {"id", "group_id", "from", "message", "timestamp", "edited",
+     "file_url", "file_name", "file_type", "deleted_for_everyone"}
+An engine may carry extra keys of its own (the JSON files keep "deleted_for").
+
+Every method is synchronous and may block on I/O; the app calls them from
+the threadpool.
+"""
+
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE") or ("sql" if os.getenv("DATABASE_URL") else "json")
+# A user with no heartbeat for this long is shown as offline
+ONLINE_TIMEOUT_SECONDS = 60
+
+
+class StorageEngine:
+    name = "base"
+
+    # ----- lifecycle -----
+
+    def init(self):
+        """Create tables or files; called once at startup"""
+
+    def instrument(self):
+        """Hook the engine into instrumentation.py, if it has anything to hook"""
+
+    def session_backend(self):
+        """Persistent session store for sessions.SessionStore, or None to keep sessions in memory"""
+        return None
+
+    def install(self, app, request_metrics):
+        """Add any middleware and /metrics collectors the engine needs to the app"""
+
+    # ----- users -----
+
+    def get_user(self, username: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def existing_usernames(self, usernames: Iterable[str]) -> set:
+        """The subset of usernames that belong to registered users"""
+        raise NotImplementedError
+
+    def create_user(self, username: str, password_hash: str, plain_password: str) -> bool:
+        """False if the username is already taken"""
+        raise NotImplementedError
+
+    def update_user(self, username: str, **fields) -> bool:
+        """Set password, plain_password, is_admin or is_banned. False if there is no such user."""
+        raise NotImplementedError
+
+    def list_users(self) -> List[dict]:
+        raise NotImplementedError
+
+    def search_users(self, query: str, limit: int) -> List[str]:
+        """Usernames containing query (case-insensitive), banned users excluded"""
+        raise NotImplementedError
+
+    def banned_usernames(self) -> List[str]:
+        raise NotImplementedError
+
+    # ----- presence -----
+
+    def set_online(self, username: str):
+        raise NotImplementedError
+
+    def set_offline(self, username: str):
+        raise NotImplementedError
+
+    def online_users(self, max_age_seconds: int = ONLINE_TIMEOUT_SECONDS) -> Dict[str, str]:
+        """username -> ISO time of the last heartbeat, for users seen within max_age_seconds"""
+        raise NotImplementedError
+
+    def last_seen(self, username: str) -> Optional[str]:
+        raise NotImplementedError
+
+    # ----- messages -----
+
+    def add_message(self, sender: str, recipient: str, text: str, file_url: Optional[str] = None,
+                    file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        raise NotImplementedError
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """
+        Messages between two users, oldest first. With a viewer, messages
+        deleted for everyone or for the viewer are left out; without one
+        (admin view) everything is returned. With a limit, only the newest
+        `limit` messages sent before `before` (a naive UTC ISO timestamp,
+        like the ones every engine stamps messages with), which for the sql
+        engine may come from the archive (message_archive.py).
+        """
+        raise NotImplementedError
+
+    def contacts(self, username: str) -> List[str]:
+        """Users that username has exchanged messages with"""
+        raise NotImplementedError
+
+    def edit_message(self, message_id: str, text: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def delete_for_everyone(self, message_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        """Hide a message from one participant; with no username, from both"""
+        raise NotImplementedError
+
+    def conversation_summaries(self) -> List[dict]:
+        """{"users": [a, b], "message_count", "last_message"} for every pair that has chatted"""
+        raise NotImplementedError
+
+    def file_urls(self) -> Iterator[str]:
+        """file_url of every message and group message not deleted for everyone (for attachment_gc)"""
+        raise NotImplementedError
+
+    # ----- groups -----
+
+    def create_group(self, name: str, creator: str, members: Iterable[str]) -> dict:
+        """A new group of creator and members (registered usernames)"""
+        raise NotImplementedError
+
+    def get_group(self, group_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def user_groups(self, username: str) -> List[dict]:
+        """
+        The user's groups without member lists: "member_count", "unread"
+        (messages from others after the user's read cursor) and
+        "last_read_at", the cursor itself. Polled often, so it stays cheap
+        however large a group is.
+        """
+        raise NotImplementedError
+
+    def add_group_members(self, group_id: str, usernames: Iterable[str]) -> bool:
+        """False if the group does not exist; new members start with everything read"""
+        raise NotImplementedError
+
+    def remove_group_member(self, group_id: str, username: str) -> bool:
+        """False if username was not a member"""
+        raise NotImplementedError
+
+    def add_group_message(self, group_id: str, sender: str, text: str, file_url: Optional[str] = None,
+                          file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        raise NotImplementedError
+
+    def group_messages(self, group_id: str, before: Optional[str] = None,
+                       limit: Optional[int] = None) -> List[dict]:
+        """A group's messages not deleted for everyone, oldest first; before/limit as in conversation()"""
+        raise NotImplementedError
+
+    def mark_group_read(self, group_id: str, username: str, up_to: str) -> Optional[str]:
+        """
+        Move a member's read cursor forward to up_to (a naive UTC ISO timestamp),
+        no further than the group's newest message. Returns the cursor, None if not a member
+        """
+        raise NotImplementedError
+
+
+def create_storage(name: str = STORAGE_ENGINE) -> StorageEngine:
+    if name == "json":
+        from storage_json import JsonStorage
+        return JsonStorage()
+    if name == "sql":
+        from storage_sql import SqlStorage
+        return SqlStorage()
+    if name == "memory":
+        from storage_memory import MemoryStorage
+        return MemoryStorage()
+    if name == "sharded":
+        from storage_sharded import ShardedStorage
+        return ShardedStorage()
+    raise ValueError(f"Unknown STORAGE_ENGINE {name!r} (expected json, sql, memory or sharded)")
@@ -0,0 +1,457 @@
+"""
+JSON-file storage engine: the original main.py store.
+
+Every call reloads the file it needs and read-modify-write calls rewrite
+the whole file, so this engine suits small installs and local development.
+Writes go through write_json_atomic and a process-wide lock, so concurrent
+requests in one worker cannot lose each other's updates.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import attachment_gc
+import instrumentation
+from sessions import SqliteSessionBackend
+from storage_engine import StorageEngine, ONLINE_TIMEOUT_SECONDS
+
+
+def write_json_atomic(path: str, data):
+    # Write to a temp file and swap it in, so concurrent readers never see a half-written file
+    start = time.perf_counter()
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        size = f.tell()
+    os.replace(tmp_path, path)
+    instrumentation.record_json_io("write", path, size, time.perf_counter() - start)
+
+
+class JsonStorage(StorageEngine):
+    name = "json"
+
+    def __init__(self, data_dir: str = "."):
+        self.users_file = os.path.join(data_dir, "users.json")
+        self.messages_file = os.path.join(data_dir, "messages.json")
+        self.online_users_file = os.path.join(data_dir, "online_users.json")
+        self.banned_users_file = os.path.join(data_dir, "banned_users.json")
+        self.groups_file = os.path.join(data_dir, "groups.json")
+        self.group_messages_file = os.path.join(data_dir, "group_messages.json")
+        self.sessions_file = os.path.join(data_dir, "sessions.db")
+        self._lock = threading.RLock()
+
+        # Initialize data files
+        for path, empty in ((self.users_file, {}), (self.messages_file, []),
+                            (self.online_users_file, {}), (self.banned_users_file, []),
+                            (self.groups_file, {}), (self.group_messages_file, [])):
+            if not os.path.exists(path):
+                with open(path, "w") as f:
+                    json.dump(empty, f)
+
+    def session_backend(self):
+        # Sessions survive restarts and are shared between workers
+        return SqliteSessionBackend(self.sessions_file)
+
+    # ----- files -----
+
+    def load_users(self) -> dict:
+        return instrumentation.load_json(self.users_file)
+
+    def save_users(self, users: dict):
+        write_json_atomic(self.users_file, users)
+
+    def load_messages(self) -> list:
+        messages = instrumentation.load_json(self.messages_file)
+
+        # Ensure all messages have required fields for backwards compatibility
+        needs_save = False
+        for msg in messages:
+            if "id" not in msg:
+                msg["id"] = str(uuid.uuid4())
+                needs_save = True
+            if "edited" not in msg:
+                msg["edited"] = False
+                needs_save = True
+            if "deleted_for" not in msg:
+                msg["deleted_for"] = []
+                needs_save = True
+
+        if needs_save:
+            with self._lock:
+                self.save_messages(messages)
+        return messages
+
+    def save_messages(self, messages: list):
+        write_json_atomic(self.messages_file, messages)
+
+    def load_online_users(self) -> dict:
+        return instrumentation.load_json(self.online_users_file)
+
+    def save_online_users(self, online_users: dict):
+        write_json_atomic(self.online_users_file, online_users)
+
+    def load_banned_users(self) -> list:
+        return instrumentation.load_json(self.banned_users_file)
+
+    def save_banned_users(self, banned_users: list):
+        write_json_atomic(self.banned_users_file, banned_users)
+
+    def load_groups(self) -> dict:
+        return instrumentation.load_json(self.groups_file)
+
+    def save_groups(self, groups: dict):
+        write_json_atomic(self.groups_file, groups)
+
+    def load_group_messages(self) -> list:
+        return instrumentation.load_json(self.group_messages_file)
+
+    def save_group_messages(self, group_messages: list):
+        write_json_atomic(self.group_messages_file, group_messages)
+
+    # ----- users -----
+
+    @staticmethod
+    def _user_record(username: str, data: dict, is_banned: bool) -> dict:
+        return {
+            "username": username,
+            "password": data.get("password"),
+            "plain_password": data.get("plain_password"),
+            "is_admin": data.get("is_admin", False),
+            "is_banned": is_banned,
+            "created_at": data.get("created_at"),
+        }
+
+    def get_user(self, username: str) -> Optional[dict]:
+        users = self.load_users()
+        if username not in users:
+            return None
+        return self._user_record(username, users[username], username in self.load_banned_users())
+
+    def existing_usernames(self, usernames: Iterable[str]) -> set:
+        users = self.load_users()
+        return {username for username in usernames if username in users}
+
+    def create_user(self, username: str, password_hash: str, plain_password: str) -> bool:
+        with self._lock:
+            users = self.load_users()
+            if username in users:
+                return False
+            users[username] = {
+                "password": password_hash,
+                "plain_password": plain_password,  # WARNING: Security risk! Storing plain password for admin view
+                "created_at": datetime.utcnow().isoformat(),
+                "is_admin": False
+            }
+            self.save_users(users)
+        return True
+
+    def update_user(self, username: str, **fields) -> bool:
+        with self._lock:
+            users = self.load_users()
+            if username not in users:
+                return False
+            is_banned = fields.pop("is_banned", None)
+            if fields:
+                users[username].update(fields)
+                self.save_users(users)
+            if is_banned is not None:
+                banned_users = self.load_banned_users()
+                if is_banned and username not in banned_users:
+                    banned_users.append(username)
+                    self.save_banned_users(banned_users)
+                elif not is_banned and username in banned_users:
+                    banned_users.remove(username)
+                    self.save_banned_users(banned_users)
+        return True
+
+    def list_users(self) -> List[dict]:
+        users = self.load_users()
+        banned_users = set(self.load_banned_users())
+        return [self._user_record(username, data, username in banned_users) for username, data in users.items()]
+
+    def search_users(self, query: str, limit: int) -> List[str]:
+        users = self.load_users()
+        banned_users = set(self.load_banned_users())
+        query = query.lower()
+        matches = [username for username in users
+                   if query in username.lower() and username not in banned_users]
+        return matches[:limit]
+
+    def banned_usernames(self) -> List[str]:
+        return self.load_banned_users()
+
+    # ----- presence -----
+
+    def set_online(self, username: str):
+        with self._lock:
+            online_users = self.load_online_users()
+            online_users[username] = {
+                "status": "online",
+                "last_seen": datetime.utcnow().isoformat()
+            }
+            self.save_online_users(online_users)
+
+    def set_offline(self, username: str):
+        with self._lock:
+            online_users = self.load_online_users()
+            # Remove user completely when they go offline
+            if username in online_users:
+                del online_users[username]
+                self.save_online_users(online_users)
+
+    def online_users(self, max_age_seconds: int = ONLINE_TIMEOUT_SECONDS) -> Dict[str, str]:
+        online_users = self.load_online_users()
+        now = datetime.utcnow()
+        stale = [username for username, data in online_users.items()
+                 if (now - datetime.fromisoformat(data["last_seen"])).total_seconds() > max_age_seconds]
+
+        # Clean up stale users so the file does not grow with everyone who ever logged in
+        if stale:
+            with self._lock:
+                current = self.load_online_users()
+                for username in stale:
+                    if current.get(username) == online_users[username]:
+                        del current[username]
+                self.save_online_users(current)
+            for username in stale:
+                del online_users[username]
+
+        return {username: data["last_seen"] for username, data in online_users.items()
+                if data.get("status") == "online"}
+
+    def last_seen(self, username: str) -> Optional[str]:
+        data = self.load_online_users().get(username)
+        return data["last_seen"] if data else None
+
+    # ----- messages -----
+
+    def add_message(self, sender: str, recipient: str, text: str, file_url: Optional[str] = None,
+                    file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        new_message = {
+            "id": str(uuid.uuid4()),
+            "from": sender,
+            "to": recipient,
+            "message": text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "edited": False,
+            "deleted_for": []
+        }
+        # Add file info if present
+        if file_url:
+            new_message["file_url"] = file_url
+            new_message["file_name"] = file_name
+            new_message["file_type"] = file_type
+
+        with self._lock:
+            messages = self.load_messages()
+            messages.append(new_message)
+            self.save_messages(messages)
+        return new_message
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        for msg in self.load_messages():
+            if msg.get("id") == message_id:
+                return msg
+        return None
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        result = []
+        for msg in self.load_messages():
+            if not ((msg["from"] == user1 and msg["to"] == user2) or (msg["from"] == user2 and msg["to"] == user1)):
+                continue
+            if viewer is not None and (msg.get("deleted_for_everyone", False) or viewer in msg.get("deleted_for", [])):
+                continue
+            if before is not None and msg["timestamp"] >= before:
+                continue
+            result.append(msg)
+        return result[-limit:] if limit is not None else result
+
+    def contacts(self, username: str) -> List[str]:
+        contacts = set()
+        for msg in self.load_messages():
+            if msg["from"] == username:
+                contacts.add(msg["to"])
+            elif msg["to"] == username:
+                contacts.add(msg["from"])
+        return list(contacts)
+
+    def _update_message(self, message_id: str, change) -> Optional[dict]:
+        with self._lock:
+            messages = self.load_messages()
+            for msg in messages:
+                if msg.get("id") == message_id:
+                    change(msg)
+                    self.save_messages(messages)
+                    return msg
+        return None
+
+    def edit_message(self, message_id: str, text: str) -> Optional[dict]:
+        def change(msg):
+            msg["message"] = text
+            msg["edited"] = True
+            msg["edited_at"] = datetime.utcnow().isoformat()
+        return self._update_message(message_id, change)
+
+    def delete_for_everyone(self, message_id: str) -> Optional[dict]:
+        def change(msg):
+            msg["deleted_for_everyone"] = True
+        return self._update_message(message_id, change)
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        def change(msg):
+            deleted_for = msg.setdefault("deleted_for", [])
+            for participant in (msg["from"], msg["to"]):
+                if (username is None or username == participant) and participant not in deleted_for:
+                    deleted_for.append(participant)
+        return self._update_message(message_id, change)
+
+    def conversation_summaries(self) -> List[dict]:
+        conversations = {}
+        for msg in self.load_messages():
+            pair = tuple(sorted([msg["from"], msg["to"]]))
+            if pair not in conversations:
+                conversations[pair] = {
+                    "users": list(pair),
+                    "last_message": msg["timestamp"],
+                    "message_count": 1
+                }
+            else:
+                conversations[pair]["message_count"] += 1
+                if msg["timestamp"] > conversations[pair]["last_message"]:
+                    conversations[pair]["last_message"] = msg["timestamp"]
+        return list(conversations.values())
+
+    def file_urls(self):
+        return itertools.chain(attachment_gc.json_file_urls(self.messages_file), self.group_file_urls())
+
+    # ----- groups -----
+
+    def group_file_urls(self):
+        return attachment_gc.json_file_urls(self.group_messages_file)
+
+    @staticmethod
+    def _group_record(group_id: str, data: dict) -> dict:
+        return {
+            "id": group_id,
+            "name": data["name"],
+            "created_by": data["created_by"],
+            "created_at": data["created_at"],
+            "members": list(data["members"]),
+        }
+
+    @staticmethod
+    def _group_summary(group_id: str, data: dict, member_count: int, unread: int, last_read_at: str) -> dict:
+        return {
+            "id": group_id,
+            "name": data["name"],
+            "created_by": data["created_by"],
+            "created_at": data["created_at"],
+            "member_count": member_count,
+            "unread": unread,
+            "last_read_at": last_read_at,
+        }
+
+    def create_group(self, name: str, creator: str, members: Iterable[str]) -> dict:
+        now = datetime.utcnow().isoformat()
+        group_id = str(uuid.uuid4())
+        # username -> {"joined_at", "last_read_at"}: one read cursor per member
+        data = {
+            "name": name,
+            "created_by": creator,
+            "created_at": now,
+            "members": {username: {"joined_at": now, "last_read_at": now} for username in [creator, *members]}
+        }
+        with self._lock:
+            groups = self.load_groups()
+            groups[group_id] = data
+            self.save_groups(groups)
+        return self._group_record(group_id, data)
+
+    def get_group(self, group_id: str) -> Optional[dict]:
+        data = self.load_groups().get(group_id)
+        return self._group_record(group_id, data) if data else None
+
+    def user_groups(self, username: str) -> List[dict]:
+        groups = {group_id: data for group_id, data in self.load_groups().items() if username in data["members"]}
+        if not groups:
+            return []
+        unread = dict.fromkeys(groups, 0)
+        for msg in self.load_group_messages():
+            data = groups.get(msg["group_id"])
+            if (data and msg["from"] != username and not msg.get("deleted_for_everyone", False)
+                    and msg["timestamp"] > data["members"][username]["last_read_at"]):
+                unread[msg["group_id"]] += 1
+        return [self._group_summary(group_id, data, len(data["members"]), unread[group_id],
+                                    data["members"][username]["last_read_at"])
+                for group_id, data in groups.items()]
+
+    def add_group_members(self, group_id: str, usernames: Iterable[str]) -> bool:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            groups = self.load_groups()
+            if group_id not in groups:
+                return False
+            members = groups[group_id]["members"]
+            for username in usernames:
+                members.setdefault(username, {"joined_at": now, "last_read_at": now})
+            self.save_groups(groups)
+        return True
+
+    def remove_group_member(self, group_id: str, username: str) -> bool:
+        with self._lock:
+            groups = self.load_groups()
+            members = groups.get(group_id, {}).get("members", {})
+            if username not in members:
+                return False
+            del members[username]
+            self.save_groups(groups)
+        return True
+
+    def add_group_message(self, group_id: str, sender: str, text: str, file_url: Optional[str] = None,
+                          file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        new_message = {
+            "id": str(uuid.uuid4()),
+            "group_id": group_id,
+            "from": sender,
+            "message": text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "edited": False
+        }
+        if file_url:
+            new_message["file_url"] = file_url
+            new_message["file_name"] = file_name
+            new_message["file_type"] = file_type
+
+        with self._lock:
+            group_messages = self.load_group_messages()
+            group_messages.append(new_message)
+            self.save_group_messages(group_messages)
+        return new_message
+
+    def group_messages(self, group_id: str, before: Optional[str] = None,
+                       limit: Optional[int] = None) -> List[dict]:
+        result = [msg for msg in self.load_group_messages()
+                  if msg["group_id"] == group_id and not msg.get("deleted_for_everyone", False)
+                  and (before is None or msg["timestamp"] < before)]
+        return result[-limit:] if limit is not None else result
+
+    def mark_group_read(self, group_id: str, username: str, up_to: str) -> Optional[str]:
+        with self._lock:
+            groups = self.load_groups()
+            member = groups.get(group_id, {}).get("members", {}).get(username)
+            if member is None:
+                return None
+            # A cursor past the newest message would hide messages sent before that time
+            newest = max((msg["timestamp"] for msg in self.load_group_messages() if msg["group_id"] == group_id),
+                         default=None)
+            if newest is not None and min(up_to, newest) > member["last_read_at"]:
+                member["last_read_at"] = min(up_to, newest)
+                self.save_groups(groups)
+            return member["last_read_at"]
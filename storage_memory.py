@@ -0,0 +1,320 @@
+"""
+In-memory storage engine: plain dicts, nothing persisted.
+
+Meant for benchmarks (it shows what the app costs with storage taken out
+of the picture) and throwaway test instances. Messages are indexed per
+conversation and contacts per user, so the hot read paths do not scan
+every message. Data lives in one process; run a single worker with it.
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from storage_engine import StorageEngine, ONLINE_TIMEOUT_SECONDS
+
+
+def pair_key(user1: str, user2: str) -> tuple:
+    return (user1, user2) if user1 <= user2 else (user2, user1)
+
+
+class MemoryStorage(StorageEngine):
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.users: Dict[str, dict] = {}
+        self.banned = set()
+        self.online: Dict[str, datetime] = {}
+        self.messages: Dict[str, dict] = {}
+        # (user1, user2) sorted -> message ids in send order
+        self.conversations: Dict[tuple, List[str]] = {}
+        self.user_contacts: Dict[str, set] = {}
+        # group id -> group record with "members": {username: read cursor}
+        self.groups: Dict[str, dict] = {}
+        self.group_message_lists: Dict[str, List[dict]] = {}
+        self.user_group_ids: Dict[str, set] = {}
+
+    def bulk_load(self, users: dict, messages: Iterable[dict], banned: Iterable[str] = ()):
+        """Load data in main.py's JSON format (users.json dict, messages.json list, banned list)"""
+        with self._lock:
+            for username, data in users.items():
+                self.users[username] = {
+                    "username": username,
+                    "password": data.get("password"),
+                    "plain_password": data.get("plain_password"),
+                    "is_admin": data.get("is_admin", False),
+                    "created_at": data.get("created_at"),
+                }
+            self.banned.update(banned)
+            for msg in messages:
+                msg = dict(msg)
+                msg.setdefault("id", str(uuid.uuid4()))
+                msg.setdefault("edited", False)
+                msg.setdefault("deleted_for", [])
+                self._index(msg)
+
+    def _index(self, msg: dict):
+        self.messages[msg["id"]] = msg
+        self.conversations.setdefault(pair_key(msg["from"], msg["to"]), []).append(msg["id"])
+        self.user_contacts.setdefault(msg["from"], set()).add(msg["to"])
+        self.user_contacts.setdefault(msg["to"], set()).add(msg["from"])
+
+    # ----- users -----
+
+    def _user_record(self, data: dict) -> dict:
+        return dict(data, is_banned=data["username"] in self.banned)
+
+    def get_user(self, username: str) -> Optional[dict]:
+        data = self.users.get(username)
+        return self._user_record(data) if data else None
+
+    def existing_usernames(self, usernames: Iterable[str]) -> set:
+        return {username for username in usernames if username in self.users}
+
+    def create_user(self, username: str, password_hash: str, plain_password: str) -> bool:
+        with self._lock:
+            if username in self.users:
+                return False
+            self.users[username] = {
+                "username": username,
+                "password": password_hash,
+                "plain_password": plain_password,
+                "is_admin": False,
+                "created_at": datetime.utcnow().isoformat(),
+            }
+        return True
+
+    def update_user(self, username: str, **fields) -> bool:
+        with self._lock:
+            if username not in self.users:
+                return False
+            is_banned = fields.pop("is_banned", None)
+            self.users[username].update(fields)
+            if is_banned:
+                self.banned.add(username)
+            elif is_banned is not None:
+                self.banned.discard(username)
+        return True
+
+    def list_users(self) -> List[dict]:
+        return [self._user_record(data) for data in list(self.users.values())]
+
+    def search_users(self, query: str, limit: int) -> List[str]:
+        query = query.lower()
+        matches = []
+        for username in list(self.users):
+            if query in username.lower() and username not in self.banned:
+                matches.append(username)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def banned_usernames(self) -> List[str]:
+        return list(self.banned)
+
+    # ----- presence -----
+
+    def set_online(self, username: str):
+        self.online[username] = datetime.utcnow()
+
+    def set_offline(self, username: str):
+        self.online.pop(username, None)
+
+    def online_users(self, max_age_seconds: int = ONLINE_TIMEOUT_SECONDS) -> Dict[str, str]:
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+        return {username: last_seen.isoformat() for username, last_seen in list(self.online.items())
+                if last_seen >= cutoff}
+
+    def last_seen(self, username: str) -> Optional[str]:
+        last_seen = self.online.get(username)
+        return last_seen.isoformat() if last_seen else None
+
+    # ----- messages -----
+
+    def add_message(self, sender: str, recipient: str, text: str, file_url: Optional[str] = None,
+                    file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        new_message = {
+            "id": str(uuid.uuid4()),
+            "from": sender,
+            "to": recipient,
+            "message": text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "edited": False,
+            "deleted_for": []
+        }
+        if file_url:
+            new_message["file_url"] = file_url
+            new_message["file_name"] = file_name
+            new_message["file_type"] = file_type
+        with self._lock:
+            self._index(new_message)
+        return new_message
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        return self.messages.get(message_id)
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        with self._lock:
+            ids = list(self.conversations.get(pair_key(user1, user2), ()))
+        result = []
+        for message_id in ids:
+            msg = self.messages[message_id]
+            if viewer is not None and (msg.get("deleted_for_everyone", False) or viewer in msg["deleted_for"]):
+                continue
+            if before is not None and msg["timestamp"] >= before:
+                continue
+            result.append(msg)
+        return result[-limit:] if limit is not None else result
+
+    def contacts(self, username: str) -> List[str]:
+        with self._lock:
+            return list(self.user_contacts.get(username, ()))
+
+    def edit_message(self, message_id: str, text: str) -> Optional[dict]:
+        with self._lock:
+            msg = self.messages.get(message_id)
+            if msg:
+                msg["message"] = text
+                msg["edited"] = True
+                msg["edited_at"] = datetime.utcnow().isoformat()
+        return msg
+
+    def delete_for_everyone(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            msg = self.messages.get(message_id)
+            if msg:
+                msg["deleted_for_everyone"] = True
+        return msg
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        with self._lock:
+            msg = self.messages.get(message_id)
+            if msg:
+                for participant in (msg["from"], msg["to"]):
+                    if (username is None or username == participant) and participant not in msg["deleted_for"]:
+                        msg["deleted_for"].append(participant)
+        return msg
+
+    def conversation_summaries(self) -> List[dict]:
+        with self._lock:
+            conversations = [(pair, list(ids)) for pair, ids in self.conversations.items()]
+        return [
+            {
+                "users": list(pair),
+                "message_count": len(ids),
+                "last_message": max(self.messages[message_id]["timestamp"] for message_id in ids)
+            }
+            for pair, ids in conversations
+        ]
+
+    def file_urls(self):
+        with self._lock:
+            messages = list(self.messages.values())
+            messages += [msg for group_messages in self.group_message_lists.values() for msg in group_messages]
+        for msg in messages:
+            if msg.get("file_url") and not msg.get("deleted_for_everyone", False):
+                yield msg["file_url"]
+
+    # ----- groups -----
+
+    @staticmethod
+    def _group_record(group: dict) -> dict:
+        return dict(group, members=list(group["members"]))
+
+    def create_group(self, name: str, creator: str, members: Iterable[str]) -> dict:
+        now = datetime.utcnow().isoformat()
+        group = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "created_by": creator,
+            "created_at": now,
+            "members": {username: now for username in [creator, *members]}
+        }
+        with self._lock:
+            self.groups[group["id"]] = group
+            self.group_message_lists[group["id"]] = []
+            for username in group["members"]:
+                self.user_group_ids.setdefault(username, set()).add(group["id"])
+        return self._group_record(group)
+
+    def get_group(self, group_id: str) -> Optional[dict]:
+        group = self.groups.get(group_id)
+        return self._group_record(group) if group else None
+
+    def user_groups(self, username: str) -> List[dict]:
+        result = []
+        for group_id in list(self.user_group_ids.get(username, ())):
+            group = self.groups[group_id]
+            last_read_at = group["members"].get(username)
+            if last_read_at is None:
+                continue
+            unread = 0
+            # Newest first; stop at the read cursor
+            for msg in reversed(self.group_message_lists[group_id]):
+                if msg["timestamp"] <= last_read_at:
+                    break
+                if msg["from"] != username and not msg.get("deleted_for_everyone", False):
+                    unread += 1
+            result.append({key: group[key] for key in ("id", "name", "created_by", "created_at")})
+            result[-1].update(member_count=len(group["members"]), unread=unread, last_read_at=last_read_at)
+        return result
+
+    def add_group_members(self, group_id: str, usernames: Iterable[str]) -> bool:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            group = self.groups.get(group_id)
+            if group is None:
+                return False
+            for username in usernames:
+                group["members"].setdefault(username, now)
+                self.user_group_ids.setdefault(username, set()).add(group_id)
+        return True
+
+    def remove_group_member(self, group_id: str, username: str) -> bool:
+        with self._lock:
+            group = self.groups.get(group_id)
+            if group is None or username not in group["members"]:
+                return False
+            del group["members"][username]
+            self.user_group_ids.get(username, set()).discard(group_id)
+        return True
+
+    def add_group_message(self, group_id: str, sender: str, text: str, file_url: Optional[str] = None,
+                          file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        new_message = {
+            "id": str(uuid.uuid4()),
+            "group_id": group_id,
+            "from": sender,
+            "message": text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "edited": False
+        }
+        if file_url:
+            new_message["file_url"] = file_url
+            new_message["file_name"] = file_name
+            new_message["file_type"] = file_type
+        with self._lock:
+            self.group_message_lists.setdefault(group_id, []).append(new_message)
+        return new_message
+
+    def group_messages(self, group_id: str, before: Optional[str] = None,
+                       limit: Optional[int] = None) -> List[dict]:
+        with self._lock:
+            messages = list(self.group_message_lists.get(group_id, ()))
+        result = [msg for msg in messages if not msg.get("deleted_for_everyone", False)
+                  and (before is None or msg["timestamp"] < before)]
+        return result[-limit:] if limit is not None else result
+
+    def mark_group_read(self, group_id: str, username: str, up_to: str) -> Optional[str]:
+        with self._lock:
+            group = self.groups.get(group_id)
+            if group is None or username not in group["members"]:
+                return None
+            # A cursor past the newest message would hide messages sent before that time
+            messages = self.group_message_lists.get(group_id)
+            if messages and min(up_to, messages[-1]["timestamp"]) > group["members"][username]:
+                group["members"][username] = min(up_to, messages[-1]["timestamp"])
+            return group["members"][username]
@@ -0,0 +1,326 @@
+"""
+Conversation-sharded storage engine: messages spread over SQLite shard files.
+
+Users, presence, bans and groups stay in the JSON files (JsonStorage).
+One-to-one messages go to MESSAGE_SHARD_DIR/shard_NN.db, one of
+MESSAGE_SHARDS files picked by hashing the conversation's two usernames, so
+every message of a conversation lives in one shard. Each shard has its own writer lock (a
+threading lock in the worker, SQLite's file lock between workers), so
+sends in unrelated conversations commit in parallel instead of queuing
+behind one lock and one file rewrite.
+
+index.db is the routing index: one row per conversation with its shard. It
+is written only when a conversation starts, serves get_conversations, and
+keeps old conversations where they are if MESSAGE_SHARDS changes later.
+Message ids carry no shard, so edits and deletes look the id up in each
+shard (a primary-key probe per shard).
+
+The first start imports messages.json into the shards; the file is left
+untouched as a backup. index.db records when the import has finished, so
+a start interrupted halfway through imports again (rows already copied are
+skipped by id) instead of taking the routes it wrote for complete.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from storage_json import JsonStorage
+
+MESSAGE_SHARDS = int(os.getenv("MESSAGE_SHARDS", "8"))
+MESSAGE_SHARD_DIR = os.getenv("MESSAGE_SHARD_DIR", "./message_shards")
+SHARD_FILE = re.compile(r"^shard_(\d+)\.db$")
+BUSY_TIMEOUT_SECONDS = 5
+
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT NOT NULL UNIQUE,
+    user1 TEXT NOT NULL,
+    user2 TEXT NOT NULL,
+    from_user TEXT NOT NULL,
+    to_user TEXT NOT NULL,
+    message TEXT,
+    file_url TEXT,
+    file_name TEXT,
+    file_type TEXT,
+    timestamp TEXT NOT NULL,
+    edited INTEGER NOT NULL DEFAULT 0,
+    edited_at TEXT,
+    deleted_for_sender INTEGER NOT NULL DEFAULT 0,
+    deleted_for_receiver INTEGER NOT NULL DEFAULT 0,
+    deleted_for_everyone INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_messages_pair_time ON messages (user1, user2, timestamp);
+"""
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user1 TEXT NOT NULL,
+    user2 TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    PRIMARY KEY (user1, user2)
+);
+CREATE INDEX IF NOT EXISTS ix_conversations_user2 ON conversations (user2);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+IMPORTED_KEY = "messages_json_imported"
+COLUMNS = ("id", "from_user", "to_user", "message", "file_url", "file_name", "file_type", "timestamp",
+           "edited", "edited_at", "deleted_for_sender", "deleted_for_receiver", "deleted_for_everyone")
+SELECT_MESSAGE = f"SELECT {', '.join(COLUMNS)} FROM messages"
+INSERT_MESSAGE = ("INSERT OR IGNORE INTO messages (id, user1, user2, from_user, to_user, message, file_url, file_name, "
+                  "file_type, timestamp, edited, edited_at, deleted_for_sender, deleted_for_receiver, "
+                  "deleted_for_everyone) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def pair_key(user1: str, user2: str) -> tuple:
+    return (user1, user2) if user1 <= user2 else (user2, user1)
+
+
+def shard_for(pair: tuple, shards: int) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(f"{pair[0]}\0{pair[1]}".encode("utf-8")) % shards
+
+
+def row_to_message(row) -> dict:
+    """A shard row in the JSON engine's message format"""
+    msg = dict(zip(COLUMNS, row))
+    deleted_for = []
+    if msg["deleted_for_sender"]:
+        deleted_for.append(msg["from_user"])
+    if msg["deleted_for_receiver"] and msg["to_user"] not in deleted_for:
+        deleted_for.append(msg["to_user"])
+    result = {
+        "id": msg["id"],
+        "from": msg["from_user"],
+        "to": msg["to_user"],
+        "message": msg["message"],
+        "timestamp": msg["timestamp"],
+        "edited": bool(msg["edited"]),
+        "deleted_for": deleted_for
+    }
+    if msg["file_url"]:
+        result["file_url"] = msg["file_url"]
+        result["file_name"] = msg["file_name"]
+        result["file_type"] = msg["file_type"]
+    if msg["edited_at"]:
+        result["edited_at"] = msg["edited_at"]
+    if msg["deleted_for_everyone"]:
+        result["deleted_for_everyone"] = True
+    return result
+
+
+def message_to_row(msg: dict) -> tuple:
+    user1, user2 = pair_key(msg["from"], msg["to"])
+    deleted_for = msg.get("deleted_for", [])
+    return (msg["id"], user1, user2, msg["from"], msg["to"], msg["message"], msg.get("file_url"),
+            msg.get("file_name"), msg.get("file_type"), msg["timestamp"], int(bool(msg.get("edited"))),
+            msg.get("edited_at"), int(msg["from"] in deleted_for), int(msg["to"] in deleted_for),
+            int(bool(msg.get("deleted_for_everyone"))))
+
+
+class ShardedStorage(JsonStorage):
+    name = "sharded"
+
+    def __init__(self, data_dir: str = ".", shard_dir: str = MESSAGE_SHARD_DIR, shards: int = MESSAGE_SHARDS):
+        super().__init__(data_dir)
+        self.shard_dir = shard_dir
+        self.shards = shards
+        os.makedirs(shard_dir, exist_ok=True)
+        # Shards left over from a larger MESSAGE_SHARDS still hold their conversations
+        existing = [int(match.group(1)) for match in map(SHARD_FILE.match, os.listdir(shard_dir)) if match]
+        self.shard_ids = list(range(max([shards] + [shard + 1 for shard in existing])))
+        self._writer_locks = [threading.Lock() for _ in self.shard_ids]
+        self._index_lock = threading.Lock()
+        self._local = threading.local()
+        # (user1, user2) -> shard; routes never change once written, so caching them is safe
+        self._routes: Dict[tuple, int] = {}
+
+        conn = self._connect("index")
+        conn.executescript(INDEX_SCHEMA)
+        for shard in self.shard_ids:
+            self._connect(shard).executescript(SHARD_SCHEMA)
+
+    def messages_imported(self) -> bool:
+        """Whether messages.json has been fully copied into the shards"""
+        return self._connect("index").execute("SELECT 1 FROM meta WHERE key = ?", (IMPORTED_KEY,)).fetchone() is not None
+
+    def init(self):
+        index = self._connect("index")
+        if not self.messages_imported():
+            messages = self.load_messages()
+            if messages:
+                self.import_messages(messages)
+                print(f"✅ Imported {len(messages)} messages from {self.messages_file} into {len(self.shard_ids)} shards")
+            # Only once every shard has committed its rows
+            with self._index_lock:
+                index.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                              (IMPORTED_KEY, datetime.utcnow().isoformat()))
+                index.commit()
+
+    # ----- shards -----
+
+    def _path(self, shard) -> str:
+        name = "index.db" if shard == "index" else f"shard_{shard:02d}.db"
+        return os.path.join(self.shard_dir, name)
+
+    def _connect(self, shard) -> sqlite3.Connection:
+        # One connection per thread and shard; sqlite3 connections are not shared between threads
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(shard)
+        if conn is None:
+            conn = connections[shard] = sqlite3.connect(self._path(shard), timeout=BUSY_TIMEOUT_SECONDS)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _route(self, pair: tuple, create: bool = False) -> Optional[int]:
+        shard = self._routes.get(pair)
+        if shard is not None:
+            return shard
+        row = self._connect("index").execute(
+            "SELECT shard FROM conversations WHERE user1 = ? AND user2 = ?", pair
+        ).fetchone()
+        if row is None and not create:
+            return None
+        if row is None:
+            with self._index_lock:
+                conn = self._connect("index")
+                conn.execute("INSERT OR IGNORE INTO conversations (user1, user2, shard) VALUES (?, ?, ?)",
+                             pair + (shard_for(pair, self.shards),))
+                conn.commit()
+                # Another worker may have routed the conversation first
+                row = conn.execute("SELECT shard FROM conversations WHERE user1 = ? AND user2 = ?", pair).fetchone()
+        self._routes[pair] = row[0]
+        return row[0]
+
+    def _find(self, message_id: str):
+        """(shard, message) for an id, or (None, None)"""
+        for shard in self.shard_ids:
+            row = self._connect(shard).execute(f"{SELECT_MESSAGE} WHERE id = ?", (message_id,)).fetchone()
+            if row:
+                return shard, row_to_message(row)
+        return None, None
+
+    def import_messages(self, messages: Iterable[dict]):
+        """Copy messages in the JSON engine's format into their shards; ids already present are skipped"""
+        rows_by_shard: Dict[int, list] = {}
+        for msg in messages:
+            shard = self._route(pair_key(msg["from"], msg["to"]), create=True)
+            rows_by_shard.setdefault(shard, []).append(message_to_row(msg))
+        for shard, rows in rows_by_shard.items():
+            with self._writer_locks[shard]:
+                conn = self._connect(shard)
+                conn.executemany(INSERT_MESSAGE, rows)
+                conn.commit()
+
+    # ----- messages -----
+
+    def add_message(self, sender: str, recipient: str, text: str, file_url: Optional[str] = None,
+                    file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        new_message = {
+            "id": str(uuid.uuid4()),
+            "from": sender,
+            "to": recipient,
+            "message": text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "edited": False,
+            "deleted_for": []
+        }
+        if file_url:
+            new_message["file_url"] = file_url
+            new_message["file_name"] = file_name
+            new_message["file_type"] = file_type
+
+        shard = self._route(pair_key(sender, recipient), create=True)
+        with self._writer_locks[shard]:
+            conn = self._connect(shard)
+            conn.execute(INSERT_MESSAGE, message_to_row(new_message))
+            conn.commit()
+        return new_message
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        return self._find(message_id)[1]
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        pair = pair_key(user1, user2)
+        shard = self._route(pair)
+        if shard is None:
+            return []
+        conditions = ["user1 = :user1 AND user2 = :user2"]
+        if viewer is not None:
+            conditions.append("deleted_for_everyone = 0 AND NOT ((from_user = :viewer AND deleted_for_sender = 1) "
+                              "OR (to_user = :viewer AND deleted_for_receiver = 1))")
+        if before is not None:
+            conditions.append("timestamp < :before")
+        params = {"user1": pair[0], "user2": pair[1], "viewer": viewer, "before": before, "limit": limit}
+        query = f"{SELECT_MESSAGE} WHERE {' AND '.join(conditions)}"
+        conn = self._connect(shard)
+        if limit is None:
+            rows = conn.execute(f"{query} ORDER BY timestamp, rowid", params).fetchall()
+        else:
+            rows = conn.execute(f"{query} ORDER BY timestamp DESC, rowid DESC LIMIT :limit", params).fetchall()[::-1]
+        return [row_to_message(row) for row in rows]
+
+    def contacts(self, username: str) -> List[str]:
+        # Served from the routing index alone; no shard is opened
+        rows = self._connect("index").execute(
+            "SELECT user2 FROM conversations WHERE user1 = ? UNION SELECT user1 FROM conversations WHERE user2 = ?",
+            (username, username)
+        ).fetchall()
+        return [contact for contact, in rows]
+
+    def _update_message(self, message_id: str, statement: str, params: tuple = ()) -> Optional[dict]:
+        shard, msg = self._find(message_id)
+        if shard is None:
+            return None
+        with self._writer_locks[shard]:
+            conn = self._connect(shard)
+            conn.execute(statement, params + (message_id,))
+            conn.commit()
+            row = conn.execute(f"{SELECT_MESSAGE} WHERE id = ?", (message_id,)).fetchone()
+        return row_to_message(row)
+
+    def edit_message(self, message_id: str, text: str) -> Optional[dict]:
+        return self._update_message(message_id, "UPDATE messages SET message = ?, edited = 1, edited_at = ? WHERE id = ?",
+                                    (text, datetime.utcnow().isoformat()))
+
+    def delete_for_everyone(self, message_id: str) -> Optional[dict]:
+        return self._update_message(message_id, "UPDATE messages SET deleted_for_everyone = 1 WHERE id = ?")
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        if username is None:
+            return self._update_message(
+                message_id, "UPDATE messages SET deleted_for_sender = 1, deleted_for_receiver = 1 WHERE id = ?")
+        return self._update_message(
+            message_id,
+            "UPDATE messages SET deleted_for_sender = deleted_for_sender OR from_user = ?, "
+            "deleted_for_receiver = deleted_for_receiver OR to_user = ? WHERE id = ?",
+            (username, username)
+        )
+
+    def conversation_summaries(self) -> List[dict]:
+        summaries = []
+        for shard in self.shard_ids:
+            for user1, user2, count, last_message in self._connect(shard).execute(
+                "SELECT user1, user2, count(*), max(timestamp) FROM messages GROUP BY user1, user2"
+            ):
+                summaries.append({"users": [user1, user2], "last_message": last_message, "message_count": count})
+        return summaries
+
+    def file_urls(self):
+        for shard in self.shard_ids:
+            for file_url, in self._connect(shard).execute(
+                "SELECT file_url FROM messages WHERE file_url IS NOT NULL AND deleted_for_everyone = 0"
+            ):
+                yield file_url
+        yield from self.group_file_urls()
@@ -0,0 +1,526 @@
+"""
+SQLAlchemy storage engine over the database.py schema (SQLite locally,
+Postgres on Railway via DATABASE_URL).
+
+Messages reference users by id; usernames are resolved with one lookup per
+call (or a join) rather than one query per message row. Pure reads go
+through database.ReadSessionLocal (the replica with DATABASE_REPLICA_URL,
+else the read-only SQLite pool or the main engine) when replica_routing
+allows it, writes through SessionLocal. Months moved out of the
+messages table by message_archive.py are read back from MessageArchive,
+which also takes edits and deletes of archived messages. Paged reads
+(before/limit) only open archive files once they scroll past the messages
+table; unpaged reads, such as chat.html's poll, return a pair's whole
+archived history and so open every month file on each call, but only for
+pairs that have archived messages.
+"""
+
+import itertools
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+import attachment_gc
+import instrumentation
+import metrics
+import replica_routing
+from message_archive import MessageArchive
+from message_partitions import ensure_partitions
+from database import (SessionLocal, ReadSessionLocal, engine, read_engine, init_db, User, Message, OnlineUser,
+                      Group, GroupMember, GroupMessage, DATABASE_REPLICA_URL)
+from sessions import DatabaseSessionBackend
+from storage_engine import StorageEngine, ONLINE_TIMEOUT_SECONDS
+
+USER_FIELDS = ("password", "plain_password", "is_admin", "is_banned")
+
+
+def user_to_dict(user: User) -> dict:
+    return {
+        "username": user.username,
+        "password": user.password,
+        "plain_password": user.plain_password,
+        "is_admin": bool(user.is_admin),
+        "is_banned": bool(user.is_banned),
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+    }
+
+
+def message_to_dict(msg: Message, from_username: str, to_username: str) -> dict:
+    return {
+        "id": msg.id,
+        "from": from_username,
+        "to": to_username,
+        "message": msg.message,
+        "file_url": msg.file_url,
+        "file_name": msg.file_name,
+        "file_type": msg.file_type,
+        "timestamp": msg.timestamp.isoformat(),
+        "edited": msg.edited,
+        "deleted_for_everyone": msg.deleted_for_everyone
+    }
+
+
+def group_message_to_dict(msg: GroupMessage, from_username: str) -> dict:
+    return {
+        "id": msg.id,
+        "group_id": msg.group_id,
+        "from": from_username,
+        "message": msg.message,
+        "file_url": msg.file_url,
+        "file_name": msg.file_name,
+        "file_type": msg.file_type,
+        "timestamp": msg.timestamp.isoformat(),
+        "edited": msg.edited,
+        "deleted_for_everyone": msg.deleted_for_everyone
+    }
+
+
+class SqlStorage(StorageEngine):
+    name = "sql"
+
+    def __init__(self, session_factory=SessionLocal, db_engine=engine,
+                 read_session_factory=ReadSessionLocal, db_read_engine=read_engine, archive=None):
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.engine = db_engine
+        self.read_engine = db_read_engine
+        self.archive = archive or MessageArchive()
+
+    def init(self):
+        init_db()
+        print("✅ Database initialized!")
+        # A partitioned messages table (Postgres) needs next months' partitions in place
+        created = ensure_partitions(self.engine)
+        if created:
+            print(f"📅 Created message partitions: {', '.join(created)}")
+
+    def instrument(self):
+        # Queries per request, slow-query log (SLOW_QUERY_MS) and Server-Timing
+        instrumentation.instrument_engine(self.engine)
+        if self.read_engine is not self.engine:
+            instrumentation.instrument_engine(self.read_engine)
+
+    def session_backend(self):
+        # Sessions survive restarts and are shared between workers
+        return DatabaseSessionBackend(self.session_factory)
+
+    def install(self, app, request_metrics):
+        if DATABASE_REPLICA_URL and self.read_engine is not self.engine:
+            # Reads of clients that just wrote go to the primary (READ_YOUR_WRITES_SECONDS)
+            app.add_middleware(replica_routing.ReplicaRoutingMiddleware)
+            request_metrics.register_collector(metrics.replica_routing_samples(replica_routing))
+
+    @contextmanager
+    def _session(self, read_only: bool = False):
+        if not read_only:
+            replica_routing.pin_primary()
+        use_read_pool = read_only and replica_routing.use_replica()
+        db = (self.read_session_factory if use_read_pool else self.session_factory)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _user_ids(db, usernames: Iterable[str]) -> Dict[str, int]:
+        return dict(db.query(User.username, User.id).filter(User.username.in_(list(usernames))).all())
+
+    @staticmethod
+    def _usernames(db, user_ids: Iterable[int]) -> Dict[int, str]:
+        return dict(db.query(User.id, User.username).filter(User.id.in_(list(user_ids))).all())
+
+    def _message_dict(self, db, msg: Message) -> dict:
+        names = self._usernames(db, {msg.from_user_id, msg.to_user_id})
+        return message_to_dict(msg, names.get(msg.from_user_id), names.get(msg.to_user_id))
+
+    # ----- users -----
+
+    def get_user(self, username: str) -> Optional[dict]:
+        with self._session(read_only=True) as db:
+            user = db.query(User).filter(User.username == username).first()
+            return user_to_dict(user) if user else None
+
+    def existing_usernames(self, usernames: Iterable[str]) -> set:
+        with self._session(read_only=True) as db:
+            return set(self._user_ids(db, usernames))
+
+    def create_user(self, username: str, password_hash: str, plain_password: str) -> bool:
+        with self._session() as db:
+            db.add(User(
+                username=username,
+                password=password_hash,
+                plain_password=plain_password,  # Remove in production
+                is_admin=False
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another signup took the name while we were hashing
+                db.rollback()
+                return False
+        return True
+
+    def update_user(self, username: str, **fields) -> bool:
+        with self._session() as db:
+            user = db.query(User).filter(User.username == username).first()
+            if not user:
+                return False
+            for field, value in fields.items():
+                if field not in USER_FIELDS:
+                    raise ValueError(f"Unknown user field {field!r}")
+                setattr(user, field, value)
+            db.commit()
+        return True
+
+    def list_users(self) -> List[dict]:
+        with self._session(read_only=True) as db:
+            return [user_to_dict(user) for user in db.query(User).all()]
+
+    def search_users(self, query: str, limit: int) -> List[str]:
+        with self._session(read_only=True) as db:
+            users = db.query(User.username).filter(
+                User.username.ilike(f"%{query}%"),
+                User.is_banned == False
+            ).limit(limit).all()
+            return [username for username, in users]
+
+    def banned_usernames(self) -> List[str]:
+        with self._session(read_only=True) as db:
+            return [username for username, in db.query(User.username).filter(User.is_banned == True).all()]
+
+    # ----- presence -----
+
+    def set_online(self, username: str):
+        with self._session() as db:
+            user_id = db.query(User.id).filter(User.username == username).scalar()
+            if user_id is None:
+                return
+            online_user = db.query(OnlineUser).filter(OnlineUser.user_id == user_id).first()
+            if online_user:
+                online_user.last_heartbeat = datetime.utcnow()
+            else:
+                db.add(OnlineUser(user_id=user_id, last_heartbeat=datetime.utcnow()))
+            try:
+                db.commit()
+            except IntegrityError:
+                # A concurrent heartbeat inserted the row first; its timestamp is as good as ours
+                db.rollback()
+
+    def set_offline(self, username: str):
+        with self._session() as db:
+            online_user = db.query(OnlineUser).join(User).filter(User.username == username).first()
+            if online_user:
+                db.delete(online_user)
+                db.commit()
+
+    def online_users(self, max_age_seconds: int = ONLINE_TIMEOUT_SECONDS) -> Dict[str, str]:
+        cutoff_time = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+        with self._session(read_only=True) as db:
+            rows = db.query(User.username, OnlineUser.last_heartbeat).join(OnlineUser).filter(
+                OnlineUser.last_heartbeat >= cutoff_time
+            ).all()
+            return {username: last_heartbeat.isoformat() for username, last_heartbeat in rows}
+
+    def last_seen(self, username: str) -> Optional[str]:
+        with self._session(read_only=True) as db:
+            last_heartbeat = db.query(OnlineUser.last_heartbeat).join(User).filter(
+                User.username == username
+            ).scalar()
+            return last_heartbeat.isoformat() if last_heartbeat else None
+
+    # ----- messages -----
+
+    def add_message(self, sender: str, recipient: str, text: str, file_url: Optional[str] = None,
+                    file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        with self._session() as db:
+            ids = self._user_ids(db, (sender, recipient))
+            new_message = Message(
+                id=str(uuid.uuid4()),
+                from_user_id=ids[sender],
+                to_user_id=ids[recipient],
+                message=text,
+                file_url=file_url,
+                file_name=file_name,
+                file_type=file_type,
+                timestamp=datetime.utcnow(),
+                edited=False,
+                deleted_for_sender=False,
+                deleted_for_receiver=False,
+                deleted_for_everyone=False
+            )
+            db.add(new_message)
+            db.commit()
+            return message_to_dict(new_message, sender, recipient)
+
+    def get_message(self, message_id: str) -> Optional[dict]:
+        with self._session(read_only=True) as db:
+            msg = db.query(Message).filter(Message.id == message_id).first()
+            if msg:
+                return self._message_dict(db, msg)
+        return self.archive.get_message(message_id)
+
+    def conversation(self, user1: str, user2: str, viewer: Optional[str] = None,
+                     before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        result = self._hot_conversation(user1, user2, viewer, before, limit)
+        if (limit is None or len(result) < limit) and self.archive.has_conversation(user1, user2):
+            # Scrolled past the messages table (or an unpaged read): continue in the archive
+            # from the oldest hot message
+            older_than = result[0]["timestamp"] if result else before
+            remaining = None if limit is None else limit - len(result)
+            result = self.archive.conversation(user1, user2, viewer, older_than, remaining) + result
+        return result
+
+    def _hot_conversation(self, user1: str, user2: str, viewer: Optional[str],
+                          before: Optional[str], limit: Optional[int]) -> List[dict]:
+        with self._session(read_only=True) as db:
+            ids = self._user_ids(db, (user1, user2))
+            if user1 not in ids or user2 not in ids:
+                return []
+            names = {user_id: username for username, user_id in ids.items()}
+            id1, id2 = ids[user1], ids[user2]
+
+            first_to_second = (Message.from_user_id == id1) & (Message.to_user_id == id2)
+            second_to_first = (Message.from_user_id == id2) & (Message.to_user_id == id1)
+            if viewer is None:
+                condition = first_to_second | second_to_first
+            else:
+                viewer_id = ids.get(viewer)
+                # The viewer's own messages hide with deleted_for_sender, the other side's with deleted_for_receiver
+                condition = (Message.deleted_for_everyone == False) & (
+                    (first_to_second & ((Message.deleted_for_sender == False) if viewer_id == id1
+                                        else (Message.deleted_for_receiver == False))) |
+                    (second_to_first & ((Message.deleted_for_sender == False) if viewer_id == id2
+                                        else (Message.deleted_for_receiver == False)))
+                )
+            query = db.query(Message).filter(condition)
+            if before is not None:
+                query = query.filter(Message.timestamp < datetime.fromisoformat(before))
+            if limit is None:
+                messages = query.order_by(Message.timestamp).all()
+            else:
+                messages = query.order_by(Message.timestamp.desc()).limit(limit).all()[::-1]
+            return [message_to_dict(msg, names[msg.from_user_id], names[msg.to_user_id]) for msg in messages]
+
+    def contacts(self, username: str) -> List[str]:
+        with self._session(read_only=True) as db:
+            user_id = db.query(User.id).filter(User.username == username).scalar()
+            if user_id is None:
+                return []
+            # Get all users this user has messaged with
+            contacts = db.query(User.username).distinct().join(
+                Message,
+                ((Message.from_user_id == user_id) & (Message.to_user_id == User.id)) |
+                ((Message.to_user_id == user_id) & (Message.from_user_id == User.id))
+            ).filter(User.username != username).all()
+            contacts = [contact for contact, in contacts]
+        # Conversations that only have archived messages left still count
+        archived = self.archive.contacts(username) - set(contacts)
+        return contacts + sorted(archived)
+
+    def _update_message(self, message_id: str, **fields) -> Optional[dict]:
+        with self._session() as db:
+            msg = db.query(Message).filter(Message.id == message_id).first()
+            if not msg:
+                return self.archive.update_message(message_id, **fields)
+            for field, value in fields.items():
+                setattr(msg, field, value)
+            db.commit()
+            return self._message_dict(db, msg)
+
+    def edit_message(self, message_id: str, text: str) -> Optional[dict]:
+        return self._update_message(message_id, message=text, edited=True)
+
+    def delete_for_everyone(self, message_id: str) -> Optional[dict]:
+        return self._update_message(message_id, deleted_for_everyone=True)
+
+    def delete_for_user(self, message_id: str, username: Optional[str]) -> Optional[dict]:
+        with self._session() as db:
+            msg = db.query(Message).filter(Message.id == message_id).first()
+            if not msg:
+                return self.archive.delete_for_user(message_id, username)
+            names = self._usernames(db, {msg.from_user_id, msg.to_user_id})
+            sender, receiver = names.get(msg.from_user_id), names.get(msg.to_user_id)
+            if username is None or username == sender:
+                msg.deleted_for_sender = True
+            if username is None or username == receiver:
+                msg.deleted_for_receiver = True
+            db.commit()
+            return message_to_dict(msg, sender, receiver)
+
+    def conversation_summaries(self) -> List[dict]:
+        with self._session(read_only=True) as db:
+            # One grouped query per direction, merged into unordered pairs here
+            rows = db.query(
+                Message.from_user_id, Message.to_user_id, func.count(Message.id), func.max(Message.timestamp)
+            ).group_by(Message.from_user_id, Message.to_user_id).all()
+            names = dict(db.query(User.id, User.username).all())
+        rows = [
+            (names[from_id], names[to_id], count, last_message.isoformat() if last_message else None)
+            for from_id, to_id, count, last_message in rows if from_id in names and to_id in names
+        ]
+
+        conversations = {}
+        for from_user, to_user, count, last_message in itertools.chain(rows, self.archive.pair_summaries()):
+            if not from_user or not to_user:
+                continue
+            pair = tuple(sorted([from_user, to_user]))
+            summary = conversations.setdefault(pair, {"users": list(pair), "message_count": 0, "last_message": None})
+            summary["message_count"] += count
+            if last_message and (summary["last_message"] is None or last_message > summary["last_message"]):
+                summary["last_message"] = last_message
+        return list(conversations.values())
+
+    def file_urls(self):
+        # Archived messages keep their attachments alive too
+        return itertools.chain(attachment_gc.db_file_urls(self.read_session_factory), self.archive.file_urls())
+
+    # ----- groups -----
+
+    def _group_dicts(self, db, groups: List[Group]) -> List[dict]:
+        # Members of every group in one query, not one per group
+        members: Dict[str, List[str]] = {group.id: [] for group in groups}
+        for group_id, username in db.query(GroupMember.group_id, User.username).join(
+            User, User.id == GroupMember.user_id
+        ).filter(GroupMember.group_id.in_(list(members))).all():
+            members[group_id].append(username)
+        creators = self._usernames(db, {group.created_by for group in groups})
+        return [
+            {
+                "id": group.id,
+                "name": group.name,
+                "created_by": creators.get(group.created_by),
+                "created_at": group.created_at.isoformat() if group.created_at else None,
+                "members": members[group.id],
+            }
+            for group in groups
+        ]
+
+    def create_group(self, name: str, creator: str, members: Iterable[str]) -> dict:
+        usernames = list(dict.fromkeys([creator, *members]))
+        with self._session() as db:
+            ids = self._user_ids(db, usernames)
+            now = datetime.utcnow()
+            group = Group(id=str(uuid.uuid4()), name=name, created_by=ids[creator], created_at=now)
+            db.add(group)
+            db.add_all([GroupMember(group_id=group.id, user_id=ids[username], joined_at=now, last_read_at=now)
+                        for username in usernames if username in ids])
+            db.commit()
+            return self._group_dicts(db, [group])[0]
+
+    def get_group(self, group_id: str) -> Optional[dict]:
+        with self._session(read_only=True) as db:
+            group = db.query(Group).filter(Group.id == group_id).first()
+            return self._group_dicts(db, [group])[0] if group else None
+
+    def user_groups(self, username: str) -> List[dict]:
+        with self._session(read_only=True) as db:
+            user_id = db.query(User.id).filter(User.username == username).scalar()
+            if user_id is None:
+                return []
+            cursors = dict(db.query(GroupMember.group_id, GroupMember.last_read_at).filter(
+                GroupMember.user_id == user_id
+            ).all())
+            if not cursors:
+                return []
+            # Unread counts for all the user's groups in one grouped query over (group_id, timestamp)
+            unread = dict(db.query(GroupMessage.group_id, func.count(GroupMessage.id)).join(
+                GroupMember, (GroupMember.group_id == GroupMessage.group_id) & (GroupMember.user_id == user_id)
+            ).filter(
+                GroupMessage.timestamp > GroupMember.last_read_at,
+                GroupMessage.from_user_id != user_id,
+                GroupMessage.deleted_for_everyone == False
+            ).group_by(GroupMessage.group_id).all())
+            member_counts = dict(db.query(GroupMember.group_id, func.count(GroupMember.user_id)).filter(
+                GroupMember.group_id.in_(list(cursors))
+            ).group_by(GroupMember.group_id).all())
+            groups = db.query(Group).filter(Group.id.in_(list(cursors))).all()
+            creators = self._usernames(db, {group.created_by for group in groups})
+            return [
+                {
+                    "id": group.id,
+                    "name": group.name,
+                    "created_by": creators.get(group.created_by),
+                    "created_at": group.created_at.isoformat() if group.created_at else None,
+                    "member_count": member_counts.get(group.id, 0),
+                    "unread": unread.get(group.id, 0),
+                    "last_read_at": cursors[group.id].isoformat() if cursors[group.id] else None,
+                }
+                for group in groups
+            ]
+
+    def add_group_members(self, group_id: str, usernames: Iterable[str]) -> bool:
+        with self._session() as db:
+            if db.query(Group.id).filter(Group.id == group_id).scalar() is None:
+                return False
+            ids = self._user_ids(db, usernames)
+            existing = {user_id for user_id, in db.query(GroupMember.user_id).filter(GroupMember.group_id == group_id)}
+            now = datetime.utcnow()
+            db.add_all([GroupMember(group_id=group_id, user_id=user_id, joined_at=now, last_read_at=now)
+                        for user_id in set(ids.values()) - existing])
+            db.commit()
+        return True
+
+    def remove_group_member(self, group_id: str, username: str) -> bool:
+        with self._session() as db:
+            user_id = db.query(User.id).filter(User.username == username).scalar()
+            removed = db.query(GroupMember).filter(
+                GroupMember.group_id == group_id, GroupMember.user_id == user_id
+            ).delete(synchronize_session=False)
+            db.commit()
+        return removed > 0
+
+    def add_group_message(self, group_id: str, sender: str, text: str, file_url: Optional[str] = None,
+                          file_name: Optional[str] = None, file_type: Optional[str] = None) -> dict:
+        with self._session() as db:
+            sender_id = db.query(User.id).filter(User.username == sender).scalar()
+            new_message = GroupMessage(
+                id=str(uuid.uuid4()),
+                group_id=group_id,
+                from_user_id=sender_id,
+                message=text,
+                file_url=file_url,
+                file_name=file_name,
+                file_type=file_type,
+                timestamp=datetime.utcnow(),
+                edited=False,
+                deleted_for_everyone=False
+            )
+            db.add(new_message)
+            db.commit()
+            return group_message_to_dict(new_message, sender)
+
+    def group_messages(self, group_id: str, before: Optional[str] = None,
+                       limit: Optional[int] = None) -> List[dict]:
+        with self._session(read_only=True) as db:
+            query = db.query(GroupMessage).filter(
+                GroupMessage.group_id == group_id, GroupMessage.deleted_for_everyone == False
+            )
+            if before is not None:
+                query = query.filter(GroupMessage.timestamp < datetime.fromisoformat(before))
+            if limit is None:
+                messages = query.order_by(GroupMessage.timestamp).all()
+            else:
+                messages = query.order_by(GroupMessage.timestamp.desc()).limit(limit).all()[::-1]
+            names = self._usernames(db, {msg.from_user_id for msg in messages})
+            return [group_message_to_dict(msg, names.get(msg.from_user_id)) for msg in messages]
+
+    def mark_group_read(self, group_id: str, username: str, up_to: str) -> Optional[str]:
+        with self._session() as db:
+            user_id = db.query(User.id).filter(User.username == username).scalar()
+            member = db.query(GroupMember).filter(
+                GroupMember.group_id == group_id, GroupMember.user_id == user_id
+            ).first()
+            if member is None:
+                return None
+            # The cursor only moves forward, and no further than the newest message
+            newest = db.query(func.max(GroupMessage.timestamp)).filter(GroupMessage.group_id == group_id).scalar()
+            if newest is not None:
+                up_to = min(datetime.fromisoformat(up_to), newest)
+                if member.last_read_at is None or up_to > member.last_read_at:
+                    member.last_read_at = up_to
+                    db.commit()
+            return member.last_read_at.isoformat() if member.last_read_at else None
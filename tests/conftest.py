@@ -0,0 +1,53 @@
+import importlib
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+# The server is a flat set of modules in the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+ENGINES = ["json", "memory", "sharded", "sql"]
+
+
+def fresh_import(name: str):
+    """Import a server module from scratch, so it picks up the current directory and environment"""
+    for module_name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.dirname(os.path.abspath(path)) == REPO_ROOT:
+            del sys.modules[module_name]
+    return importlib.import_module(name)
+
+
+def serve(engine: str, tmp_path, monkeypatch):
+    """chat_server on an empty data directory; yields (module, client)"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("STORAGE_ENGINE", engine)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/chatapp.db")
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    module = fresh_import("chat_server")
+    with TestClient(module.app) as client:
+        yield module, client
+
+
+@pytest.fixture(params=ENGINES)
+def server(request, tmp_path, monkeypatch):
+    """serve() with each storage engine"""
+    yield from serve(request.param, tmp_path, monkeypatch)
+
+
+@pytest.fixture
+def sql_server(tmp_path, monkeypatch):
+    yield from serve("sql", tmp_path, monkeypatch)
+
+
+def login(client: TestClient, *usernames: str, password: str = "pw12345") -> dict:
+    """Sign users up and return {username: auth headers}"""
+    headers = {}
+    for username in usernames:
+        client.post("/signup", json={"username": username, "password": password})
+        token = client.post("/login", json={"username": username, "password": password}).json()["token"]
+        headers[username] = {"Authorization": f"Bearer {token}"}
+    return headers
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import time
+
+from attachment_gc import AttachmentGC
+from blob_store import BlobStore
+
+MONTH_AGO = time.time() - 30 * 24 * 60 * 60
+
+
+def age(path):
+    os.utime(path, (MONTH_AGO, MONTH_AGO))
+
+
+def put(store, data: bytes, old: bool = True) -> str:
+    sha256 = hashlib.sha256(data).hexdigest()
+    tmp_path = store.temp_path()
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    store.commit(tmp_path, sha256, "x.png")
+    if old:
+        age(store.blob_path(sha256))
+    return sha256
+
+
+def test_orphans_are_deleted_and_live_files_kept(tmp_path):
+    store = BlobStore(str(tmp_path))
+    live, orphan, recent = put(store, b"live"), put(store, b"orphan"), put(store, b"recent", old=False)
+    store.add_ref(f"/chat_files/{live}.png", "m1")
+    legacy = tmp_path / "old_upload.txt"
+    legacy.write_bytes(b"legacy")
+    age(str(legacy))
+    abandoned = store.temp_path()
+    with open(abandoned, "wb") as f:
+        f.write(b"half an upload")
+    age(abandoned)
+
+    gc = AttachmentGC(store, lambda: [f"/chat_files/{live}.png"], batch_pause=0)
+    dry = gc.run(dry_run=True)
+    assert dry["orphaned"] == 3 and dry["deleted"] == 0 and store.exists(orphan)
+
+    report = gc.run()
+    assert report["deleted"] == 3 and report["skipped_recent"] == 1
+    assert store.exists(live) and store.exists(recent) and not store.exists(orphan)
+    assert not legacy.exists() and not os.path.exists(abandoned)
+
+
+def test_blobs_used_after_the_live_set_was_built_are_kept(tmp_path):
+    store = BlobStore(str(tmp_path))
+    claimed, reuploaded, referenced, orphan = (put(store, data) for data in (b"a", b"b", b"c", b"d"))
+
+    def file_urls():
+        # Nothing is live when the snapshot is taken; then, before the scan
+        # reaches them, three blobs get used again
+        yield from ()
+        assert store.claim(claimed, "y.png") is not None
+        put(store, b"b", old=False)
+        store.add_ref(f"/chat_files/{referenced}.png", "m1")
+
+    report = AttachmentGC(store, file_urls, batch_pause=0).run()
+    assert report["kept_on_recheck"] == 1 and report["skipped_recent"] == 2 and report["deleted"] == 1
+    assert store.exists(claimed) and store.exists(reuploaded) and store.exists(referenced)
+    assert not store.exists(orphan)
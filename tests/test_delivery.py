@@ -0,0 +1,39 @@
+import asyncio
+
+from fastapi import WebSocketDisconnect
+
+import delivery
+
+
+class FailingSocket:
+    def __init__(self, exc):
+        self.exc = exc
+
+    async def send_text(self, text):
+        raise self.exc
+
+
+def run_sender_with(exc):
+    hub = delivery.DeliveryHub()
+
+    async def scenario():
+        conn = hub.register("alice", asyncio.get_running_loop())
+        conn.enqueue(delivery.presence_event("bob", "online"))
+        await hub.run_sender(conn, FailingSocket(exc))
+        return conn
+
+    return hub, asyncio.run(scenario())
+
+
+def test_send_to_half_closed_socket_unregisters_connection():
+    for exc in (RuntimeError("closed"), OSError("reset"), WebSocketDisconnect(1006)):
+        hub, conn = run_sender_with(exc)
+        assert conn.closed
+        assert conn.close_reason.startswith("send failed")
+        assert not hub.is_connected("alice")
+        assert hub.metrics()["disconnects_for_send_error"] == 1
+
+
+def test_publish_after_send_failure_is_not_queued():
+    hub, conn = run_sender_with(RuntimeError("closed"))
+    assert hub.publish_to("alice", delivery.presence_event("bob", "offline")) == 0
@@ -0,0 +1,103 @@
+import hashlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from media_response import (IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, MediaFileResponse, etag_matches,
+                            parse_range)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes=0-0 ", (0, 0)),
+    # Ignored: serve the whole file
+    ("bytes=0-1,5-6", None),
+    ("bytes=-", None),
+    ("items=0-1", None),
+    ("garbage", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5-4", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+def test_etag_matches_weakly():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', 'W/"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+
+
+DATA = bytes(range(256)) * 4
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "blob"
+    path.write_bytes(DATA)
+    app = FastAPI()
+
+    @app.get("/blob")
+    def blob(request: Request):
+        return MediaFileResponse(str(path), request.headers, content_hash=SHA256, immutable=True,
+                                 media_type="video/mp4")
+
+    @app.get("/legacy")
+    def legacy(request: Request):
+        return MediaFileResponse(str(path), request.headers, filename="clip.mp4")
+
+    return TestClient(app)
+
+
+def test_full_and_partial_content(client):
+    r = client.get("/blob")
+    assert r.status_code == 200 and r.content == DATA
+    assert r.headers["etag"] == f'"{SHA256}"'
+    assert r.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert r.headers["accept-ranges"] == "bytes" and r.headers["content-type"] == "video/mp4"
+
+    r = client.get("/blob", headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206 and r.content == DATA[100:200]
+    assert r.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    assert r.headers["content-length"] == "100"
+
+    r = client.get("/blob", headers={"Range": "bytes=-10"})
+    assert r.status_code == 206 and r.content == DATA[-10:]
+
+
+def test_unsatisfiable_range_is_416(client):
+    r = client.get("/blob", headers={"Range": f"bytes={len(DATA)}-"})
+    assert r.status_code == 416 and r.content == b""
+    assert r.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_conditional_requests(client):
+    etag = client.get("/blob").headers["etag"]
+    r = client.get("/blob", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+    assert client.get("/blob", headers={"If-None-Match": '"other"'}).status_code == 200
+
+    legacy = client.get("/legacy")
+    assert legacy.headers["etag"].startswith('W/"') and legacy.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert legacy.headers["content-disposition"] == 'attachment; filename="clip.mp4"'
+    r = client.get("/legacy", headers={"If-Modified-Since": legacy.headers["last-modified"]})
+    assert r.status_code == 304 and "content-disposition" not in r.headers
+    assert client.get("/legacy", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}).status_code == 200
+
+    # If-Range: a stale validator gets the whole file instead of a range of different bytes
+    r = client.get("/blob", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert r.status_code == 206 and r.content == DATA[:10]
+    r = client.get("/blob", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == DATA
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from conftest import login
+
+
+def test_archived_messages_are_read_paged_and_unpaged(sql_server):
+    chat_server, client = sql_server
+    import database
+    import message_archive
+
+    headers = login(client, "alice", "bobby", "carol")
+    ids = []
+    for i in range(3):
+        r = client.post("/send_message", json={"from_user": "alice", "to_user": "bobby", "message": f"old {i}"},
+                        headers=headers["alice"])
+        ids.append(r.json()["id"])
+    client.post("/send_message", json={"from_user": "bobby", "to_user": "alice", "message": "new"},
+                headers=headers["bobby"])
+    client.post("/send_message", json={"from_user": "alice", "to_user": "carol", "message": "hot only"},
+                headers=headers["alice"])
+    with database.SessionLocal() as db:
+        for i, message_id in enumerate(ids):
+            db.query(database.Message).filter(database.Message.id == message_id).update(
+                {"timestamp": datetime(2020, 1, 5 + i)})
+        db.commit()
+    message_archive.archive_old_messages(database.engine, chat_server.storage.archive)
+    assert chat_server.storage.archive.months() == [datetime(2020, 1, 1)]
+
+    def texts(user, other, **params):
+        r = client.get(f"/get_messages/{user}/{other}", params=params, headers=headers[user])
+        return [m["message"] for m in r.json()["messages"]]
+
+    assert texts("bobby", "alice") == ["old 0", "old 1", "old 2", "new"]
+    assert texts("bobby", "alice", limit=2) == ["old 2", "new"]
+    assert texts("bobby", "alice", limit=2, before="2020-01-07T00:00:00") == ["old 0", "old 1"]
+    assert texts("alice", "carol") == ["hot only"]
+    assert not chat_server.storage.archive.has_conversation("alice", "carol")
+
+    # Edits and deletes reach archived rows
+    assert client.put(f"/edit_message/{ids[0]}", json={"message": "edited"}, headers=headers["alice"]).status_code == 200
+    assert client.delete(f"/delete_message/{ids[1]}/me", headers=headers["bobby"]).status_code == 200
+    assert texts("bobby", "alice") == ["edited", "old 2", "new"]
+    assert texts("alice", "bobby") == ["edited", "old 1", "old 2", "new"]
@@ -0,0 +1,56 @@
+from conftest import login
+
+
+def send(client, headers, sender, to, text):
+    r = client.post("/send_message", json={"from_user": sender, "to_user": to, "message": text},
+                    headers=headers[sender])
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def texts(client, headers, user, other):
+    r = client.get(f"/get_messages/{user}/{other}", headers=headers[user])
+    return [m["message"] for m in r.json()["messages"]]
+
+
+def test_anonymous_delete_is_rejected(server):
+    _, client = server
+    headers = login(client, "alice", "bobby")
+    message_id = send(client, headers, "alice", "bobby", "hi")
+
+    for delete_type in ("everyone", "me"):
+        r = client.delete(f"/delete_message/{message_id}/{delete_type}")
+        assert r.status_code == 401
+    assert texts(client, headers, "alice", "bobby") == ["hi"]
+    assert texts(client, headers, "bobby", "alice") == ["hi"]
+
+
+def test_only_sender_deletes_for_everyone(server):
+    _, client = server
+    headers = login(client, "alice", "bobby", "carol")
+    message_id = send(client, headers, "alice", "bobby", "hi")
+
+    assert client.delete(f"/delete_message/{message_id}/everyone", headers=headers["bobby"]).status_code == 403
+    # A body username without a session still has to be the sender
+    r = client.request("DELETE", f"/delete_message/{message_id}/everyone", json={"username": "bobby"})
+    assert r.status_code == 403
+    # And a session cannot claim someone else's name in the body
+    r = client.request("DELETE", f"/delete_message/{message_id}/everyone", json={"username": "alice"},
+                       headers=headers["bobby"])
+    assert r.status_code == 403
+    assert client.delete(f"/delete_message/{message_id}/me", headers=headers["carol"]).status_code == 403
+    assert texts(client, headers, "bobby", "alice") == ["hi"]
+
+    assert client.delete(f"/delete_message/{message_id}/everyone", headers=headers["alice"]).status_code == 200
+    assert texts(client, headers, "bobby", "alice") == []
+
+
+def test_delete_for_me_hides_only_for_that_user(server):
+    _, client = server
+    headers = login(client, "alice", "bobby")
+    message_id = send(client, headers, "alice", "bobby", "hi")
+
+    r = client.request("DELETE", f"/delete_message/{message_id}/me", json={"username": "bobby"})
+    assert r.status_code == 200
+    assert texts(client, headers, "bobby", "alice") == []
+    assert texts(client, headers, "alice", "bobby") == ["hi"]
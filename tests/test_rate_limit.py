@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from rate_limit import MemoryBackend, RateLimiter, RateLimitMiddleware
+
+
+def test_token_bucket_allows_burst_then_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    backend = MemoryBackend()
+
+    assert [backend.take("k", 2.0, 3)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = backend.take("k", 2.0, 3)
+    assert not allowed and retry_after == 0.5
+    # Other keys have their own bucket
+    assert backend.take("other", 2.0, 3)[0]
+
+    now[0] += 0.5
+    assert backend.take("k", 2.0, 3)[0]
+    assert not backend.take("k", 2.0, 3)[0]
+    now[0] += 60
+    assert [backend.take("k", 2.0, 3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def make_app(backend, limits):
+    limiter = RateLimiter(identify=lambda request: request.headers.get("x-user"), backend=backend,
+                          limits=limits, enabled=True)
+    app = FastAPI()
+
+    @app.post("/send", dependencies=[Depends(limiter.limit("message"))])
+    def send():
+        return {"ok": True}
+
+    @app.post("/upload")
+    def upload():
+        return {"ok": True}
+
+    limiter.limit_route("POST", "/upload", "upload")
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    return TestClient(app), limiter
+
+
+def test_dependency_and_middleware_answer_429_per_user():
+    client, limiter = make_app(MemoryBackend(), {"message": ((0.001, 2), 8), "upload": ((0.001, 1), 8)})
+    codes = [client.post("/send", headers={"x-user": "alice"}).status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    assert client.post("/send", headers={"x-user": "bob"}).status_code == 200
+
+    assert client.post("/upload", headers={"x-user": "alice"}).status_code == 200
+    r = client.post("/upload", headers={"x-user": "alice"})
+    assert r.status_code == 429 and int(r.headers["retry-after"]) >= 1
+    assert limiter.stats()["classes"]["message"]["rejected"] == 1
+    assert limiter.stats()["classes"]["message"]["in_flight"] == 0
+
+
+class SlowBackend:
+    """Stands in for Redis: take() blocks its thread"""
+
+    blocking = True
+
+    def __init__(self):
+        self.threads = set()
+
+    def take(self, key, rate, burst, cost=1.0):
+        self.threads.add(threading.get_ident())
+        time.sleep(0.2)
+        return True, 0.0
+
+
+def test_blocking_backend_does_not_stall_event_loop():
+    backend = SlowBackend()
+    limiter = RateLimiter(backend=backend, limits={"message": ((1.0, 10), 8)}, enabled=True)
+
+    class Client:
+        host = "10.0.0.1"
+
+    class Conn:
+        client = Client()
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        assert await limiter._admit("message", Conn()) is None
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+    assert threading.get_ident() not in backend.threads
+
+
+def test_backend_errors_let_requests_through_and_are_counted():
+    class BrokenBackend:
+        blocking = False
+
+        def take(self, key, rate, burst, cost=1.0):
+            raise ConnectionError("redis down")
+
+    client, limiter = make_app(BrokenBackend(), {"message": ((1.0, 1), 8), "upload": ((1.0, 1), 8)})
+    assert [client.post("/send").status_code for _ in range(3)] == [200, 200, 200]
+    assert limiter.stats()["backend_errors"] == 3 and limiter.stats()["backend_failing"]
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from resumable_uploads import ResumableUploadStore, create_resumable_router, fcntl
+
+
+def make_client(tmp_path):
+    store = ResumableUploadStore(str(tmp_path))
+    committed = {}
+
+    def commit_file(path, sha256, file_name, content_type):
+        dest = os.path.join(str(tmp_path), sha256)
+        shutil.move(path, dest)
+        committed[sha256] = dest
+        return {"file_url": f"/chat_files/{sha256}", "file_name": file_name, "file_type": content_type}
+
+    app = FastAPI()
+    app.include_router(create_resumable_router(store, commit_file, lambda sha256, name, ctype: None))
+    return TestClient(app), store, committed
+
+
+def test_chunked_upload_round_trip(tmp_path):
+    client, store, committed = make_client(tmp_path)
+    data = os.urandom(3000)
+    upload = client.post("/uploads", json={"file_name": "a.bin", "total_size": len(data)}).json()
+    upload_id = upload["upload_id"]
+
+    r = client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=data[:1000])
+    assert r.headers["Upload-Offset"] == "1000"
+    r = client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=data[1000:])
+    assert r.status_code == 409 and r.headers["Upload-Offset"] == "1000"
+    r = client.put(f"/uploads/{upload_id}", params={"offset": 1000}, content=data[1000:],
+                   headers={"X-Chunk-SHA256": "0" * 64})
+    assert r.status_code == 422
+    client.put(f"/uploads/{upload_id}", params={"offset": 1000}, content=data[1000:],
+               headers={"X-Chunk-SHA256": hashlib.sha256(data[1000:]).hexdigest()})
+
+    r = client.post(f"/uploads/{upload_id}/finalize")
+    sha256 = hashlib.sha256(data).hexdigest()
+    assert r.json()["file_url"] == f"/chat_files/{sha256}"
+    with open(committed[sha256], "rb") as f:
+        assert f.read() == data
+    assert store._locks == {} and store._lock_users == {}
+
+
+def test_unknown_upload_ids_do_not_leave_locks(tmp_path):
+    client, store, _ = make_client(tmp_path)
+    for upload_id in ("deadbeef", "0" * 32, "not-hex"):
+        assert client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=b"x").status_code == 404
+        assert client.post(f"/uploads/{upload_id}/finalize").status_code == 404
+    assert store._locks == {} and store._lock_users == {}
+
+
+@pytest.mark.skipif(fcntl is None, reason="needs fcntl")
+def test_chunk_waits_for_another_workers_lock(tmp_path):
+    client, store, _ = make_client(tmp_path)
+    upload_id = client.post("/uploads", json={"file_name": "a.bin", "total_size": 10}).json()["upload_id"]
+    results = []
+
+    # Another worker holds the upload: same file, different open file description
+    with open(store._data_path(upload_id), "rb") as held:
+        fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+        writer = threading.Thread(target=lambda: results.append(
+            client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=b"0123456789")))
+        writer.start()
+        writer.join(0.5)
+        assert writer.is_alive()
+    writer.join(5)
+    assert results[0].status_code == 200 and results[0].headers["Upload-Offset"] == "10"
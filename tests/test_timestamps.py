@@ -0,0 +1,82 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture(autouse=True)
+def local_time_ahead_of_utc(monkeypatch):
+    # UTC+5:30, so local and UTC wall clocks differ by more than a few minutes
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_message_timestamps_are_utc_and_before_accepts_offsets(server):
+    _, client = server
+    headers = login(client, "alice", "bobby")
+    assert datetime.now() - datetime.utcnow() > timedelta(hours=5)
+
+    sent_at = datetime.now(timezone.utc)
+    client.post("/send_message", json={"from_user": "alice", "to_user": "bobby", "message": "hi"},
+                headers=headers["alice"])
+    message = client.get("/get_messages/bobby/alice", headers=headers["bobby"]).json()["messages"][0]
+    stamped = datetime.fromisoformat(message["timestamp"])
+    assert stamped.tzinfo is None
+    assert abs(stamped - sent_at.replace(tzinfo=None)) < timedelta(minutes=1)
+
+    def count(before):
+        r = client.get("/get_messages/bobby/alice", params={"before": before, "limit": 50}, headers=headers["bobby"])
+        assert r.status_code == 200, r.text
+        return len(r.json()["messages"])
+
+    a_minute_ago = sent_at - timedelta(minutes=1)
+    in_a_minute = sent_at + timedelta(minutes=1)
+    # The same instants written in local time, UTC with an offset, and naive UTC
+    assert count(in_a_minute.astimezone().isoformat()) == 1
+    assert count(in_a_minute.isoformat()) == 1
+    assert count(in_a_minute.replace(tzinfo=None).isoformat()) == 1
+    assert count(a_minute_ago.astimezone().isoformat()) == 0
+    assert count(a_minute_ago.replace(tzinfo=None).isoformat()) == 0
+    assert client.get("/get_messages/bobby/alice", params={"before": "yesterday"},
+                      headers=headers["bobby"]).status_code == 400
+
+
+def test_group_read_cursor_in_local_time(server):
+    _, client = server
+    headers = login(client, "alice", "bobby")
+    group_id = client.post("/create_group", json={"name": "g", "creator": "alice", "members": ["bobby"]},
+                           headers=headers["alice"]).json()["group"]["id"]
+
+    def send(text):
+        client.post("/send_group_message", json={"group_id": group_id, "from_user": "alice", "message": text},
+                    headers=headers["alice"])
+
+    def unread():
+        groups = client.get("/get_groups/bobby", headers=headers["bobby"]).json()["groups"]
+        return groups[0]["unread"]
+
+    def mark_read(up_to):
+        r = client.post("/mark_group_read", json={"group_id": group_id, "username": "bobby", "up_to": up_to},
+                        headers=headers["bobby"])
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    send("one")
+    assert unread() == 1
+    # "Now" in local time covers the message just sent
+    mark_read(datetime.now().astimezone().isoformat())
+    assert unread() == 0
+
+    # A cursor far in the future is clamped to the newest message, so later messages still count
+    mark_read((datetime.now(timezone.utc) + timedelta(days=365)).isoformat())
+    send("two")
+    assert unread() == 1
+
+    # A cursor never moves back
+    mark_read("2000-01-01T00:00:00Z")
+    assert unread() == 1
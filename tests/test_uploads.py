@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from uploads import InvalidUpload, UploadTooLarge, receive_upload
+
+MAX_SIZE = 1000
+
+
+def make_client(tmp_path):
+    app = FastAPI()
+    dest_path = os.path.join(str(tmp_path), "upload")
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        try:
+            received = await receive_upload(request, dest_path, max_size=MAX_SIZE, chunk_size=64)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidUpload as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"filename": received.filename, "content_type": received.content_type,
+                "size": received.size, "sha256": received.sha256}
+
+    return TestClient(app), dest_path
+
+
+def multipart_body(data: bytes, field_name: str = "file", boundary: str = "b0undary") -> bytes:
+    return (f"--{boundary}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\nhello\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field_name}\"; filename=\"a.bin\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+
+
+def chunked(body: bytes, size: int = 100):
+    # A generator body is sent without Content-Length, so only the streamed size can be checked
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+HEADERS = {"Content-Type": "multipart/form-data; boundary=b0undary"}
+
+
+def test_file_part_is_streamed_to_disk_with_its_hash(tmp_path):
+    client, dest_path = make_client(tmp_path)
+    data = os.urandom(MAX_SIZE)
+    r = client.post("/upload", content=chunked(multipart_body(data)), headers=HEADERS)
+    assert r.json() == {"filename": "a.bin", "content_type": "application/octet-stream",
+                        "size": MAX_SIZE, "sha256": hashlib.sha256(data).hexdigest()}
+    with open(dest_path, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(str(tmp_path)) == ["upload"]
+
+
+def test_oversized_uploads_are_rejected_and_leave_nothing(tmp_path):
+    client, dest_path = make_client(tmp_path)
+    body = multipart_body(os.urandom(MAX_SIZE + 1))
+    # Announced size within the multipart allowance, so the limit trips while streaming
+    assert client.post("/upload", content=body, headers=HEADERS).status_code == 413
+    assert client.post("/upload", content=chunked(body), headers=HEADERS).status_code == 413
+
+    # Announced size over the limit: rejected before the body is read
+    r = client.post("/upload", content=chunked(body),
+                    headers={**HEADERS, "Content-Length": str(10 * 1024 * 1024)})
+    assert r.status_code == 413
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_malformed_uploads_are_rejected(tmp_path):
+    client, _ = make_client(tmp_path)
+    assert client.post("/upload", content=b"{}", headers={"Content-Type": "application/json"}).status_code == 400
+    assert client.post("/upload", content=multipart_body(b"x", field_name="other"), headers=HEADERS).status_code == 400
+    truncated = multipart_body(b"x" * 100)[:-40]
+    assert client.post("/upload", content=truncated, headers=HEADERS).status_code == 400
+    assert os.listdir(str(tmp_path)) == []
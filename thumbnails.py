@@ -0,0 +1,232 @@
+"""
+Background thumbnail and preview pipeline for image and video messages.
+
+After an upload lands, derive_previews runs in a process pool (resizing is
+CPU-bound and would otherwise hold the GIL in the web workers). For every
+image - and for videos, a frame grabbed with ffmpeg when it is installed -
+it writes:
+
+- JPEG thumbnails at each of THUMBNAIL_SIZES (longest edge, in pixels)
+- meta.json with the original dimensions and a tiny blurred placeholder
+  as a data: URI, small enough to inline in the upload response
+
+Results are cached on disk in a "<original>.previews" directory next to the
+original file, so they are computed once per stored blob. Pillow is
+optional; without it no previews are produced and clients fall back to the
+original file.
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import importlib.util
+import io
+import json
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Dict, Optional
+
+THUMBNAIL_SIZES = (160, 480, 960)
+PLACEHOLDER_SIZE = 16
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+# How long an upload response waits for previews before returning without dimensions
+PREVIEW_WAIT_SECONDS = float(os.getenv("PREVIEW_WAIT_SECONDS", "2"))
+
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+FFMPEG_PATH = shutil.which("ffmpeg")
+
+
+def previews_dir(original_path: str) -> str:
+    return original_path + ".previews"
+
+
+def thumbnail_path(original_path: str, size: int) -> str:
+    return os.path.join(previews_dir(original_path), f"{size}.jpg")
+
+
+def guess_file_type(filename: str) -> Optional[str]:
+    content_type = mimetypes.guess_type(filename)[0] or ""
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type.startswith("video/"):
+        return "video"
+    return None
+
+
+def can_preview(file_type: Optional[str]) -> bool:
+    if not PILLOW_AVAILABLE:
+        return False
+    if file_type == "image":
+        return True
+    return file_type == "video" and FFMPEG_PATH is not None
+
+
+def load_meta(original_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(previews_dir(original_path), "meta.json"), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# ----- worker process side -----
+
+def _extract_video_frame(video_path: str, frame_path: str) -> bool:
+    result = subprocess.run(
+        [FFMPEG_PATH or "ffmpeg", "-y", "-loglevel", "error", "-ss", "1", "-i", video_path,
+         "-frames:v", "1", frame_path],
+        capture_output=True,
+        timeout=60,
+    )
+    if result.returncode != 0 or not os.path.exists(frame_path):
+        # Clips shorter than a second: take the very first frame instead
+        result = subprocess.run(
+            [FFMPEG_PATH or "ffmpeg", "-y", "-loglevel", "error", "-i", video_path,
+             "-frames:v", "1", frame_path],
+            capture_output=True,
+            timeout=60,
+        )
+    return result.returncode == 0 and os.path.exists(frame_path)
+
+
+def derive_previews(original_path: str, file_type: str, sizes=THUMBNAIL_SIZES) -> Optional[dict]:
+    """Build thumbnails and meta.json for one file. Runs in a pool worker."""
+    from PIL import Image, ImageFilter, ImageOps
+
+    out_dir = previews_dir(original_path)
+    meta = load_meta(original_path)
+    if meta is not None:
+        return meta
+
+    work_dir = tempfile.mkdtemp(prefix="previews-", dir=os.path.dirname(original_path))
+    try:
+        source = original_path
+        if file_type == "video":
+            source = os.path.join(work_dir, "frame.jpg")
+            if not _extract_video_frame(original_path, source):
+                return None
+
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            width, height = img.size
+            if img.mode not in ("RGB", "L"):
+                # Flatten transparency onto white, JPEG has no alpha
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                rgba = img.convert("RGBA")
+                background.paste(rgba, mask=rgba.split()[-1])
+                img = background
+
+            generated = []
+            for size in sizes:
+                # thumbnail() never upscales, so small originals keep their size
+                thumb = img.copy()
+                thumb.thumbnail((size, size), Image.LANCZOS)
+                thumb.save(os.path.join(work_dir, f"{size}.jpg"), "JPEG", quality=80, optimize=True, progressive=True)
+                generated.append(size)
+
+            tiny = img.copy()
+            tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+            buf = io.BytesIO()
+            tiny.save(buf, "JPEG", quality=50)
+            placeholder = "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+        if file_type == "video":
+            os.remove(source)
+
+        meta = {
+            "width": width,
+            "height": height,
+            "sizes": generated,
+            "placeholder": placeholder,
+        }
+        with open(os.path.join(work_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        # Publish atomically; a concurrent worker may have won the race
+        try:
+            os.rename(work_dir, out_dir)
+        except OSError:
+            pass
+        return meta
+    except Exception:
+        return None
+    finally:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# ----- web process side -----
+
+class PreviewPipeline:
+    """Process pool running derive_previews, with one in-flight job per file"""
+
+    def __init__(self, workers: int = PREVIEW_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, concurrent.futures.Future] = {}
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the web process has threads and an event loop
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def submit(self, original_path: str, file_type: str) -> Optional[concurrent.futures.Future]:
+        if not can_preview(file_type):
+            return None
+        with self._lock:
+            job = self._jobs.get(original_path)
+            if job is not None:
+                return job
+            if load_meta(original_path) is not None:
+                done = concurrent.futures.Future()
+                done.set_result(load_meta(original_path))
+                return done
+            job = self._get_executor().submit(derive_previews, original_path, file_type)
+            self._jobs[original_path] = job
+        job.add_done_callback(lambda _: self._forget(original_path))
+        return job
+
+    def _forget(self, original_path: str):
+        with self._lock:
+            self._jobs.pop(original_path, None)
+
+    async def wait(self, original_path: str, file_type: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Previews for a file, deriving them if needed. None if unavailable or still running."""
+        job = self.submit(original_path, file_type)
+        if job is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except Exception:
+            return None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def preview_payload(meta: Optional[dict], thumbnail_url) -> dict:
+    """Upload-response fields for a file's previews; thumbnail_url(size) builds a URL"""
+    payload = {"thumbnails": {str(size): thumbnail_url(size) for size in THUMBNAIL_SIZES}}
+    if meta:
+        payload["width"] = meta["width"]
+        payload["height"] = meta["height"]
+        payload["placeholder"] = meta["placeholder"]
+    return payload
+
+
+pipeline = PreviewPipeline()
@@ -0,0 +1,190 @@
+"""
+Streaming upload helpers shared by main.py and main_with_db.py.
+
+Upload endpoints take the raw request instead of an UploadFile: the
+multipart body is parsed as it arrives and the file part is written
+straight to disk, so nothing is spooled to a temporary file first and the
+size limit is enforced as bytes arrive. A Content-Length that is already
+over the limit is rejected before any of the body is read. Disk writes and
+hashing run in the threadpool so the event loop stays free, and the SHA-256
+of the content is computed in the same pass.
+"""
+
+import hashlib
+import os
+from typing import List, Optional
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    # python-multipart before 0.0.13
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# 200MB, the limit chat.html advertises for attachments
+MAX_CHAT_FILE_SIZE = 200 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Room for boundaries, part headers and small form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_size: int):
+        super().__init__(f"Upload exceeds {max_size} bytes")
+        self.max_size = max_size
+
+
+class InvalidUpload(Exception):
+    """The body is not a multipart form carrying the expected file"""
+
+
+class ReceivedFile:
+    __slots__ = ("filename", "content_type", "size", "sha256")
+
+    def __init__(self, filename: str, content_type: Optional[str], size: int, sha256: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so this is cheap to offload
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _decode(value: bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+class _FilePartReader:
+    """python-multipart callbacks that keep only the data of one file field"""
+
+    def __init__(self, field_name: str, max_size: Optional[int]):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.size = 0
+        self.complete = False
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._in_file = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = _decode(options.get(b"name", b""))
+        # The first part of the expected field that carries a file name; other fields are skipped
+        if name == self.field_name and b"filename" in options and self.filename is None:
+            self.filename = _decode(options[b"filename"])
+            content_type = self._headers.get(b"content-type")
+            self.content_type = _decode(content_type) if content_type else None
+            self._in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._in_file:
+            return
+        self.size += end - start
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        self.pending.append(data[start:end])
+        self.pending_size += end - start
+
+    def on_part_end(self):
+        if self._in_file:
+            self.complete = True
+            self._in_file = False
+
+    def take_pending(self) -> bytes:
+        data = b"".join(self.pending)
+        self.pending, self.pending_size = [], 0
+        return data
+
+
+async def receive_upload(request: Request, dest_path: str, field_name: str = "file",
+                         max_size: Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_SIZE) -> ReceivedFile:
+    """
+    Parse a multipart/form-data request body and stream its file field to
+    dest_path. Returns the file's name, content type, size and SHA-256.
+
+    The data is written to a temporary ``.part`` file and moved into place
+    only once it is complete, so readers never see a half-written file.
+    Raises UploadTooLarge if max_size is exceeded and InvalidUpload for a
+    malformed body or a missing file; either way nothing is left on disk.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidUpload("Expected a multipart/form-data body")
+    # Reject before reading anything when the client announces an oversized body
+    content_length = request.headers.get("content-length", "")
+    if max_size is not None and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge(max_size)
+
+    reader = _FilePartReader(field_name, max_size)
+    parser = MultipartParser(params[b"boundary"], reader.callbacks())
+    part_path = dest_path + ".part"
+    hasher = hashlib.sha256()
+    f = await run_in_threadpool(open, part_path, "wb")
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except FormParserError as e:
+                raise InvalidUpload(f"Malformed multipart body: {e}")
+            # Network reads are small; write in chunk_size pieces
+            if reader.pending_size >= chunk_size:
+                await run_in_threadpool(_write_chunk, f, hasher, reader.take_pending())
+        if not reader.complete:
+            raise InvalidUpload(f"No complete '{field_name}' file in the upload")
+        await run_in_threadpool(_write_chunk, f, hasher, reader.take_pending())
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, part_path, dest_path)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(_discard, part_path)
+        raise
+
+    return ReceivedFile(reader.filename, reader.content_type, reader.size, hasher.hexdigest())